@@ -0,0 +1,340 @@
+import functools
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+import inference_engine as engine
+from heatmap_format import new_heatmap_grid, save_heatmap, load_heatmap_sources, NODATA
+from tile_pipeline import iter_prepared_tiles, NUM_READER_THREADS
+
+# ====================================================================
+#  INFERENCJA ADAPTACYJNA (OD ZGRUBNEJ SIATKI DO PEŁNEJ) Z LIMITEM CZASU
+# ====================================================================
+#
+#  Zamiast oceniać każdy kafelek ROI na TARGET_LEVEL, dzielimy siatkę na bloki
+#  COARSE_STRIDE x COARSE_STRIDE i oceniamy jeden kafelek tkanki na blok
+#  (najbliższy środka). Potem drzewem czwórkowym dzielimy tylko bloki, których
+#  wynik różni się od sąsiadów o więcej niż REFINE_DELTA albo leży po drugiej
+#  stronie progu 0.5 - najpierw te z największą niezgodnością. Reszta kafelków
+#  dostaje wartość swojego bloku (interpolacja stałą w liściu drzewa).
+#
+#  time_budget (sekundy) ogranicza czas całego przebiegu: po jego upływie
+#  zapisujemy najlepszą dostępną heatmapę. Płaszczyzna źródeł .hmap mówi,
+#  które kafelki ocenił model, a które są interpolowane (heatmap_format.py).
+#
+#  Użycie: python adaptive_inference.py [resnet|mobilenet] [limit_sekund]
+
+MODEL_NAME = "resnet"
+COARSE_STRIDE = 8       # Bok bloku startowego w kafelkach (potęga 2)
+REFINE_DELTA = 0.2      # Różnica P(tumor) z sąsiadem, od której blok jest dzielony
+TIME_BUDGET = None      # Limit czasu w sekundach (None = bez limitu)
+BATCH_SIZE = 16         # Mniejsze paczki = dokładniejsze trzymanie się limitu czasu
+
+INTERPOLATED = "interpolated"   # Nazwa źródła dla kafelków bez własnej predykcji
+
+
+def adaptive_output_path(spec):
+    """Plik heatmapy adaptacyjnej obok pełnej (…_heatmap.hmap -> …_heatmap_adaptive.hmap)."""
+    root, ext = os.path.splitext(spec.output_path)
+    return f"{root}_adaptive{ext}"
+
+
+def initial_blocks(candidate_grid, stride):
+    """Bloki (row, col, bok) siatki startowej, które zawierają choć jednego kandydata."""
+    rows, cols = candidate_grid.shape
+    return [(row, col, stride) for row in range(0, rows, stride) for col in range(0, cols, stride)
+            if candidate_grid[row:row + stride, col:col + stride].any()]
+
+
+def split_block(candidate_grid, block):
+    """Cztery ćwiartki bloku (bez pustych)."""
+    row, col, size = block
+    half = size // 2
+    children = [(row + dr, col + dc, half) for dr in (0, half) for dc in (0, half)]
+    return [(r, c, s) for r, c, s in children if candidate_grid[r:r + s, c:c + s].any()]
+
+
+def representative(candidate_grid, block, excluded):
+    """Kandydat najbliższy środka bloku (row, col) z pominięciem excluded albo None."""
+    row, col, size = block
+    rr, cc = np.nonzero(candidate_grid[row:row + size, col:col + size] & ~excluded[row:row + size, col:col + size])
+    if len(rr) == 0:
+        return None
+    centre = (size - 1) / 2
+    i = int(np.argmin((rr - centre) ** 2 + (cc - centre) ** 2))
+    return row + int(rr[i]), col + int(cc[i])
+
+
+def disagreement(leaves, values, shape):
+    """
+    Dla każdego liścia: największa różnica P(tumor) z sąsiednim liściem (+1, gdy są
+    po różnych stronach progu 0.5). Liście bez wartości nie mają wpływu.
+    """
+    leaf_grid = np.full(shape, -1, dtype=np.int64)
+    for i, (row, col, size) in enumerate(leaves):
+        leaf_grid[row:row + size, col:col + size] = i
+    scores = np.zeros(len(leaves))
+    for i, (row, col, size) in enumerate(leaves):
+        if np.isnan(values[i]):
+            continue
+        ring = leaf_grid[max(row - 1, 0):row + size + 1, max(col - 1, 0):col + size + 1]
+        neighbours = np.unique(ring[(ring >= 0) & (ring != i)])
+        neighbour_values = values[neighbours]
+        neighbour_values = neighbour_values[~np.isnan(neighbour_values)]
+        if len(neighbour_values):
+            crossing = (neighbour_values > 0.5) != (values[i] > 0.5)
+            scores[i] = np.max(np.abs(neighbour_values - values[i]) + crossing)
+    return scores
+
+
+def fill_unscored(values, leaves):
+    """Liście bez żadnej wartości (limit czasu w pierwszej rundzie) - wartość najbliższego ocenionego."""
+    known = ~np.isnan(values)
+    if known.all() or not known.any():
+        return values
+    centres = np.array([(row + size / 2, col + size / 2) for row, col, size in leaves])
+    missing = np.nonzero(~known)[0]
+    known_idx = np.nonzero(known)[0]
+    distances = ((centres[missing, None, :] - centres[None, known_idx, :]) ** 2).sum(axis=2)
+    values = values.copy()
+    values[missing] = values[known_idx[np.argmin(distances, axis=1)]]
+    return values
+
+
+def run_adaptive(model_name=MODEL_NAME, time_budget=TIME_BUDGET, output_path=None, coarse_stride=COARSE_STRIDE,
+                 refine_delta=REFINE_DELTA, batch_size=BATCH_SIZE, num_workers=NUM_READER_THREADS,
+                 norm_mode=engine.NORM_MODE, model=None, device=None, scan=None, polygons=None, progress=None):
+    """
+    Heatmapa modelu z rejestru liczona od zgrubnej siatki do pełnej rozdzielczości tam,
+    gdzie sąsiednie predykcje się różnią. Po time_budget sekund przerywa i zapisuje to,
+    co ma (z interpolacją). Model, skan i poligony można przekazać z zewnątrz.
+    progress(ocenione, kandydaci) - opcjonalny callback. Zwraca ścieżkę heatmapy lub None.
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + time_budget if time_budget else None
+    if coarse_stride < 1 or coarse_stride & (coarse_stride - 1):
+        raise ValueError(f"coarse_stride musi być potęgą 2 (jest {coarse_stride}).")
+
+    spec = engine.MODEL_REGISTRY[model_name]
+    output_path = output_path or adaptive_output_path(spec)
+    budget_text = f"limit {time_budget} s" if time_budget else "bez limitu czasu"
+    print(f"Rozpoczynam inferencję adaptacyjną ({spec.label}, blok startowy {coarse_stride}, {budget_text})...")
+
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if model is None:
+        model = spec.load(device)
+    if polygons is None:
+        polygons = engine.parse_xml_annotations(engine.PATH_TO_XML)
+    if not polygons:
+        print("BŁĄD: Nie znaleziono żadnych poligonów w XML. Przerywam.")
+        return None
+    if scan is None:
+        try:
+            scan = engine.open_scan(engine.PATH_TO_SCAN)
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się otworzyć pliku SVS. Błąd: {e}")
+            return None
+    slide, tiles_gen = scan
+    level = engine.TARGET_LEVEL
+    cols, rows = tiles_gen.level_tiles[level]
+
+    _, candidate_coords = engine.candidate_tiles(slide, tiles_gen, polygons)
+    candidate_grid = np.zeros((rows, cols), dtype=bool)
+    for col, row in candidate_coords:
+        candidate_grid[row, col] = True
+
+    stain_params = engine.slide_stain_params(tiles_gen, candidate_coords) if norm_mode == "slide" else None
+    prepare = functools.partial(engine.prepare_tiles, input_sizes=[spec.input_size], stain_params=stain_params)
+
+    scores = new_heatmap_grid(cols, rows)          # Predykcje modelu (NaN = nieoceniony)
+    failed = np.zeros((rows, cols), dtype=bool)    # Odrzucone przy przygotowaniu (brak tkanki, Macenko)
+    leaves = initial_blocks(candidate_grid, coarse_stride)
+    reps = {}            # Liść -> oceniany kafelek (row, col)
+    inherited = {}       # Liść -> wartość rodzica (dopóki liść nie ma własnej)
+    # Liść -> niezgodność rodzica (kolejność oceniania w rundzie). Bloki startowe w losowej
+    # kolejności, żeby przy limicie czasu w pierwszej rundzie pokrycie było równomierne.
+    priority = dict(zip(leaves, np.random.default_rng(0).random(len(leaves)) - 1.0))
+    # Pomiar czasu do limitu: czekanie na potok na wczytany kafelek (średnia) i model
+    # na oceniony kafelek (ostatnia paczka - pierwsza zawiera rozgrzewkę modelu)
+    pipeline_seconds, read_tiles = 0.0, 0
+    model_tile, scored_tiles = 0.0, 0
+    out_of_time = False
+    rounds = 0
+
+    def leaf_value(leaf):
+        rep = reps.get(leaf)
+        if rep is not None and not np.isnan(scores[rep]):
+            return float(scores[rep])
+        return inherited.get(leaf, np.nan)
+
+    def score(coords):
+        """
+        Ocena kafelków paczkami. Po każdej paczce z potoku sprawdza, czy gotowe kafelki
+        i choć jeden następny zdążą przed końcem limitu (czas end-to-end: odczyt, Macenko
+        i model); jeśli nie, ocenia tyle gotowych, ile się zmieści, i zwraca False.
+        """
+        nonlocal pipeline_seconds, read_tiles, model_tile, scored_tiles
+        batch_coords, batch_inputs = [], []
+        pending = set()      # Współrzędne z batch_coords (szybkie sprawdzanie przynależności)
+
+        def seconds_left(n_ready, n_next):
+            """Zapas limitu po ocenie n_ready gotowych kafelków i odczycie + ocenie n_next następnych."""
+            left = deadline - time.perf_counter()
+            if not scored_tiles:
+                return left      # Jeszcze bez pomiaru - dostarczy go pierwszy kafelek
+            read_tile = pipeline_seconds / max(read_tiles, 1)
+            return left - n_ready * model_tile - n_next * (read_tile + model_tile)
+
+        def fitting(n):
+            """Ile z n gotowych kafelków zdąży się ocenić przed końcem limitu."""
+            if deadline is None:
+                return n
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                return 0
+            return n if not scored_tiles else min(n, int(left / model_tile))
+
+        def flush(n):
+            nonlocal model_tile, scored_tiles
+            coords, inputs = batch_coords[:n], batch_inputs[:n]
+            del batch_coords[:n], batch_inputs[:n]
+            pending.difference_update(coords)
+            batch_start = time.perf_counter()
+            probs = engine.predict_batch(model, inputs, device)
+            model_tile = (time.perf_counter() - batch_start) / n
+            scored_tiles += n
+            for (row, col), p in zip(coords, probs):
+                scores[row, col] = p
+            if progress is not None:
+                progress(int(np.count_nonzero(~np.isnan(scores))), len(candidate_coords))
+
+        def flush_fitting():
+            """Ocenia gotowe kafelki, które mieszczą się w limicie; True, gdy wszystkie."""
+            n = fitting(len(batch_inputs))
+            if n:
+                flush(n)
+            return not batch_inputs
+
+        remaining = len(coords)
+        with torch.no_grad():
+            tiles = iter_prepared_tiles(tiles_gen, level, coords, prepare, num_workers=num_workers, deadline=deadline)
+            wait_start = time.perf_counter()
+            for chunk, ready in tiles:
+                # Czas czekania na potok na wczytaną współrzędną (odczyt + Macenko, ponad model)
+                pipeline_seconds += time.perf_counter() - wait_start
+                read_tiles += len(chunk)
+                remaining -= len(chunk)
+                for col, row, inputs in ready:
+                    batch_coords.append((row, col))
+                    batch_inputs.append(inputs[spec.input_size])
+                    pending.add((row, col))
+                for col, row in chunk:
+                    if np.isnan(scores[row, col]) and (row, col) not in pending:
+                        failed[row, col] = True
+
+                # Pełne paczki - tyle kafelków, ile się mieści (pomiar poprawia się z każdą).
+                # Bez pomiaru czasu od razu jeden kafelek: najmniejsze możliwe przekroczenie limitu
+                while len(batch_inputs) >= batch_size or (batch_inputs and not scored_tiles):
+                    n = fitting(min(batch_size if scored_tiles or deadline is None else 1, len(batch_inputs)))
+                    if not n:
+                        return False
+                    flush(n)
+
+                # Czy po gotowych kafelkach zmieści się choć jeden następny (odczyt + model).
+                # Odczytu dalszych pilnuje deadline w potoku - czytelnicy stają po jego upływie.
+                if deadline is not None and remaining and seconds_left(len(batch_inputs), 1) < 0:
+                    flush_fitting()
+                    return False
+                wait_start = time.perf_counter()
+        return flush_fitting() and remaining == 0
+
+    while leaves and not out_of_time:
+        rounds += 1
+        # --- Ocena liści bez własnej predykcji (najpierw te o największej niezgodności rodzica) ---
+        while True:
+            pending = []
+            for leaf in leaves:
+                rep = reps.get(leaf)
+                if rep is None or failed[rep]:
+                    reps[leaf] = rep = representative(candidate_grid, leaf, failed)
+                if rep is not None and np.isnan(scores[rep]):
+                    pending.append(leaf)
+            leaves = [leaf for leaf in leaves if reps[leaf] is not None]
+            if not pending:
+                break
+            pending.sort(key=lambda leaf: -priority.get(leaf, 0.0))
+            coords = list(dict.fromkeys((reps[leaf][1], reps[leaf][0]) for leaf in pending))
+            if not score(coords):
+                out_of_time = True
+                break
+        if out_of_time:
+            break
+
+        # --- Podział liści niezgodnych z sąsiadami ---
+        values = np.array([leaf_value(leaf) for leaf in leaves], dtype=np.float64)
+        disagreements = disagreement(leaves, values, (rows, cols))
+        to_split = {i for i, (leaf, d) in enumerate(zip(leaves, disagreements))
+                    if leaf[2] > 1 and d > refine_delta}
+        if not to_split:
+            break
+        new_leaves = []
+        for i, leaf in enumerate(leaves):
+            if i not in to_split:
+                new_leaves.append(leaf)
+                continue
+            for child in split_block(candidate_grid, leaf):
+                row, col, size = child
+                rep = reps[leaf]
+                if row <= rep[0] < row + size and col <= rep[1] < col + size:
+                    reps[child] = rep   # Ćwiartka z kafelkiem rodzica nie potrzebuje nowej predykcji
+                inherited[child] = values[i]
+                priority[child] = disagreements[i]
+                new_leaves.append(child)
+        leaves = new_leaves
+
+    # --- Heatmapa: predykcje modelu + wartości liści dla pozostałych kafelków ---
+    values = fill_unscored(np.array([leaf_value(leaf) for leaf in leaves], dtype=np.float64), leaves)
+    grid = new_heatmap_grid(cols, rows)
+    for (row, col, size), value in zip(leaves, values):
+        cells = candidate_grid[row:row + size, col:col + size] & ~failed[row:row + size, col:col + size]
+        grid[row:row + size, col:col + size][cells] = value
+    scored = ~np.isnan(scores)
+    grid[scored] = scores[scored]
+    source_grid = np.where(scored, 0, 1).astype(np.uint8)   # 0 = model, 1 = interpolacja
+
+    total_time = time.perf_counter() - start_time
+    n_scored, n_filled = int(scored.sum()), int(np.count_nonzero(~np.isnan(grid)))
+    print(f"\nAnaliza adaptacyjna zakończona w {total_time:.2f} s "
+          f"({rounds} rund{', przerwana limitem czasu' if out_of_time else ''}).")
+    print(f"Model ocenił {n_scored} z {len(candidate_coords)} kandydatów "
+          f"({n_scored / max(len(candidate_coords), 1):.1%}), interpolowano {n_filled - n_scored}.")
+
+    try:
+        save_heatmap(output_path, grid, level, engine.TILE_SIZE, tiles_gen.level_dimensions[level],
+                     model=spec.name, sources=[spec.name, INTERPOLATED], source_grid=source_grid)
+        print(f"Pomyślnie zapisano heatmapę adaptacyjną {spec.label} w: {output_path}")
+    except Exception as e:
+        print(f"BŁĄD: Nie udało się zapisać pliku heatmapy. Błąd: {e}")
+        return None
+    return output_path
+
+
+def scored_fraction(path):
+    """Odsetek kafelków heatmapy adaptacyjnej ocenionych przez model (reszta interpolowana)."""
+    loaded = load_heatmap_sources(path)
+    if loaded is None:
+        return 1.0   # Bez płaszczyzny źródeł (np. pełna heatmapa) - każdy kafelek ocenił model
+    sources, source_grid = loaded
+    if INTERPOLATED not in sources:
+        return 1.0
+    present = source_grid != NODATA
+    return float(np.count_nonzero(present & (source_grid != sources.index(INTERPOLATED))) / max(present.sum(), 1))
+
+
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else MODEL_NAME
+    time_budget = float(sys.argv[2]) if len(sys.argv) > 2 else TIME_BUDGET
+    run_adaptive(model_name, time_budget)
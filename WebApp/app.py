@@ -1,7 +1,43 @@
-from flask import Flask, render_template, jsonify, request
-import subprocess
+from flask import Flask, render_template, jsonify, request, abort, Response, stream_with_context
+from werkzeug.security import safe_join
+import gzip
+import json
+import math
+import os
+import threading
+
+from inference_worker import InferenceWorker, HEATMAP_TYPES, MODEL_REGISTRY
+from adaptive_inference import scored_fraction
+from heatmap_jobs import JobManager, DONE, ERROR
+from heatmap_format import HEATMAP_EXT
+from heatmap_tiles import get_pyramid
+
 app = Flask(__name__)
 
+# Modele, skan i poligony trzymane w pamięci serwera między żądaniami
+worker = InferenceWorker()
+# Zadania generowania heatmap w tle (postęp odpytywany przez /api/heatmap_jobs/<id>)
+jobs = JobManager(worker.generate)
+
+HEATMAP_MESSAGES = {
+    'resnet': "Wygenerowano heatmapę ResNet.",
+    'mobilenet': "Wygenerowano heatmapę MobileNet.",
+    'truth': "Wygenerowano heatmapę Eksperta.",
+    'models': "Wygenerowano heatmapy modeli.",
+}
+
+@app.after_request
+def compress_heatmap(response):
+    """Pliki .hmap wysyłamy skompresowane gzip (dużo pustych/powtarzalnych kafelków)."""
+    if (request.path.endswith(HEATMAP_EXT) and response.status_code == 200
+            and "gzip" in request.headers.get("Accept-Encoding", "")):
+        response.direct_passthrough = False
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -10,101 +46,179 @@ def home():
 def scan():
      return render_template("scan.html")
 
+def heatmap_urls(path):
+    """Adres pliku .hmap i jego piramidy DZI (/heatmap_dzi/<ścieżka bez .hmap>.dzi)."""
+    url_path = path.replace(os.sep, "/")
+    return {"heatmap_path": "/" + url_path,
+            "dzi_path": "/heatmap_dzi/" + url_path[:-len(HEATMAP_EXT)] + ".dzi"}
+
+def job_response(job):
+    """
+    Stan zadania dla przeglądarki; po zakończeniu z adresami heatmapy. Wspólne
+    zadanie modeli zwraca adresy każdej heatmapy w "heatmaps": {typ: {...}}.
+    """
+    data = job.to_dict()
+    if job.status == DONE:
+        data["message"] = HEATMAP_MESSAGES[job.heatmap_type]
+        if isinstance(job.result, dict):
+            data["heatmaps"] = {heatmap_type: {"message": HEATMAP_MESSAGES[heatmap_type], **heatmap_urls(path)}
+                                for heatmap_type, path in job.result.items()}
+        else:
+            data.update(heatmap_urls(job.result))
+    return data
+
+def cached_response(heatmap_type, path):
+    """Odpowiedź jak dla zakończonego zadania, ale bez zlecania go."""
+    return {"success": True, "type": heatmap_type, "status": DONE, "cached": True,
+            "message": HEATMAP_MESSAGES[heatmap_type], **heatmap_urls(path)}
+
+def heatmap_pyramid_or_404(stem):
+    """Piramida dla static/<...>.hmap; inne ścieżki (np. '..') -> 404."""
+    path = safe_join(".", stem + HEATMAP_EXT)
+    if path is None or not stem.startswith("static/") or not os.path.isfile(path):
+        abort(404)
+    return get_pyramid(path)
+
+@app.route('/heatmap_dzi/<path:stem>.dzi')
+def heatmap_dzi(stem):
+    pyramid = heatmap_pyramid_or_404(stem)
+    return Response(pyramid.dzi_xml(), mimetype="application/xml")
+
+@app.route('/heatmap_dzi/<path:stem>_files/<int:level>/<int:col>_<int:row>.png')
+def heatmap_dzi_tile(stem, level, col, row):
+    png = heatmap_pyramid_or_404(stem).render_tile(level, col, row)
+    if png is None:
+        abort(404)
+    response = Response(png, mimetype="image/png")
+    # Pliki w cache są adresowane treścią - kafelek pod danym adresem się nie zmienia
+    if stem.startswith("static/heatmap_cache/"):
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route('/api/heatmap_jobs', methods=['POST'])
+def submit_heatmap_job():
+
+    data = request.get_json(silent=True) or {}
+    heatmap_type = data.get('type')
+
+    print(f"Otrzymano zlecenie heatmapy typu: {heatmap_type}")
+
+    if heatmap_type not in HEATMAP_TYPES:
+        return jsonify({"success": False, "message": "Nieznany typ"}), 400
+
+    # Gotowa heatmapa z cache - bez kolejki zadań
+    cached_path = worker.cached(heatmap_type)
+    if cached_path is not None:
+        return jsonify(cached_response(heatmap_type, cached_path))
+
+    job, created = jobs.submit(worker.job_key(heatmap_type), worker.job_type(heatmap_type))
+    if not created:
+        print(f"Heatmapa '{heatmap_type}' już się generuje - dołączam do zadania {job.id}.")
+    return jsonify({"success": True, **job_response(job)}), 202
+
+@app.route('/api/heatmap_jobs/<job_id>', methods=['GET'])
+def heatmap_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Nieznane zadanie"}), 404
+    return jsonify({"success": True, **job_response(job)})
+
+STREAM_KEEPALIVE_SECONDS = 15   # Najdłuższa przerwa między zdarzeniami (proxy nie zamyka połączenia)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/heatmap_jobs/<job_id>/stream')
+def heatmap_job_stream(job_id):
+    """
+    Server-Sent Events z wynikami częściowymi zadania:
+      header - opis siatki (jak nagłówek .hmap, "models" = modele zadania),
+      tiles  - paczka [[col, row, p_uint8], ...] jednego modelu ("model") + postęp,
+      progress - sam postęp,
+      done / error - koniec (done zawiera adresy gotowej heatmapy).
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Nieznane zadanie"}), 404
+
+    def tile_events(chunks):
+        by_model = {}
+        for model, chunk in chunks:
+            by_model.setdefault(model, []).extend(chunk)
+        for model, tiles in by_model.items():
+            yield sse_event("tiles", {"model": model, "tiles": tiles, **job.to_dict()})
+
+    def events():
+        yield sse_event("header", worker.grid_header(job.heatmap_type))
+        seen = 0
+        while True:
+            new_chunks = job.wait_for_update(seen, timeout=STREAM_KEEPALIVE_SECONDS)
+            status = job.status
+            if new_chunks:
+                seen += len(new_chunks)
+                yield from tile_events(new_chunks)
+            elif status in (DONE, ERROR):
+                # Paczki dopisane po timeoucie wait_for_update, a przed zmianą stanu - przed zdarzeniem końcowym
+                yield from tile_events(job.wait_for_update(seen, timeout=0))
+                yield sse_event("done" if status == DONE else "error", job_response(job))
+                return
+            else:
+                # Sam postęp (np. paczki bez tkanki) - służy też jako keepalive
+                yield sse_event("progress", job.to_dict())
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @app.route('/api/generate_heatmap', methods=['POST'])
 def generate_heatmap_api():
+    """
+    Wersja synchroniczna (czeka na wynik) - przez tę samą kolejkę zadań. Z "time_budget"
+    (sekundy) heatmapa modelu jest liczona adaptacyjnie i gotowa w tym czasie, jeśli
+    pełnej nie ma jeszcze w cache ("scored_fraction" = odsetek kafelków ocenionych przez model).
+    """
 
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     heatmap_type = data.get('type')
 
     print(f"Otrzymano żądanie wygenerowania heatmapy typu: {heatmap_type}")
 
-    try:
-        if heatmap_type == 'resnet':
-
-            result = subprocess.run(
-                ['python', 'run_inference_resnet.py'], 
-                capture_output=True, text=True, timeout=60, check=True
-            )
-
-            print("="*40)
-            print(">>> LOGI Z PODPROCESU (run_inference_resnet.py) <<<")
-            print(result.stdout)  # <--- To wypisze czas i liczbę kafelków!
-            print("="*40)
-            
-            # Jeśli były jakieś błędy/ostrzeżenia, też je pokaż:
-            if result.stderr:
-                print(">>> BŁĘDY/OSTRZEŻENIA <<<")
-                print(result.stderr)
-
-            # Zwracamy ścieżkę do pliku, który ten skrypt właśnie stworzył
-            return jsonify({
-                "success": True, 
-                "message": "Wygenerowano heatmapę ResNet.",
-                "json_path": "/static/scans/breast_scan2_MODEL_heatmap.json"
-            })
-            
-        elif heatmap_type == 'truth':
-       
-            result = subprocess.run(
-                ['python', 'generate_truth_json.py'], 
-                capture_output=True, text=True, timeout=60, check=True
-            )
-
-            print("="*40)
-            print(">>> LOGI Z PODPROCESU (run_inference.py) <<<")
-            print(result.stdout)  # <--- To wypisze czas i liczbę kafelków!
-            print("="*40)
-            
-            # Jeśli były jakieś błędy/ostrzeżenia, też je pokaż:
-            if result.stderr:
-                print(">>> BŁĘDY/OSTRZEŻENIA <<<")
-                print(result.stderr)
-
-
-            return jsonify({
-                "success": True, 
-                "message": "Wygenerowano heatmapę Eksperta.",
-                "json_path": "/static/scans/breast_scan2_TRUTH_heatmap.json"
-            })
-        
-        elif heatmap_type == 'mobilenet':
-            print("Uruchamiam skrypt MobileNet...")
- 
-            result = subprocess.run(
-                ['python', 'run_inference_mobilenet.py'], 
-                capture_output=True, text=True, timeout=300, check=True 
-            )
-
-            print("="*40)
-            print(">>> LOGI Z PODPROCESU (run_inference_resnet.py) <<<")
-            print(result.stdout)  # <--- To wypisze czas i liczbę kafelków!
-            print("="*40)
-            
-            # Jeśli były jakieś błędy/ostrzeżenia, też je pokaż:
-            if result.stderr:
-                print(">>> BŁĘDY/OSTRZEŻENIA <<<")
-                print(result.stderr)
-
-                
-            return jsonify({
-                "success": True, 
-                "message": "Wygenerowano heatmapę MobileNet.",
-        
-                "json_path": "/static/scans/breast_scan2_MODEL_MOBILENET_heatmap.json"
-            })
-        
-        else:
-            return jsonify({"success": False, "message": "Nieznany typ"}), 400
-
-    except subprocess.TimeoutExpired:
-        print("BŁĄD: Generowanie trwało zbyt długo (timeout)")
-        return jsonify({"success": False, "message": "Błąd: Generowanie trwało zbyt długo (timeout)"}), 500
-    except subprocess.CalledProcessError as e:
-        print(f"BŁĄD: Skrypt Pythona zwrócił błąd: {e.stderr}")
-        return jsonify({"success": False, "message": f"Błąd serwera: {e.stderr}"}), 500
-    except Exception as e:
-        print(f"BŁĄD: {e}")
-        return jsonify({"success": False, "message": f"Błąd: {e}"}), 500
-    
+    if heatmap_type not in HEATMAP_TYPES:
+        return jsonify({"success": False, "message": "Nieznany typ"}), 400
+
+    cached_path = worker.cached(heatmap_type)
+    if cached_path is not None:
+        return jsonify(cached_response(heatmap_type, cached_path))
+
+    time_budget = data.get('time_budget')
+    if time_budget is not None and heatmap_type in MODEL_REGISTRY:
+        try:
+            time_budget = float(time_budget)
+        except (TypeError, ValueError):
+            time_budget = 0.0
+        if not math.isfinite(time_budget) or time_budget <= 0:   # float() przyjmuje też "nan" i "inf"
+            return jsonify({"success": False, "message": "Niepoprawny limit czasu"}), 400
+        try:
+            path = worker.generate_adaptive(heatmap_type, time_budget)
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Błąd: {e}"}), 500
+        return jsonify({"success": True, "adaptive": True, "scored_fraction": scored_fraction(path),
+                        "message": HEATMAP_MESSAGES[heatmap_type].rstrip(".") + " (tryb adaptacyjny).",
+                        **heatmap_urls(path)})
+
+    job, _ = jobs.submit(worker.job_key(heatmap_type), worker.job_type(heatmap_type))
+    job.future.result()
+
+    if job.status != DONE:
+        return jsonify({"success": False, "message": f"Błąd: {job.error}"}), 500
+    path = job.result[heatmap_type] if isinstance(job.result, dict) else job.result
+    return jsonify({"success": True, "message": HEATMAP_MESSAGES[heatmap_type],
+                    **heatmap_urls(path)})
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Wczytaj modele od razu - tylko w procesie, który obsługuje żądania
+    # (w trybie debug reloader Flaska uruchamia dodatkowy proces-obserwatora)
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        threading.Thread(target=worker.warm_up, daemon=True).start()
+    app.run(debug=True)
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+import inference_engine as engine
+from heatmap_format import load_heatmap
+from sharded_inference import run_sharded
+
+try:
+    import tifffile
+except ImportError:           # tifffile jest potrzebny tylko do skanu syntetycznego
+    tifffile = None
+
+# ====================================================================
+#  BENCHMARK: inferencja w 1 procesie vs shardy na N procesach
+# ====================================================================
+#
+#  Liczy heatmapę skanu z konfiguracji silnika (PATH_TO_SCAN, TARGET_LEVEL)
+#  raz zwykłym run_inference() i dla każdej liczby procesów z SHARD_COUNTS
+#  przez run_sharded(). Wypisuje czas, kafelki/s i przyspieszenie oraz
+#  sprawdza, czy połączona heatmapa jest taka sama jak z jednego procesu.
+#  Tryb "synthetic" nie potrzebuje prywatnego .svs: generuje piramidalny TIFF
+#  z plamami tkanki, XML z poligonami i losowe wagi modelu w OUTPUT_DIR
+#  (wymaga pakietu tifffile). Przyspieszenie ma sens tylko przy kilku rdzeniach -
+#  na jednym rdzeniu shardy płacą za start procesów i nic nie zyskują.
+#
+#  Użycie: python benchmark_sharded.py [resnet|mobilenet] [svs|synthetic]
+
+SHARD_COUNTS = sorted({1, 2, 4, os.cpu_count() or 1})
+OUTPUT_DIR = "benchmark_output"
+
+# Skan syntetyczny: rozmiar poziomu 0, plamy tkanki (x, y, promień) i ziarno
+SYNTHETIC_SIZE = (8192, 6144)
+SYNTHETIC_BLOBS = [(2000, 2000, 1200), (5600, 3500, 1600), (3300, 4800, 800)]
+SYNTHETIC_SEED = 0
+STAIN_VECTORS = np.array([[0.65, 0.70, 0.29], [0.07, 0.99, 0.11]])   # OD hematoksyliny i eozyny
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _polygon_xml(polygons):
+    graphics = []
+    for description, (cx, cy, r) in polygons:
+        angles = np.linspace(0, 2 * np.pi, 48, endpoint=False)
+        points = "".join(f"<point>{cx + r * np.cos(a):.1f},{cy + r * np.sin(a):.1f}</point>" for a in angles)
+        graphics.append(f'<graphic type="polygon" description="{description}"><point-list>{points}</point-list></graphic>')
+    return f'<?xml version="1.0"?><session><overlays>{"".join(graphics)}</overlays></session>'
+
+
+def make_synthetic_slide(folder, model_type, size=SYNTHETIC_SIZE, seed=SYNTHETIC_SEED):
+    """
+    Piramidalny TIFF (czytany przez OpenSlide), XML z poligonami wokół plam tkanki
+    i losowe wagi modelu w folderze. Ustawia PATH_TO_SCAN, PATH_TO_XML, TARGET_LEVEL
+    i wagi w rejestrze silnika - shardy dostają je przez konfigurację i rejestr.
+    """
+    if tifffile is None:
+        raise RuntimeError("Skan syntetyczny wymaga pakietu tifffile (pip install tifffile).")
+    os.makedirs(folder, exist_ok=True)
+    scan_path = os.path.join(folder, "synthetic.tiff")
+    xml_path = os.path.join(folder, "synthetic.session.xml")
+    spec = engine.MODEL_REGISTRY[model_type]
+    weights_path = os.path.join(folder, f"synthetic_{model_type}.pth")
+
+    if not os.path.isfile(scan_path):
+        rng = np.random.default_rng(seed)
+        width, height = size
+        image = np.full((height, width, 3), 242, dtype=np.uint8)
+        yy, xx = np.ogrid[:height, :width]
+        for cx, cy, r in SYNTHETIC_BLOBS:
+            inside = (xx - cx) ** 2 + (yy - cy) ** 2 < r * r
+            n = int(inside.sum())
+            od = (rng.random(n) ** 3 * 1.5)[:, None] * STAIN_VECTORS[0] + (rng.random(n) * 0.8)[:, None] * STAIN_VECTORS[1]
+            image[inside] = np.clip(240 * np.exp(-od), 0, 255).astype(np.uint8)
+        tmp_path = scan_path + ".tmp"
+        with tifffile.TiffWriter(tmp_path) as tiff:
+            level = image
+            while True:
+                tiff.write(level, tile=(256, 256), photometric="rgb", compression="zlib",
+                           subfiletype=0 if level is image else 1)
+                if min(level.shape[:2]) < 2 * 256:
+                    break
+                level = level[::2, ::2]
+        os.replace(tmp_path, scan_path)
+
+    with open(xml_path, "w") as f:
+        f.write(_polygon_xml([("Cellularity: 40", (cx, cy, 0.9 * r)) for cx, cy, r in SYNTHETIC_BLOBS]))
+    if not os.path.isfile(weights_path):
+        torch.manual_seed(seed)
+        torch.save(spec.build().state_dict(), weights_path)
+
+    engine.PATH_TO_SCAN, engine.PATH_TO_XML = scan_path, xml_path
+    _, tiles_gen = engine.open_scan(scan_path)
+    engine.TARGET_LEVEL = tiles_gen.level_count - 1
+    spec.weights = weights_path
+
+
+def main(model_type="resnet", source="svs"):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if source == "synthetic":
+        make_synthetic_slide(os.path.join(OUTPUT_DIR, "synthetic"), model_type)
+    print(f"Benchmark shardów ({model_type}) na {os.cpu_count()} rdzeniach, skan: {engine.PATH_TO_SCAN}")
+    if (os.cpu_count() or 1) == 1:
+        print("OSTRZEŻENIE: Jeden rdzeń - shardy nie mogą tu przyspieszyć inferencji (mierzony jest tylko narzut).")
+
+    reference_path = os.path.join(OUTPUT_DIR, "single.hmap")
+    _, t_single = timed(lambda: engine.run_model(model_type, output_path=reference_path, checkpoint=False))
+    _, reference = load_heatmap(reference_path)
+    n_tiles = int((~np.isnan(reference)).sum())
+
+    results = [("1 proces (run_inference)", t_single, 0.0)]
+    for n in SHARD_COUNTS:
+        path = os.path.join(OUTPUT_DIR, f"shards_{n}.hmap")
+        _, seconds = timed(lambda: run_sharded([model_type], n, output_paths={model_type: path}))
+        _, grid = load_heatmap(path)
+        same_tiles = np.array_equal(np.isnan(grid), np.isnan(reference))
+        max_diff = float(np.nanmax(np.abs(grid - reference))) if same_tiles and n_tiles else float("nan")
+        results.append((f"{n} shard(y)", seconds, max_diff))
+
+    print(f"\n{'wariant':<28}{'czas [s]':>10}{'kafelki/s':>12}{'przyspieszenie':>16}{'maks. różnica':>15}")
+    for name, seconds, max_diff in results:
+        print(f"{name:<28}{seconds:>10.1f}{n_tiles / seconds:>12.1f}{t_single / seconds:>15.2f}x{max_diff:>15.4f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "resnet",
+         sys.argv[2] if len(sys.argv) > 2 else "svs")
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from normalize_HnE import (norm_HnE, norm_HnE_batch, norm_HnE_fixed,
+                           estimate_stain_params, stain_transform)
+
+# Shardy kafelków z WSI_Pipeline.ipynb (tile_shards.py w katalogu głównym repozytorium)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tile_shards import TileShardReader, find_scan_dirs
+
+# ====================================================================
+#  BENCHMARK: Macenko per kafelek vs macierz barwników skanu
+# ====================================================================
+#
+#  Porównuje czas normalizacji na kafelek:
+#   - norm_HnE        - oryginalny Macenko dla każdego kafelka (float64, H i E)
+#   - norm_HnE_batch  - wsadowy Macenko (float32, bez H i E)
+#   - norm_HnE_fixed  - jedna macierz skanu + stała transformacja OD (LUT)
+#
+#  Domyślnie na syntetycznych kafelkach H&E; TILES_DIR = folder z shardami
+#  kafelków (wynik WSI_Pipeline.ipynb) albo z PNG pozwala użyć prawdziwych kafelków.
+
+TILES_DIR = None
+N_TILES = 64
+TILE_SIZE = 256
+SEED = 0
+
+
+def synthetic_tiles(n, size, seed):
+    """Kafelki H&E z lekko zmiennym barwieniem (jak między kafelkami jednego skanu)."""
+    rng = np.random.default_rng(seed)
+    h_vec = np.array([0.65, 0.70, 0.29])
+    e_vec = np.array([0.07, 0.99, 0.11])
+    tiles = []
+    for _ in range(n):
+        c_h = rng.random((size, size)) ** 3 * rng.uniform(1.2, 1.8)
+        c_e = rng.random((size, size)) * rng.uniform(0.6, 1.0)
+        od = c_h[..., None] * h_vec + c_e[..., None] * e_vec
+        img = 240 * np.exp(-od) + rng.normal(0, 3, (size, size, 3))
+        tiles.append(np.clip(img, 0, 255).astype(np.uint8))
+    return tiles
+
+
+def load_tiles(tiles_dir, n):
+    if find_scan_dirs(tiles_dir):
+        reader = TileShardReader(tiles_dir)
+        indices = np.arange(min(n, len(reader)))
+        tiles = reader.get_batch(indices)
+        return [tile[:height, :width] for tile, height, width
+                in zip(tiles, reader.index["height"][indices], reader.index["width"][indices])]
+    names = sorted(f for f in os.listdir(tiles_dir) if f.endswith(".png"))[:n]
+    return [np.array(Image.open(os.path.join(tiles_dir, f)).convert('RGB')) for f in names]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    tiles = load_tiles(TILES_DIR, N_TILES) if TILES_DIR else synthetic_tiles(N_TILES, TILE_SIZE, SEED)
+    tiles = [t for t in tiles if t.shape == tiles[0].shape]
+    n = len(tiles)
+    print(f"Benchmark normalizacji na {n} kafelkach {tiles[0].shape[1]}x{tiles[0].shape[0]}.")
+
+    _, t_per_tile = timed(lambda: [norm_HnE(t) for t in tiles])
+    _, t_batch = timed(lambda: norm_HnE_batch(np.stack(tiles)))
+    params, t_estimate = timed(lambda: estimate_stain_params(tiles))
+    transform = stain_transform(params)
+    _, t_fixed = timed(lambda: [norm_HnE_fixed(t, params, transform) for t in tiles])
+
+    print(f"\n{'metoda':<28}{'ms/kafelek':>12}{'przyspieszenie':>16}")
+    for name, seconds in [("norm_HnE (per kafelek)", t_per_tile),
+                          ("norm_HnE_batch", t_batch),
+                          ("norm_HnE_fixed (skan)", t_fixed)]:
+        print(f"{name:<28}{seconds * 1000 / n:>12.2f}{t_per_tile / seconds:>15.1f}x")
+    print(f"\nJednorazowa estymacja macierzy skanu: {t_estimate * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+import inference_engine as engine
+from heatmap_format import save_heatmap, load_heatmap, load_heatmap_sources, NODATA
+
+# ====================================================================
+#  KASKADA MODELI: MobileNetV2 NA WSZYSTKIM, ResNet18 TYLKO NA NIEPEWNYCH
+# ====================================================================
+#
+#  Większość kafelków jest pewnie zdrowa albo pewnie nowotworowa, więc tańszy
+#  model (FAST_MODEL) ocenia każdy kafelek tkanki, a dokładniejszy
+#  (ACCURATE_MODEL) tylko te, których P(tumor) wpada w pasmo niepewności
+#  CASCADE_BAND. Oba etapy robi jeden przebieg inference_engine.run_inference
+#  (cascade_band), a wynikowa heatmapa .hmap ma płaszczyznę źródeł: który model
+#  dał wartość każdego kafelka (patrz heatmap_format.py).
+#
+#  python cascade_inference.py [low high] liczy kaskadę i pełny przebieg
+#  ResNet18, wypisuje odsetek kafelków przekazanych dalej, zgodność z pełnym
+#  ResNet18 i tabelę dla innych pasm (do strojenia przepustowość / wierność).
+
+FAST_MODEL = "mobilenet"
+ACCURATE_MODEL = "resnet"
+CASCADE_BAND = (0.1, 0.9)   # [low, high] P(tumor) modelu szybkiego -> ocena modelem dokładnym
+
+OUTPUT_PATH = "static/scans/breast_scan2_MODEL_CASCADE_heatmap.hmap"
+REPORT_DIR = "cascade_output"
+
+# Pasma porównywane w raporcie (wyniki symulowane z pełnych przebiegów obu modeli)
+SWEEP_BANDS = [(0.5, 0.5), (0.4, 0.6), (0.3, 0.7), (0.2, 0.8), (0.1, 0.9), (0.05, 0.95), (0.01, 0.99)]
+
+
+def combine_stages(fast_grid, accurate_grid):
+    """Heatmapa kaskady: wynik modelu dokładnego tam, gdzie jest, inaczej szybkiego + płaszczyzna źródeł."""
+    escalated = ~np.isnan(accurate_grid)
+    grid = np.where(escalated, accurate_grid, fast_grid).astype(np.float32)
+    source_grid = escalated.astype(np.uint8)   # 0 = FAST_MODEL, 1 = ACCURATE_MODEL
+    return grid, source_grid
+
+
+def run_cascade(band=CASCADE_BAND, output_path=OUTPUT_PATH, stage_dir=None, **kwargs):
+    """
+    Heatmapa kaskady FAST_MODEL -> ACCURATE_MODEL dla pasma band=(low, high).
+    stage_dir - katalog na heatmapy obu etapów (domyślnie tymczasowy, usuwany),
+    pozostałe opcje jak w inference_engine.run_inference. Zwraca ścieżkę lub None.
+    """
+    tmp_dir = None
+    if stage_dir is None:
+        stage_dir = tmp_dir = tempfile.mkdtemp(prefix="heatmap_cascade_")
+    try:
+        stage_paths = {name: os.path.join(stage_dir, f"stage_{name}.hmap") for name in (FAST_MODEL, ACCURATE_MODEL)}
+        results = engine.run_inference([FAST_MODEL, ACCURATE_MODEL], output_paths=stage_paths,
+                                       cascade_band=band, **kwargs)
+        if results is None:
+            return None
+        header, fast_grid = load_heatmap(results[FAST_MODEL])
+        _, accurate_grid = load_heatmap(results[ACCURATE_MODEL])
+        grid, source_grid = combine_stages(fast_grid, accurate_grid)
+        try:
+            save_heatmap(output_path, grid, header["level"], header["tile_size"],
+                         (header["level_width"], header["level_height"]), model="cascade",
+                         sources=[FAST_MODEL, ACCURATE_MODEL], source_grid=source_grid)
+            print(f"Pomyślnie zapisano heatmapę kaskady w: {output_path}")
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się zapisać pliku heatmapy kaskady. Błąd: {e}")
+            return None
+        return output_path
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# ====================================================================
+#  RAPORT: ODSETEK PRZEKAZANYCH KAFELKÓW I ZGODNOŚĆ Z PEŁNYM ResNet18
+# ====================================================================
+
+def agreement_stats(grid, reference):
+    """Zgodność decyzji (P > 0.5) i różnice P(tumor) na kafelkach obecnych w obu siatkach."""
+    both = ~np.isnan(grid) & ~np.isnan(reference)
+    if not both.any():
+        return {"tiles": 0, "agreement": float("nan"), "mean_diff": float("nan"), "max_diff": float("nan")}
+    diff = np.abs(grid[both] - reference[both])
+    return {
+        "tiles": int(both.sum()),
+        "agreement": float(np.mean((grid[both] > 0.5) == (reference[both] > 0.5))),
+        "mean_diff": float(diff.mean()),
+        "max_diff": float(diff.max()),
+    }
+
+
+def cascade_report(cascade_path, reference_path):
+    """Statystyki heatmapy kaskady względem pełnego przebiegu modelu dokładnego."""
+    _, grid = load_heatmap(cascade_path)
+    _, reference = load_heatmap(reference_path)
+    sources, source_grid = load_heatmap_sources(cascade_path)
+    scored = source_grid != NODATA
+    escalated = source_grid == sources.index(ACCURATE_MODEL)
+    stats = agreement_stats(grid, reference)
+    stats["escalated"] = int(escalated.sum())
+    stats["escalated_fraction"] = float(escalated.sum() / max(scored.sum(), 1))
+    # Różnice mogą pochodzić tylko z kafelków, których model dokładny nie widział
+    kept = np.where(escalated, np.nan, grid)
+    stats["kept_agreement"] = agreement_stats(kept, reference)["agreement"]
+    return stats
+
+
+def band_sweep(fast_grid, reference, bands=SWEEP_BANDS):
+    """
+    Kaskada dla każdego pasma symulowana z pełnych heatmap obu modeli (model dokładny
+    na kafelku daje ten sam wynik co w pełnym przebiegu). Zwraca [(pasmo, odsetek, statystyki)].
+    """
+    scored = ~np.isnan(fast_grid)
+    rows = []
+    for low, high in bands:
+        escalated = scored & (fast_grid >= low) & (fast_grid <= high)
+        grid = np.where(escalated, reference, fast_grid)
+        rows.append(((low, high), float(escalated.sum() / max(scored.sum(), 1)), agreement_stats(grid, reference)))
+    return rows
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main(band=CASCADE_BAND):
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    cascade_path = os.path.join(REPORT_DIR, "cascade.hmap")
+    reference_path = os.path.join(REPORT_DIR, f"full_{ACCURATE_MODEL}.hmap")
+
+    # Modele wczytane raz, żeby czasy obejmowały tylko analizę skanu
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    models = {name: engine.MODEL_REGISTRY[name].load(device) for name in (FAST_MODEL, ACCURATE_MODEL)}
+
+    path, t_cascade = timed(lambda: run_cascade(band, cascade_path, stage_dir=REPORT_DIR, models=models,
+                                                device=device, checkpoint=False))
+    if path is None:
+        print("BŁĄD: Kaskada nie powiodła się.")
+        return False
+    path, t_full = timed(lambda: engine.run_model(ACCURATE_MODEL, output_path=reference_path,
+                                                  model=models[ACCURATE_MODEL], device=device, checkpoint=False))
+    if path is None:
+        print(f"BŁĄD: Pełny przebieg {ACCURATE_MODEL} nie powiódł się.")
+        return False
+
+    stats = cascade_report(cascade_path, reference_path)
+    print(f"\nKaskada {FAST_MODEL} -> {ACCURATE_MODEL}, pasmo [{band[0]}, {band[1]}]:")
+    print(f"  przekazano do {ACCURATE_MODEL}: {stats['escalated']}/{stats['tiles']} kafelków "
+          f"({stats['escalated_fraction']:.1%})")
+    print(f"  zgodność z pełnym {ACCURATE_MODEL}: {stats['agreement']:.2%} "
+          f"(na kafelkach tylko z {FAST_MODEL}: {stats['kept_agreement']:.2%}), "
+          f"różnica P: średnia {stats['mean_diff']:.4f}, maks. {stats['max_diff']:.4f}")
+    print(f"  czas: kaskada {t_cascade:.1f} s, pełny {ACCURATE_MODEL} {t_full:.1f} s "
+          f"(przyspieszenie {t_full / t_cascade:.2f}x)")
+
+    # Pełna heatmapa modelu szybkiego jest produktem ubocznym kaskady (pierwszy etap)
+    _, fast_grid = load_heatmap(os.path.join(REPORT_DIR, f"stage_{FAST_MODEL}.hmap"))
+    _, reference = load_heatmap(reference_path)
+    print(f"\n{'pasmo':<16}{'przekazane':>12}{'zgodność':>11}{'śr. różnica':>13}{'maks. różnica':>15}")
+    for (low, high), fraction, sweep_stats in band_sweep(fast_grid, reference):
+        print(f"{f'[{low}, {high}]':<16}{fraction:>12.1%}{sweep_stats['agreement']:>11.2%}"
+              f"{sweep_stats['mean_diff']:>13.4f}{sweep_stats['max_diff']:>15.4f}")
+    return True
+
+
+if __name__ == "__main__":
+    band = (float(sys.argv[1]), float(sys.argv[2])) if len(sys.argv) > 2 else CASCADE_BAND
+    sys.exit(0 if main(band) else 1)
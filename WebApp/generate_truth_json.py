@@ -1,14 +1,15 @@
 import openslide
 from openslide.deepzoom import DeepZoomGenerator
-import os
 import sys
 import numpy as np
 import xml.etree.ElementTree as ET
-from shapely.geometry import Point, Polygon
-import json
+from shapely.geometry import Polygon
 import time
 import re
 
+from roi_index import RoiIndex, tile_center_grid
+from heatmap_format import new_heatmap_grid, save_heatmap
+
 # ====================================================================
 #  1. KONFIGURACJA (Dostosuj te ścieżki!)
 # ====================================================================
@@ -20,8 +21,8 @@ PATH_TO_SCAN = "99817.svs"
 # Zakładam, że jest w tym samym folderze, ale możesz podać pełną ścieżkę
 PATH_TO_XML = "99817.session.xml" # <-- WAŻNE: Podaj poprawną nazwę pliku XML
 
-# Plik wyjściowy JSON (trafi do folderu static)
-OUTPUT_JSON_PATH = "static/scans/breast_scan2_TRUTH_heatmap.json"
+# Plik wyjściowy heatmapy .hmap (trafi do folderu static)
+OUTPUT_HEATMAP_PATH = "static/scans/breast_scan2_TRUTH_heatmap.hmap"
 
 # Parametry siatki (muszą być takie same jak w 'run_inference.py')
 TILE_SIZE = 256
@@ -85,71 +86,70 @@ def parse_xml_annotations(xml_path: str) -> list:
 #  3. GŁÓWNA LOGIKA
 # ====================================================================
 
-def generate_truth_map():
+def generate_truth_map(scan=None, polygons=None, output_path=OUTPUT_HEATMAP_PATH):
+    """
+    Mapa prawdy z adnotacji XML. Otwarty skan (slide, tiles_gen) i poligony można
+    przekazać z zewnątrz (serwer trzyma je w pamięci). Zwraca ścieżkę pliku lub None.
+    """
     print(f"Rozpoczynam generowanie 'Mapy Prawdy' z pliku {PATH_TO_XML}...")
     
     # --- Krok 1: Wczytaj poligony z XML ---
-    polygons = parse_xml_annotations(PATH_TO_XML)
+    if polygons is None:
+        polygons = parse_xml_annotations(PATH_TO_XML)
     if not polygons:
         print("BŁĄD: Nie znaleziono żadnych poligonów 'healthy' lub 'tumor' w pliku XML.")
-        return
+        return None
     print(f"Znaleziono {len(polygons)} poligonów z adnotacjami.")
 
     # --- Krok 2: Wczytaj skan (tylko do pobrania siatki) ---
-    try:
-        slide = openslide.open_slide(PATH_TO_SCAN)
-        tiles_gen = DeepZoomGenerator(slide, 
-                                      tile_size=TILE_SIZE, 
-                                      overlap=0, # Ważne: 0 overlapu
-                                      limit_bounds=False)
-    except Exception as e:
-        print(f"BŁĄD: Nie udało się otworzyć pliku SVS: {PATH_TO_SCAN}. Błąd: {e}")
-        return
+    if scan is None:
+        try:
+            slide = openslide.open_slide(PATH_TO_SCAN)
+            tiles_gen = DeepZoomGenerator(slide, 
+                                          tile_size=TILE_SIZE, 
+                                          overlap=0, # Ważne: 0 overlapu
+                                          limit_bounds=False)
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się otworzyć pliku SVS: {PATH_TO_SCAN}. Błąd: {e}")
+            return None
+    else:
+        slide, tiles_gen = scan
 
     if TARGET_LEVEL > tiles_gen.level_count - 1:
         print(f"BŁĄD: Poziom {TARGET_LEVEL} nie istnieje. Najwyższy poziom to {tiles_gen.level_count - 1}.")
-        return
+        return None
 
     cols, rows = tiles_gen.level_tiles[TARGET_LEVEL]
     print(f"Przetwarzam siatkę {cols}x{rows} na poziomie {TARGET_LEVEL}...")
 
-    # Słownik na wyniki
-    truth_heatmap_data = {}
-    tiles_found = 0
     start_time = time.time()
 
-    # --- Krok 3: Pętla przez kafelki i sprawdzanie poligonów ---
-    for row in range(rows):
-        for col in range(cols):
-            tile_name = f"{TARGET_LEVEL}_{col}_{row}"
-            
-            # Pobierz współrzędne środka kafelka
-            level_0_coords = tiles_gen.get_tile_coordinates(TARGET_LEVEL, (col, row))[0]
-            tile_center_point = Point(level_0_coords[0] + (TILE_SIZE // 2), 
-                                      level_0_coords[1] + (TILE_SIZE // 2))
-            
-            # Sprawdź, czy środek kafelka jest w którymś z poligonów
-            for polygon, label_value in polygons:
-                if tile_center_point.within(polygon):
-                    truth_heatmap_data[tile_name] = label_value
-                    tiles_found += 1
-                    break # Znaleźliśmy, przejdź do następnego kafelka
-        
-        if (row + 1) % 100 == 0:
-            print(f"  ...przeskanowano wiersz {row+1}/{rows}.")
+    # --- Krok 3: Jedno zapytanie do indeksu ROI dla całej siatki ---
+    roi_index = RoiIndex([polygon for polygon, _ in polygons])
+    label_values = np.array([label_value for _, label_value in polygons])
+
+    xs, ys = tile_center_grid(tiles_gen, TARGET_LEVEL, TILE_SIZE)
+    polygon_grid = roi_index.lookup_grid(xs, ys)
+    inside = polygon_grid >= 0
+
+    # Siatka wyników: etykieta poligonu albo NaN (poza regionami)
+    truth_grid = new_heatmap_grid(cols, rows)
+    truth_grid[inside] = label_values[polygon_grid[inside]]
+    tiles_found = int(inside.sum())
 
     end_time = time.time()
     print(f"\nAnaliza XML zakończona w {end_time - start_time:.2f} sekund.")
     print(f"Znaleziono {tiles_found} kafelków wewnątrz oznaczonych regionów.")
 
-    # --- Krok 4: Zapisz JSON ---
+    # --- Krok 4: Zapisz heatmapę (.hmap, patrz heatmap_format.py) ---
     try:
-        os.makedirs(os.path.dirname(OUTPUT_JSON_PATH), exist_ok=True)
-        with open(OUTPUT_JSON_PATH, 'w') as f:
-            json.dump(truth_heatmap_data, f)
-        print(f"Pomyślnie zapisano mapę prawdy JSON w: {OUTPUT_JSON_PATH}")
+        save_heatmap(output_path, truth_grid, TARGET_LEVEL, TILE_SIZE,
+                     tiles_gen.level_dimensions[TARGET_LEVEL], model="truth")
+        print(f"Pomyślnie zapisano mapę prawdy w: {output_path}")
     except Exception as e:
-        print(f"BŁĄD: Nie udało się zapisać pliku JSON. Błąd: {e}")
+        print(f"BŁĄD: Nie udało się zapisać pliku heatmapy. Błąd: {e}")
+        return None
+    return output_path
 
 if __name__ == "__main__":
     generate_truth_map()
\ No newline at end of file
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from heatmap_format import HEATMAP_EXT
+
+# ====================================================================
+#  CACHE WYGENEROWANYCH HEATMAP (adresowany treścią)
+# ====================================================================
+#
+#  Klucz = skrót wszystkiego, od czego zależy wynik: odcisk skanu, skrót pliku
+#  wag, skrót XML z adnotacjami oraz ustawienia skryptu (poziom, rozmiar
+#  kafelka, progi, tryb normalizacji, backend modelu). Ten sam klucz = ta sama heatmapa, więc
+#  po restarcie serwera nie liczymy jej od nowa; zmiana któregokolwiek wejścia
+#  daje nowy klucz. Pliki leżą w static/, więc przeglądarka pobiera je wprost.
+#  Rozmiar katalogu jest ograniczony - usuwamy najdawniej używane (LRU po mtime).
+
+CACHE_DIR = "static/heatmap_cache"
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+CACHE_VERSION = 2         # Zmienić, gdy zmienia się format pliku heatmapy
+
+# Ustawienia modułu skryptu, które wpływają na wynik (brakujące są pomijane);
+# MASK_* - pre-pass maski tkanki (tissue_mask.py) decyduje, które kafelki są liczone
+SETTINGS_ATTRS = ("TARGET_LEVEL", "TILE_SIZE", "INPUT_SIZE",
+                  "MAX_MEAN_THRESHOLD", "MIN_STD_THRESHOLD", "NORM_MODE", "MODEL_BACKEND",
+                  "MASK_PX_PER_TILE", "MASK_MEAN_MARGIN", "MASK_DILATION")
+
+SLIDE_SAMPLE_BYTES = 1024 * 1024   # Odcisk skanu: rozmiar + początek i koniec pliku
+HASH_CHUNK_BYTES = 4 * 1024 * 1024
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def _memoized(kind, path, compute):
+    """Skrót pliku liczony raz, dopóki plik (rozmiar, mtime) się nie zmieni."""
+    stat = os.stat(path)
+    memo_key = (kind, os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+    digest = compute(path, stat)
+    with _hash_lock:
+        _hash_memo[memo_key] = digest
+    return digest
+
+
+def _file_sha256(path, stat=None):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _slide_fingerprint(path, stat):
+    """Skan ma gigabajty - haszujemy rozmiar oraz początek i koniec pliku."""
+    h = hashlib.sha256(str(stat.st_size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(SLIDE_SAMPLE_BYTES))
+        if stat.st_size > SLIDE_SAMPLE_BYTES:
+            f.seek(max(SLIDE_SAMPLE_BYTES, stat.st_size - SLIDE_SAMPLE_BYTES))
+            h.update(f.read(SLIDE_SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+def file_hash(path):
+    return _memoized("file", path, _file_sha256)
+
+
+def slide_fingerprint(path):
+    return _memoized("slide", path, _slide_fingerprint)
+
+
+def heatmap_inputs(heatmap_type, module, weights=None, **overrides):
+    """
+    Wszystko, od czego zależy heatmapa danego modułu (skryptu) z jego konfiguracją.
+    weights - plik wag modelu (domyślnie PATH_TO_MODEL modułu, jeśli jest).
+    overrides - ustawienia podane inaczej niż stałą modułu (np. NORM_MODE=norm_mode).
+    """
+    settings = {name: getattr(module, name) for name in SETTINGS_ATTRS if hasattr(module, name)}
+    settings.update(overrides)
+    inputs = {
+        "version": CACHE_VERSION,
+        "type": heatmap_type,
+        "slide": slide_fingerprint(module.PATH_TO_SCAN),
+        "xml": file_hash(module.PATH_TO_XML),
+        "settings": settings,
+    }
+    weights = weights or getattr(module, "PATH_TO_MODEL", None)
+    if weights:
+        inputs["weights"] = file_hash(weights)
+    return inputs
+
+
+def inputs_key(inputs):
+    blob = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:32]
+
+
+def heatmap_key(heatmap_type, module, **overrides):
+    """Klucz cache dla heatmapy generowanej przez dany moduł (skrypt) z jego konfiguracją."""
+    return inputs_key(heatmap_inputs(heatmap_type, module, **overrides))
+
+
+class HeatmapCache:
+    """Katalog plików <klucz><rozszerzenie> z limitem rozmiaru (LRU)."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def get(self, key, ext=HEATMAP_EXT):
+        """Ścieżka pliku z cache albo None. Trafienie odświeża czas użycia (LRU)."""
+        path = self._entry_path(key, ext)
+        with self._lock:
+            if not os.path.isfile(path):
+                return None
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def put(self, key, src_path):
+        """Kopiuje wygenerowany plik do cache (atomowo) i zwraca ścieżkę wpisu."""
+        ext = os.path.splitext(src_path)[1]
+        path = self._entry_path(key, ext)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)   # Czytelnik widzi stary plik albo cały nowy
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        """Usuwa najdawniej używane wpisy, aż katalog zmieści się w limicie."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                print(f"Cache heatmap: usunięto najdawniej używany wpis {path}")
+            except OSError:
+                pass
@@ -0,0 +1,114 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+# ====================================================================
+#  BINARNY FORMAT HEATMAPY (.hmap)
+# ====================================================================
+#
+#  Zamiast słownika {"16_col_row": 0.1234, ...} zapisujemy gęstą siatkę
+#  rows x cols (wiersz po wierszu) z prawdopodobieństwami skwantowanymi do
+#  uint8: 0..254 = p * 254, 255 = kafelek nieanalizowany. Plik:
+#
+#    b"HMAP" | uint32 LE długość nagłówka | nagłówek JSON (UTF-8, dopełniony
+#    spacjami do wielokrotności 4) | rows * cols bajtów danych
+#
+#  Nagłówek: level, cols, rows, tile_size, level_width, level_height,
+#  model, dtype, scale, nodata. Przeglądarka czyta dane wprost do Uint8Array.
+#
+#  Opcjonalnie (np. heatmapa kaskady) za danymi leży druga płaszczyzna rows * cols
+#  bajtów: indeks modelu z listy "sources" w nagłówku, który dał wartość kafelka
+#  (nodata = brak). Czytniki, które jej nie znają, po prostu ją pomijają.
+
+HEATMAP_EXT = ".hmap"
+MAGIC = b"HMAP"
+FORMAT_VERSION = 1
+QUANT_SCALE = 254
+NODATA = 255
+
+
+def new_heatmap_grid(cols, rows):
+    """Pusta siatka (rows, cols) float32; NaN = kafelek nieanalizowany."""
+    return np.full((rows, cols), np.nan, dtype=np.float32)
+
+
+def quantize(grid):
+    values = np.rint(np.clip(np.nan_to_num(grid, nan=0.0), 0.0, 1.0) * QUANT_SCALE).astype(np.uint8)
+    values[np.isnan(grid)] = NODATA
+    return values
+
+
+def save_heatmap(path, grid, level, tile_size, level_size, model, sources=None, source_grid=None):
+    """
+    Zapisuje siatkę prawdopodobieństw (NaN = brak) atomowo jako .hmap. sources (lista
+    nazw modeli) + source_grid (rows, cols, indeks w sources) dodają płaszczyznę źródeł.
+    """
+    rows, cols = grid.shape
+    header = {
+        "version": FORMAT_VERSION,
+        "level": int(level),
+        "cols": int(cols),
+        "rows": int(rows),
+        "tile_size": int(tile_size),
+        "level_width": int(level_size[0]),
+        "level_height": int(level_size[1]),
+        "model": model,
+        "dtype": "uint8",
+        "scale": QUANT_SCALE,
+        "nodata": NODATA,
+    }
+    if sources is not None:
+        header["sources"] = list(sources)
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 4)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Plik tymczasowy per proces i wątek - równoległe zapisy tej samej heatmapy (np. dwa
+    # żądania adaptacyjne jednego modelu) nie mieszają się, ostatni os.replace wygrywa w całości
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(quantize(grid).tobytes())
+        if sources is not None:
+            source_values = np.asarray(source_grid, dtype=np.uint8).copy()
+            source_values[np.isnan(grid)] = NODATA
+            f.write(source_values.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_heatmap(path):
+    """Zawartość pliku .hmap -> (bajty, nagłówek, przesunięcie danych); sprawdza MAGIC."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"{path} nie jest plikiem heatmapy {HEATMAP_EXT}.")
+    (header_len,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8:8 + header_len].decode("utf-8"))
+    return data, header, 8 + header_len
+
+
+def load_heatmap(path):
+    """Wczytuje .hmap -> (nagłówek, siatka float32 z NaN dla nieanalizowanych)."""
+    data, header, offset = _read_heatmap(path)
+    values = np.frombuffer(data, dtype=np.uint8, count=header["rows"] * header["cols"],
+                           offset=offset).reshape(header["rows"], header["cols"])
+    grid = values.astype(np.float32) / header["scale"]
+    grid[values == header["nodata"]] = np.nan
+    return header, grid
+
+
+def load_heatmap_sources(path):
+    """Płaszczyzna źródeł -> (lista modeli, siatka uint8 indeksów; nodata = brak) albo None."""
+    data, header, offset = _read_heatmap(path)
+    if "sources" not in header:
+        return None
+    size = header["rows"] * header["cols"]
+    values = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset + size)
+    return header["sources"], values.reshape(header["rows"], header["cols"])
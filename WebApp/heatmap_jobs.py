@@ -0,0 +1,144 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from heatmap_format import QUANT_SCALE
+
+# ====================================================================
+#  ASYNCHRONICZNE ZADANIA GENEROWANIA HEATMAP
+# ====================================================================
+#
+#  Żądanie HTTP tylko zleca zadanie i od razu dostaje jego id; inferencja
+#  idzie w ograniczonej puli wątków, a przeglądarka odpytuje o postęp
+#  (kafelki zrobione/wszystkie, ETA). To samo zadanie (skan, typ) zlecone
+#  ponownie w trakcie działania dostaje id już trwającego zadania.
+#  Wyniki częściowe (paczki (col, row, p)) są zbierane w zadaniu, żeby
+#  strumień SSE mógł je wysyłać, zanim skończy się cały skan.
+
+MAX_CONCURRENT_JOBS = 1   # Ile inferencji naraz (model i tak zajmuje cały CPU/GPU)
+MAX_KEPT_JOBS = 100       # Ile zakończonych zadań pamiętamy do odpytania
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+
+class HeatmapJob:
+    """Stan jednego zadania; aktualizowany z wątku puli, czytany z żądań HTTP."""
+
+    def __init__(self, key, heatmap_type):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.heatmap_type = heatmap_type
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.chunks = []                       # (model, [[col, row, p_uint8], ...]) w kolejności nadejścia
+        self.changed = threading.Condition()   # Budzi czytelników strumienia
+
+    def finished(self):
+        return self.status in (DONE, ERROR)
+
+    def update_progress(self, done, total):
+        with self.changed:
+            self.done, self.total = done, total
+            self.changed.notify_all()
+
+    def add_results(self, results, model=None):
+        """Dopisuje paczkę wyników (col, row, p) modelu, skwantowanych jak w pliku .hmap."""
+        chunk = [[int(col), int(row), int(round(p * QUANT_SCALE))] for col, row, p in results]
+        with self.changed:
+            self.chunks.append((model or self.heatmap_type, chunk))
+            self.changed.notify_all()
+
+    def wait_for_update(self, seen_chunks, timeout):
+        """Czeka na nowe paczki/zmianę stanu; zwraca listę nowych paczek."""
+        with self.changed:
+            if len(self.chunks) <= seen_chunks and not self.finished():
+                self.changed.wait(timeout)
+            return self.chunks[seen_chunks:]
+
+    def eta_seconds(self):
+        """Szacowany czas do końca z dotychczasowego tempa (None, gdy jeszcze nie wiadomo)."""
+        if self.status != RUNNING or not self.done or not self.total:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.done * (self.total - self.done), 1)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "type": self.heatmap_type,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "eta_seconds": self.eta_seconds(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Kolejka zadań heatmap z łączeniem duplikatów i ograniczoną współbieżnością."""
+
+    def __init__(self, run_fn, max_workers=MAX_CONCURRENT_JOBS, max_kept=MAX_KEPT_JOBS):
+        """
+        run_fn(heatmap_type, progress, partial) -> wynik zadania (np. ścieżka heatmapy
+        albo {model: ścieżka}); partial(wyniki, model=None) dopisuje wyniki częściowe.
+        """
+        self._run_fn = run_fn
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="heatmap-job")
+        self._jobs = OrderedDict()
+        self._active = {}          # key -> zadanie w kolejce lub w trakcie
+        self._max_kept = max_kept
+        self._lock = threading.Lock()
+
+    def submit(self, key, heatmap_type):
+        """Zleca zadanie (lub zwraca trwające o tym samym kluczu). Zwraca (zadanie, czy_nowe)."""
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job, False
+
+            job = HeatmapJob(key, heatmap_type)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            self._forget_old()
+            job.future = self._executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        status = ERROR
+        try:
+            job.result = self._run_fn(job.heatmap_type, job.update_progress, job.add_results)
+            status = DONE
+        except Exception as e:
+            print(f"BŁĄD zadania {job.id} ({job.heatmap_type}): {e}")
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            with job.changed:
+                job.status = status
+                job.changed.notify_all()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+        return job
+
+    def _forget_old(self):
+        """Usuwa najstarsze zakończone zadania ponad limit (wywoływane pod blokadą)."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished()]
+        for job_id in finished[:max(0, len(self._jobs) - self._max_kept)]:
+            del self._jobs[job_id]
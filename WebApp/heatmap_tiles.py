@@ -0,0 +1,131 @@
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+from heatmap_format import load_heatmap
+
+# ====================================================================
+#  PIRAMIDA DZI HEATMAPY (druga warstwa OpenSeadragon)
+# ====================================================================
+#
+#  Zamiast tysięcy <div> w przeglądarce serwer renderuje heatmapę jako
+#  piramidę DZI kolorowych kafelków PNG z kanałem alfa. OpenSeadragon dokłada
+#  ją jako drugi obraz nad skanem i pobiera tylko kafelki widoczne przy
+#  bieżącym powiększeniu. Kafelki są rysowane leniwie z siatki .hmap.
+#
+#  Najdokładniejszy poziom: komórka siatki = CELL_PX x CELL_PX pikseli.
+#  Niższe poziomy zmniejszają komórkę do 1 px, a dalej uśredniają
+#  prawdopodobieństwa w blokach 2x2 (NaN = brak danych jest pomijany).
+
+DZI_TILE_SIZE = 256
+CELL_PX = 16                     # Potęga dwójki - poziomy dzielą się bez reszty
+MIN_CONFIDENCE_THRESHOLD = 0.1   # Jak w scan.js: słabsze predykcje modelu są przezroczyste
+TUMOR_RGB = (255, 0, 0)
+HEALTHY_RGB = (0, 255, 0)
+MAX_LOADED_PYRAMIDS = 8
+
+
+def _pool2x2(grid):
+    """Średnia z bloków 2x2 z pominięciem NaN (blok bez danych -> NaN)."""
+    rows, cols = grid.shape
+    padded = np.full((rows + rows % 2, cols + cols % 2), np.nan, dtype=np.float32)
+    padded[:rows, :cols] = grid
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    valid = ~np.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+
+def colorize(probs, min_confidence=0.0):
+    """Prawdopodobieństwa -> RGBA: czerwony (guz) / zielony (zdrowe), alfa = pewność."""
+    rgba = np.zeros(probs.shape + (4,), dtype=np.uint8)
+    known = ~np.isnan(probs)
+    p = np.where(known, probs, 0.5)
+    tumor = p > 0.5
+    confidence = np.abs(p - 0.5) * 2
+    rgba[..., :3] = np.where(tumor[..., None], TUMOR_RGB, HEALTHY_RGB)
+    alpha = np.rint(confidence * 255).astype(np.uint8)
+    alpha[~known | (confidence < min_confidence)] = 0
+    rgba[..., 3] = alpha
+    return rgba
+
+
+class HeatmapPyramid:
+    """Piramida DZI dla jednej siatki heatmapy (header + grid z heatmap_format)."""
+
+    def __init__(self, header, grid, tile_size=DZI_TILE_SIZE, cell_px=CELL_PX):
+        self.header = header
+        self.tile_size = tile_size
+        self.cell_px = cell_px
+        # Obraz pokrywa ten sam obszar co poziom skanu, na którym liczono siatkę
+        self.width = max(1, round(header["level_width"] * cell_px / header["tile_size"]))
+        self.height = max(1, round(header["level_height"] * cell_px / header["tile_size"]))
+        self.max_level = math.ceil(math.log2(max(self.width, self.height)))
+        self.min_confidence = 0.0 if header.get("model") == "truth" else MIN_CONFIDENCE_THRESHOLD
+
+        # grids[k] = siatka uśredniona k razy (k = 0 -> oryginał)
+        self.grids = [grid]
+        while max(self.grids[-1].shape) > 1:
+            self.grids.append(_pool2x2(self.grids[-1]))
+
+    def level_size(self, level):
+        scale = 2 ** (self.max_level - level)
+        return math.ceil(self.width / scale), math.ceil(self.height / scale)
+
+    def dzi_xml(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+                f'Format="png" Overlap="0" TileSize="{self.tile_size}">'
+                f'<Size Width="{self.width}" Height="{self.height}"/></Image>')
+
+    def render_tile(self, level, col, row):
+        """PNG kafelka DZI (level, col, row) albo None, gdy poza piramidą."""
+        if not 0 <= level <= self.max_level:
+            return None
+        level_w, level_h = self.level_size(level)
+        x0, y0 = col * self.tile_size, row * self.tile_size
+        if col < 0 or row < 0 or x0 >= level_w or y0 >= level_h:
+            return None
+        xs = np.arange(x0, min(x0 + self.tile_size, level_w))
+        ys = np.arange(y0, min(y0 + self.tile_size, level_h))
+
+        # Ile pikseli tego poziomu przypada na komórkę oryginalnej siatki
+        px_per_cell = self.cell_px / 2 ** (self.max_level - level)
+        if px_per_cell >= 1:
+            grid = self.grids[0]
+            cols_idx, rows_idx = (xs // int(px_per_cell)), (ys // int(px_per_cell))
+        else:
+            grid = self.grids[min(int(round(math.log2(1 / px_per_cell))), len(self.grids) - 1)]
+            cols_idx, rows_idx = xs, ys
+        cols_idx = np.minimum(cols_idx, grid.shape[1] - 1)
+        rows_idx = np.minimum(rows_idx, grid.shape[0] - 1)
+
+        rgba = colorize(grid[np.ix_(rows_idx, cols_idx)], self.min_confidence)
+        buffer = io.BytesIO()
+        Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", optimize=False)
+        return buffer.getvalue()
+
+
+_pyramids = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def get_pyramid(heatmap_path):
+    """Piramida dla pliku .hmap (trzymana w pamięci, odświeżana po zmianie pliku)."""
+    key = (os.path.abspath(heatmap_path), os.stat(heatmap_path).st_mtime_ns)
+    with _pyramids_lock:
+        if key in _pyramids:
+            _pyramids.move_to_end(key)
+            return _pyramids[key]
+    pyramid = HeatmapPyramid(*load_heatmap(heatmap_path))
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+        while len(_pyramids) > MAX_LOADED_PYRAMIDS:
+            _pyramids.popitem(last=False)
+    return pyramid
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+from heatmap_cache import inputs_key
+
+# ====================================================================
+#  CHECKPOINTY INFERENCJI (wznawianie przerwanego skanu)
+# ====================================================================
+#
+#  Co CHECKPOINT_EVERY_SECONDS zapisujemy siatki wyników i maskę kafelków
+#  już wczytanych (ocenionych albo odrzuconych przez filtr tkanki). Plik jest
+#  nazwany kluczem wejść (skan, XML, wagi, ustawienia - jak w heatmap_cache),
+#  więc ponowne uruchomienie z tymi samymi wejściami pomija gotowe kafelki,
+#  a zmiana czegokolwiek zaczyna od zera. Po zapisaniu heatmapy plik znika.
+
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_EVERY_SECONDS = 60
+
+
+class InferenceCheckpoint:
+    """
+    Siatka wyników + maska gotowych kafelków zapisywane atomowo jako .npz.
+    shape to kształt siatki: (rows, cols) albo (modele, rows, cols) - maska ma zawsze (rows, cols).
+    """
+
+    def __init__(self, inputs, shape, checkpoint_dir=CHECKPOINT_DIR,
+                 every_seconds=CHECKPOINT_EVERY_SECONDS):
+        self.inputs = inputs
+        self.key = inputs_key(inputs)
+        self.shape = tuple(shape)
+        self.path = os.path.join(checkpoint_dir, self.key + ".npz")
+        self.every_seconds = every_seconds
+        self._last_save = time.time()
+
+    def load(self):
+        """(siatka, gotowe) z przerwanego przebiegu z tymi samymi wejściami albo None."""
+        try:
+            with np.load(self.path) as data:
+                key = str(data["key"])
+                grid, done = data["grid"], data["done"]
+        except (OSError, KeyError, ValueError):
+            return None
+        if key != self.key or grid.shape != self.shape or done.shape != self.shape[-2:]:
+            return None
+        grid = grid.astype(np.float32)
+        grid[..., ~done] = np.nan   # Wyniki spoza gotowych kafelków i tak zostaną policzone od nowa
+        return grid, done.astype(bool)
+
+    def due(self):
+        return time.time() - self._last_save >= self.every_seconds
+
+    def save(self, grid, done):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Unikalny plik tymczasowy (mkstemp) - dwa przebiegi z tym samym kluczem nie piszą do jednego
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, key=np.array(self.key), inputs=np.array(json.dumps(self.inputs)),
+                         grid=grid, done=done)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._last_save = time.time()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,507 @@
+import openslide
+from openslide.deepzoom import DeepZoomGenerator
+import os
+import sys
+import numpy as np
+from PIL import Image
+import time
+import functools
+import re
+import xml.etree.ElementTree as ET
+from shapely.geometry import Polygon
+
+import torch
+import torch.nn as nn
+from torchvision import models
+import torch.nn.functional as F
+
+from normalize_HnE import norm_HnE_batch, norm_HnE_fixed, stain_transform
+from tile_transform import val_transform, to_model_inputs
+from tile_pipeline import iter_prepared_tiles, NUM_READER_THREADS
+from roi_index import RoiIndex
+from heatmap_format import new_heatmap_grid, save_heatmap
+from heatmap_cache import heatmap_inputs, inputs_key
+from inference_checkpoint import InferenceCheckpoint
+from model_export import load_backend_model
+
+# Maska tkanki i macierz barwników skanu wspólne z WSI_Pipeline.ipynb
+# (tissue_mask.py, slide_stain.py w katalogu głównym repozytorium)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tissue_mask import compute_tissue_mask, MASK_PX_PER_TILE, MASK_MEAN_MARGIN, MASK_DILATION
+from slide_stain import get_slide_stain_params
+
+# ====================================================================
+#  SILNIK INFERENCJI DLA WIELU MODELI (jeden przebieg po skanie)
+# ====================================================================
+#
+#  Modele są opisane w rejestrze MODEL_REGISTRY (architektura, głowa, wagi,
+#  rozmiar wejścia / transformacja, plik wyjściowy, backend). run_inference()
+#  czyta, filtruje i normalizuje Macenko każdy kafelek RAZ, a potem robi jedno
+#  przejście każdego wybranego modelu na tej samej paczce - powstaje osobna
+#  heatmapa .hmap dla każdego modelu. run_inference_resnet.py i
+#  run_inference_mobilenet.py to cienkie nakładki dla jednego modelu.
+#  Z cascade_band kolejne modele oceniają tylko niepewne kafelki pierwszego
+#  (kaskada MobileNet -> ResNet, patrz cascade_inference.py).
+#
+#  Użycie: python inference_engine.py [resnet] [mobilenet] (domyślnie wszystkie)
+
+# ====================================================================
+#  1. KONFIGURACJA (wspólna dla wszystkich modeli)
+# ====================================================================
+
+PATH_TO_SCAN = "99817.svs"
+PATH_TO_XML = "99817.session.xml"
+
+TILE_SIZE = 256
+TARGET_LEVEL = 16
+
+# Filtr tkanki (jak w treningu)
+MAX_MEAN_THRESHOLD = 215
+MIN_STD_THRESHOLD = 20
+
+# Ile kafelków trafia do modeli w jednym przejściu (jeden forward + jeden softmax na model)
+BATCH_SIZE = 64
+
+# Normalizacja: "tile" = Macenko osobno dla każdego kafelka,
+# "slide" = jedna macierz barwników na skan (cache obok skanu, patrz slide_stain.py)
+NORM_MODE = "tile"
+
+NUM_CLASSES = 2   # [healthy, tumor]
+
+# ====================================================================
+#  2. REJESTR MODELI
+# ====================================================================
+
+class ModelSpec:
+    """
+    Opis jednego klasyfikatora: architecture - konstruktor torchvision, head - nazwa
+    atrybutu z klasyfikatorem (zastępowanym naszą głową Dropout 0.5 + Linear, jak
+    w treningu), weights - plik .pth, backend - patrz model_export.py (domyślnie "eager";
+    zamrożony graf "torchscript" / "onnx" włączamy dla modelu ręcznie, po teście zgodności
+    python model_export.py). transform to val_transform na PIL (np. kafelki PNG);
+    inferencja skanu używa to_model_inputs.
+    """
+
+    def __init__(self, name, label, architecture, head, weights, output_path,
+                 input_size=224, backend="eager"):
+        self.name = name
+        self.label = label
+        self.architecture = architecture
+        self.head = head
+        self.weights = weights
+        self.output_path = output_path
+        self.input_size = input_size
+        self.backend = backend
+        self.transform = val_transform(input_size)
+
+    def build(self):
+        """Pusta architektura z naszą głową (bez wag)."""
+        model = self.architecture(weights=None)
+        old_head = getattr(model, self.head)
+        in_features = [m for m in old_head.modules() if isinstance(m, nn.Linear)][-1].in_features
+        setattr(model, self.head, nn.Sequential(
+            nn.Dropout(p=0.5),
+            nn.Linear(in_features, NUM_CLASSES)
+        ))
+        return model
+
+    def load_eager(self, model_path, device):
+        """Model eager (torchvision) z wagami .pth - też źródło eksportu do zamrożonych grafów."""
+        model = self.build()
+        try:
+            model.load_state_dict(torch.load(model_path, map_location=device))
+            print(f"Pomyślnie wczytano wagi {self.label} z: {model_path}")
+        except Exception as e:
+            print(f"BŁĄD: Nie można wczytać wag {self.label}. Błąd: {e}")
+            raise
+        model = model.to(device)
+        model.eval()
+        return model
+
+    def load(self, device, backend=None):
+        """Model do predykcji w wybranym backendzie (domyślnie self.backend)."""
+        return load_backend_model(self.load_eager, self.weights, device, backend or self.backend, self.input_size)
+
+
+MODEL_REGISTRY = {
+    "resnet": ModelSpec(
+        name="resnet", label="ResNet18",
+        architecture=models.resnet18, head="fc",
+        weights=r"Resnet_weights\final_best_model_epoch_14.pth",
+        output_path="static/scans/breast_scan2_MODEL_heatmap.hmap",
+    ),
+    "mobilenet": ModelSpec(
+        name="mobilenet", label="MobileNetV2",
+        architecture=models.mobilenet_v2, head="classifier",
+        weights=r"MobileNet_weights\final_best_model_epoch_9.pth",
+        output_path="static/scans/breast_scan2_MODEL_MOBILENET_heatmap.hmap",
+    ),
+}
+
+
+def model_inputs(name, **overrides):
+    """Wejścia heatmapy modelu (klucz cache/checkpointu): skan, XML, wagi i ustawienia."""
+    spec = MODEL_REGISTRY[name]
+    settings = {"INPUT_SIZE": spec.input_size, "MODEL_BACKEND": spec.backend}
+    settings.update(overrides)
+    return heatmap_inputs(name, sys.modules[__name__], weights=spec.weights, **settings)
+
+
+def model_key(name, **overrides):
+    return inputs_key(model_inputs(name, **overrides))
+
+# ====================================================================
+#  3. FUNKCJE PARSOWANIA XML I FILTR TKANKI
+# ====================================================================
+
+CELLULARITY_REGEX = re.compile(r"(cellula.*:|tb-)\s*(\d+)")
+
+def get_label_from_description(desc: str) -> str:
+    if not desc: return "ignore"
+    desc = desc.lower()
+    match = CELLULARITY_REGEX.search(desc)
+    if match:
+        try:
+            cellularity = int(match.group(2))
+            if cellularity == 0: return "healthy"
+            elif cellularity > 0: return "tumor"
+        except Exception: pass
+    if "healthy" in desc or "normal epithelial" in desc: return "healthy"
+    if "malignant" in desc or "idc" in desc: return "tumor"
+    return "ignore"
+
+def parse_xml_annotations(xml_path: str) -> list:
+    """Parsuje XML i zwraca listę poligonów (BEZ ETYKIET)"""
+    polygons = []
+    try:
+        tree = ET.parse(xml_path)
+        root = tree.getroot()
+        for graphic in root.findall(".//graphic"):
+            description = graphic.get("description")
+            mapped_label = get_label_from_description(description)
+            if mapped_label == "ignore":
+                continue
+            coordinates = []
+            for coord in graphic.findall(".//point"):
+                x = float(coord.text.split(',')[0])
+                y = float(coord.text.split(',')[1])
+                coordinates.append((x, y))
+            if len(coordinates) >= 3:
+                # Zapisujemy TYLKO poligon, etykieta nas nie obchodzi
+                polygons.append(Polygon(coordinates))
+    except Exception as e:
+        print(f"Błąd podczas parsowania XML {xml_path}: {e}")
+    return polygons
+
+def has_tissue(tile_image: Image.Image) -> bool:
+    try:
+        tile_np = np.array(tile_image.convert('L'))
+        mean_val = np.mean(tile_np)
+        std_val = np.std(tile_np)
+        if mean_val < MAX_MEAN_THRESHOLD and std_val > MIN_STD_THRESHOLD:
+            return True
+        return False
+    except Exception:
+        return False
+
+# ====================================================================
+#  4. SKAN, PRZYGOTOWANIE KAFELKÓW I PREDYKCJA
+# ====================================================================
+
+def open_scan(scan_path: str):
+    """Otwiera skan i zwraca (slide, tiles_gen) z siatką używaną do inferencji."""
+    slide = openslide.open_slide(scan_path)
+    tiles_gen = DeepZoomGenerator(slide, tile_size=TILE_SIZE, overlap=0, limit_bounds=False)
+    return slide, tiles_gen
+
+def candidate_tiles(slide, tiles_gen, polygons):
+    """(kafelki w ROI z XML, kafelki ROI z tkanką wg miniatury) - (col, row) na TARGET_LEVEL."""
+    roi_coords = RoiIndex(polygons).roi_coords(tiles_gen, TARGET_LEVEL, TILE_SIZE)
+    tissue_grid = compute_tissue_mask(slide, tiles_gen, TARGET_LEVEL, TILE_SIZE, MAX_MEAN_THRESHOLD,
+                                      MASK_PX_PER_TILE, MASK_MEAN_MARGIN, MASK_DILATION)
+    return roi_coords, [(col, row) for col, row in roi_coords if tissue_grid[row, col]]
+
+def slide_stain_params(tiles_gen, candidate_coords):
+    """Parametry normalizacji na poziomie skanu (NORM_MODE = "slide") z gotową transformacją."""
+    stain_params = get_slide_stain_params(PATH_TO_SCAN, tiles_gen, TARGET_LEVEL, TILE_SIZE,
+                                          candidate_coords, has_tissue)
+    stain_params["transform"] = stain_transform(stain_params)
+    return stain_params
+
+def predict_batch(model, batch_tensors, device) -> list:
+    """Jedno przejście modelu dla całej paczki kafelków. Zwraca listę P(tumor)."""
+    batch = torch.stack(batch_tensors).to(device)
+    outputs = model(batch)
+    probs = F.softmax(outputs, dim=1)
+    return probs[:, 1].cpu().tolist()
+
+def prepare_tiles(tiles: list, input_sizes, stain_params=None) -> list:
+    """
+    Filtr tkanki + normalizacja (raz na kafelek) + wejścia modeli dla paczki
+    [(col, row, PIL), ...]. Kafelki jednego rozmiaru idą jednym stosem uint8 przez
+    Macenko (bez stain_params: wsadowy per kafelek; z stain_params: stała transformacja
+    OD skanu) i to_model_inputs - bez pośrednich obrazów PIL. Zwraca
+    [(col, row, {rozmiar_wejścia: tensor}), ...] bez odrzuconych kafelków - modele
+    z tym samym rozmiarem wejścia dzielą tensor.
+    """
+    by_shape = {}
+    for col, row, tile_pil in tiles:
+        if has_tissue(tile_pil):
+            tile_np = np.asarray(tile_pil.convert('RGB'))
+            by_shape.setdefault(tile_np.shape, []).append((col, row, tile_np))
+    ready = []
+    for group in by_shape.values():
+        stack = np.stack([tile_np for _, _, tile_np in group])
+        if stain_params is None:
+            norm_stack, ok = norm_HnE_batch(stack)
+        else:
+            norm_stack = norm_HnE_fixed(stack, stain_params, stain_params["transform"])
+            ok = np.ones(len(group), dtype=bool)
+        inputs = {size: to_model_inputs(norm_stack, size) for size in input_sizes}
+        for k, (col, row, _) in enumerate(group):
+            if ok[k]:
+                ready.append((col, row, {size: batch[k] for size, batch in inputs.items()}))
+    return ready
+
+def reference_tiles(spec, n_tiles):
+    """Pierwsze n_tiles kafelków tkanki z ROI skanu, przygotowanych jak do inferencji modelu spec."""
+    slide, tiles_gen = open_scan(PATH_TO_SCAN)
+    _, candidate_coords = candidate_tiles(slide, tiles_gen, parse_xml_annotations(PATH_TO_XML))
+    tensors = []
+    for col, row in candidate_coords:
+        if len(tensors) >= n_tiles:
+            break
+        tile = tiles_gen.get_tile(TARGET_LEVEL, (col, row))
+        tensors.extend(inputs[spec.input_size] for _, _, inputs in prepare_tiles([(col, row, tile)], [spec.input_size]))
+    return tensors
+
+def mark_done(tiles_done, chunks):
+    """Oznacza kafelki z wczytanych paczek jako gotowe (do checkpointu)."""
+    for chunk in chunks:
+        for col, row in chunk:
+            tiles_done[row, col] = True
+
+def store_batch(heatmap_grid, batch_coords, probs, partial=None):
+    """Wpisuje wyniki paczki do siatki i (opcjonalnie) przekazuje je od razu dalej."""
+    for (row, col), tumor_prob in zip(batch_coords, probs):
+        heatmap_grid[row, col] = tumor_prob
+    if partial is not None:
+        partial([(col, row, tumor_prob) for (row, col), tumor_prob in zip(batch_coords, probs)])
+
+# ====================================================================
+#  5. GŁÓWNA LOGIKA WNIOSKOWANIA
+# ====================================================================
+
+def run_inference(model_names=None, batch_size=BATCH_SIZE, num_workers=NUM_READER_THREADS, norm_mode=NORM_MODE,
+                  models=None, device=None, scan=None, polygons=None, output_paths=None,
+                  progress=None, partial=None, checkpoint=True, row_range=None, cascade_band=None):
+    """
+    Heatmapy wybranych modeli z rejestru (domyślnie wszystkich) w jednym przebiegu po skanie.
+    Modele ({nazwa: model}), otwarty skan (slide, tiles_gen) i poligony można przekazać
+    z zewnątrz (np. z serwera, który trzyma je w pamięci) - wtedy nie są wczytywane ponownie.
+    output_paths={nazwa: ścieżka} zastępuje pliki wyjściowe z rejestru.
+    progress(done, total) dostaje postęp w kafelkach, a partial(nazwa, [(col, row, p), ...])
+    wyniki każdej paczki zaraz po predykcji (np. do strumieniowania). checkpoint=True zapisuje
+    postęp co jakiś czas i wznawia przerwany przebieg z tymi samymi wejściami (inference_checkpoint.py).
+    row_range=(start, stop) ogranicza analizę do pasa wierszy siatki (shardy).
+    cascade_band=(low, high) włącza kaskadę: pierwszy model ocenia każdy kafelek, a kolejne
+    tylko te z jego P(tumor) w [low, high] - ich heatmapy mają wyniki tylko dla tych kafelków.
+    Zwraca {nazwa: ścieżka zapisanej heatmapy} lub None.
+    """
+    model_names = list(model_names or MODEL_REGISTRY)
+    specs = [MODEL_REGISTRY[name] for name in model_names]
+    output_paths = {spec.name: spec.output_path for spec in specs} | (output_paths or {})
+    print(f"Rozpoczynam proces inferencji ({', '.join(spec.label for spec in specs)}, tylko w regionach XML)...")
+
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Używam urządzenia: {device}")
+
+    # --- Krok 1: Załaduj modele ---
+    models = dict(models or {})
+    for spec in specs:
+        if spec.name not in models:
+            models[spec.name] = spec.load(device)
+
+    # --- Krok 2: Załaduj poligony z XML ---
+    if polygons is None:
+        polygons = parse_xml_annotations(PATH_TO_XML)
+    if not polygons:
+        print("BŁĄD: Nie znaleziono żadnych poligonów w XML. Przerywam.")
+        return None
+    print(f"Znaleziono {len(polygons)} poligonów do analizy.")
+
+    # --- Krok 3: Załaduj skan ---
+    if scan is None:
+        try:
+            scan = open_scan(PATH_TO_SCAN)
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się otworzyć pliku SVS. Błąd: {e}")
+            return None
+    slide, tiles_gen = scan
+
+    cols, rows = tiles_gen.level_tiles[TARGET_LEVEL]
+    print(f"Skan wczytany. Przetwarzam siatkę {cols}x{rows} na poziomie {TARGET_LEVEL}.")
+
+    # --- Krok 4a/4b: Filtr 1 (Poligon XML, indeks ROI) + pre-pass tkanki z miniatury ---
+    roi_coords, candidate_coords = candidate_tiles(slide, tiles_gen, polygons)
+    print(f"W regionach XML leży {len(roi_coords)} kafelków.")
+    print(f"Pre-pass tkanki: pominięto {len(roi_coords) - len(candidate_coords)} odczytów kafelków "
+          f"({len(candidate_coords)} kandydatów).")
+    if row_range is not None:
+        # Tryb shardów (sharded_inference.py): tylko pas wierszy [start, stop)
+        candidate_coords = [(col, row) for col, row in candidate_coords if row_range[0] <= row < row_range[1]]
+        print(f"Pas wierszy {row_range[0]}-{row_range[1] - 1}: {len(candidate_coords)} kandydatów.")
+
+    # --- Normalizacja na poziomie skanu (opcjonalnie) ---
+    stain_params = slide_stain_params(tiles_gen, candidate_coords) if norm_mode == "slide" else None
+
+    # Jedna siatka na model (NaN = kafelek nieanalizowany); wspólna maska wczytanych kafelków
+    heatmap_grids = np.stack([new_heatmap_grid(cols, rows) for _ in specs])
+    tiles_done = np.zeros((rows, cols), dtype=bool)
+
+    def partial_for(name):
+        return functools.partial(partial, name) if partial is not None else None
+
+    # --- Checkpoint: wznowienie przerwanego przebiegu z tymi samymi wejściami ---
+    ckpt = None
+    if checkpoint:
+        try:
+            inputs = {"models": [model_inputs(spec.name, NORM_MODE=norm_mode) for spec in specs]}
+            if cascade_band is not None:
+                inputs["cascade_band"] = [float(v) for v in cascade_band]
+            ckpt = InferenceCheckpoint(inputs, heatmap_grids.shape)
+        except OSError as e:
+            print(f"OSTRZEŻENIE: Checkpointy wyłączone (brak pliku wejściowego?): {e}")
+        resumed = ckpt.load() if ckpt is not None else None
+        if resumed is not None:
+            heatmap_grids, tiles_done = resumed
+            print(f"Wznawiam z checkpointu: {int(tiles_done.sum())} kafelków już gotowych.")
+            if partial is not None:
+                for spec, grid in zip(specs, heatmap_grids):
+                    done_rows, done_cols = np.nonzero(~np.isnan(grid))
+                    partial(spec.name, [(col, row, float(grid[row, col])) for row, col in zip(done_rows, done_cols)])
+    todo_coords = [(col, row) for col, row in candidate_coords if not tiles_done[row, col]]
+
+    tiles_processed = 0
+    tiles_read = len(candidate_coords) - len(todo_coords)
+    model_seconds = {spec.name: 0.0 for spec in specs}
+    start_time = time.time()
+
+    # Paczka kafelków czekających na predykcję (współrzędne i wejścia w tej samej kolejności)
+    batch_coords = []
+    batch_inputs = []
+    read_chunks = []   # Wczytane paczki współrzędnych, jeszcze nie oznaczone jako gotowe
+
+    def flush_batch():
+        """Jedno przejście każdego modelu na bieżącej paczce (w kaskadzie - na niepewnych kafelkach)."""
+        coords, tile_inputs = batch_coords, batch_inputs
+        for spec, grid in zip(specs, heatmap_grids):
+            if not coords:
+                break
+            model_start = time.time()
+            probs = predict_batch(models[spec.name], [inputs[spec.input_size] for inputs in tile_inputs], device)
+            model_seconds[spec.name] += time.time() - model_start
+            store_batch(grid, coords, probs, partial_for(spec.name))
+            if cascade_band is not None:
+                uncertain = [i for i, p in enumerate(probs) if cascade_band[0] <= p <= cascade_band[1]]
+                coords = [coords[i] for i in uncertain]
+                tile_inputs = [tile_inputs[i] for i in uncertain]
+
+    input_sizes = sorted({spec.input_size for spec in specs})
+    prepare = functools.partial(prepare_tiles, input_sizes=input_sizes, stain_params=stain_params)
+
+    # --- Krok 4c: Potok - czytelnicy przygotowują kafelki, tu tylko modele ---
+    try:
+        with torch.no_grad():
+            for chunk, ready in iter_prepared_tiles(tiles_gen, TARGET_LEVEL, todo_coords, prepare,
+                                                    num_workers=num_workers):
+                for col, row, tile_inputs in ready:
+                    tiles_processed += 1
+                    batch_coords.append((row, col))
+                    batch_inputs.append(tile_inputs)
+
+                    if len(batch_inputs) == batch_size:
+                        flush_batch()
+                        batch_coords, batch_inputs = [], []
+                read_chunks.append(chunk)
+
+                if ckpt is not None and ckpt.due():
+                    # Dokończ niepełną paczkę, żeby wszystkie wczytane kafelki miały wynik
+                    if batch_inputs:
+                        flush_batch()
+                        batch_coords, batch_inputs = [], []
+                    mark_done(tiles_done, read_chunks)
+                    read_chunks = []
+                    ckpt.save(heatmap_grids, tiles_done)
+
+                n_read = len(chunk)
+                tiles_read += n_read
+                if progress is not None:
+                    progress(tiles_read, len(candidate_coords))
+                if tiles_read // 1000 != (tiles_read - n_read) // 1000:
+                    print(f"  ...wczytano {tiles_read}/{len(candidate_coords)} kafelków.")
+
+            # Ostatnia, niepełna paczka
+            if batch_inputs:
+                flush_batch()
+    except BaseException:
+        # Przerwanie/awaria: zachowaj to, co już na pewno ma wynik
+        if ckpt is not None:
+            try:
+                ckpt.save(heatmap_grids, tiles_done)
+                print(f"Zapisano checkpoint ({int(tiles_done.sum())} kafelków) w: {ckpt.path}")
+            except OSError as e:
+                print(f"OSTRZEŻENIE: Nie udało się zapisać checkpointu: {e}")
+        raise
+
+    end_time = time.time()
+    total_time_seconds = end_time - start_time
+    print(f"\nAnaliza zakończona w {total_time_seconds:.2f} sekund.")
+    if tiles_processed > 0:
+        avg_time_per_tile_ms = (total_time_seconds * 1000) / tiles_processed
+        print(f"Średni czas na 1 kafelek: {avg_time_per_tile_ms:.2f} ms")
+        print(f"Przepustowość: {tiles_processed / total_time_seconds:.1f} kafelków/s (batch_size={batch_size})")
+        for spec in specs:
+            print(f"  {spec.label}: {model_seconds[spec.name] * 1000 / tiles_processed:.2f} ms/kafelek w modelu")
+    else:
+        print("Nie przetworzono żadnych kafelków.")
+    print(f"Przeanalizowano i zapisano wyniki dla {tiles_processed} kafelków (wewnątrz regionów).")
+    if cascade_band is not None:
+        scored = np.count_nonzero(~np.isnan(heatmap_grids[0]))
+        for spec, grid in zip(specs[1:], heatmap_grids[1:]):
+            escalated = np.count_nonzero(~np.isnan(grid))
+            print(f"Kaskada: {spec.label} ocenił {escalated}/{scored} kafelków "
+                  f"({escalated / max(scored, 1):.1%}, pasmo niepewności {cascade_band[0]}-{cascade_band[1]}).")
+
+    # --- Krok 5: Zapisz heatmapy (.hmap, patrz heatmap_format.py) ---
+    results = {}
+    for spec, grid in zip(specs, heatmap_grids):
+        output_path = output_paths[spec.name]
+        try:
+            save_heatmap(output_path, grid, TARGET_LEVEL, TILE_SIZE,
+                         tiles_gen.level_dimensions[TARGET_LEVEL], model=spec.name)
+            print(f"Pomyślnie zapisano heatmapę {spec.label} w: {output_path}")
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się zapisać pliku heatmapy {spec.label}. Błąd: {e}")
+            return None
+        results[spec.name] = output_path
+    if ckpt is not None:
+        ckpt.remove()
+    return results
+
+def run_model(name, output_path=None, model=None, partial=None, **kwargs):
+    """
+    Heatmapa jednego modelu z rejestru (dla nakładek run_inference_*.py). model i
+    partial([(col, row, p), ...]) dotyczą tylko tego modelu, pozostałe opcje jak
+    w run_inference. Zwraca ścieżkę heatmapy lub None.
+    """
+    results = run_inference([name],
+                            models={name: model} if model is not None else None,
+                            output_paths={name: output_path} if output_path else None,
+                            partial=(lambda _, results: partial(results)) if partial is not None else None,
+                            **kwargs)
+    return results[name] if results else None
+
+if __name__ == "__main__":
+    run_inference(sys.argv[1:] or None)
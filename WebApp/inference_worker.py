@@ -0,0 +1,202 @@
+import threading
+import time
+import openslide
+from openslide.deepzoom import DeepZoomGenerator
+import torch
+
+import inference_engine
+import adaptive_inference
+import generate_truth_json
+from heatmap_cache import HeatmapCache, heatmap_key
+from heatmap_format import QUANT_SCALE, NODATA
+
+# ====================================================================
+#  STAŁY WORKER INFERENCJI DLA SERWERA FLASK
+# ====================================================================
+#
+#  Zamiast uruchamiać 'python run_inference_*.py' przy każdym żądaniu
+#  (start interpretera, import torch/openslide/shapely, otwarcie skanu,
+#  wczytanie wag .pth), trzymamy modele, otwarte skany i poligony w pamięci
+#  procesu serwera i wołamy bezpośrednio inference_engine.run_inference().
+#  Heatmapy modeli liczy jedno wspólne zadanie MODELS_JOB: kafelki są czytane
+#  i normalizowane raz, a każdy model z rejestru dostaje tę samą paczkę.
+
+MODEL_REGISTRY = inference_engine.MODEL_REGISTRY
+HEATMAP_TYPES = tuple(MODEL_REGISTRY) + ('truth',)
+MODELS_JOB = 'models'   # Typ wspólnego zadania dla wszystkich modeli z rejestru
+
+
+class InferenceWorker:
+    """Modele, uchwyty skanów i poligony wczytane raz i współdzielone przez żądania."""
+
+    def __init__(self):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._models = {}
+        self._scans = {}
+        self._polygons = {}
+        self._lock = threading.Lock()   # chroni tylko wczytywanie (nie samą inferencję)
+        self.cache = HeatmapCache()
+
+    # --- Zasoby wczytywane leniwie (raz) ---
+
+    def get_model(self, heatmap_type: str):
+        with self._lock:
+            if heatmap_type not in self._models:
+                self._models[heatmap_type] = MODEL_REGISTRY[heatmap_type].load(self.device)
+            return self._models[heatmap_type]
+
+    def get_scan(self, module):
+        """(slide, tiles_gen) dla skanu z konfiguracji modułu; OpenSlide jest bezpieczny wątkowo."""
+        key = (module.PATH_TO_SCAN, module.TILE_SIZE)
+        with self._lock:
+            if key not in self._scans:
+                slide = openslide.open_slide(module.PATH_TO_SCAN)
+                tiles_gen = DeepZoomGenerator(slide, tile_size=module.TILE_SIZE, overlap=0, limit_bounds=False)
+                self._scans[key] = (slide, tiles_gen)
+            return self._scans[key]
+
+    def get_polygons(self, module):
+        """Poligony z XML; każdy skrypt parsuje je po swojemu (z etykietami lub bez)."""
+        key = (module.__name__, module.PATH_TO_XML)
+        with self._lock:
+            if key not in self._polygons:
+                self._polygons[key] = module.parse_xml_annotations(module.PATH_TO_XML)
+            return self._polygons[key]
+
+    def warm_up(self):
+        """Wczytuje wszystkie modele, skan i poligony z góry (np. przy starcie serwera)."""
+        for heatmap_type in MODEL_REGISTRY:
+            try:
+                self.get_model(heatmap_type)
+            except Exception as e:
+                print(f"OSTRZEŻENIE: Nie udało się wstępnie wczytać '{heatmap_type}': {e}")
+        try:
+            self.get_scan(inference_engine)
+            self.get_polygons(inference_engine)
+        except Exception as e:
+            print(f"OSTRZEŻENIE: Nie udało się wstępnie wczytać skanu: {e}")
+        print("Worker inferencji gotowy.")
+
+    # --- Generowanie heatmap ---
+
+    def job_type(self, heatmap_type: str) -> str:
+        """Typ zadania: heatmapy modeli liczy jedno wspólne zadanie, 'truth' - osobne."""
+        return MODELS_JOB if heatmap_type in MODEL_REGISTRY else heatmap_type
+
+    def job_key(self, heatmap_type: str) -> tuple:
+        """Identyfikator zadania (skan, typ zadania) - te same zadania są łączone w jedno."""
+        module = inference_engine if heatmap_type in MODEL_REGISTRY else generate_truth_json
+        return (module.PATH_TO_SCAN, self.job_type(heatmap_type))
+
+    def cache_key(self, heatmap_type: str):
+        """Klucz heatmapy w cache (None, gdy brakuje któregoś pliku wejściowego)."""
+        try:
+            if heatmap_type in MODEL_REGISTRY:
+                return inference_engine.model_key(heatmap_type)
+            return heatmap_key(heatmap_type, generate_truth_json)
+        except OSError as e:
+            print(f"OSTRZEŻENIE: Nie można wyliczyć klucza cache dla '{heatmap_type}': {e}")
+            return None
+
+    def cached(self, heatmap_type: str):
+        """Ścieżka heatmapy z cache, jeśli żadne wejście się nie zmieniło, inaczej None."""
+        key = self.cache_key(heatmap_type)
+        return self.cache.get(key) if key is not None else None
+
+    def grid_header(self, job_type: str) -> dict:
+        """Opis siatki heatmapy (jak nagłówek .hmap) - do rysowania wyników częściowych."""
+        module = inference_engine if job_type == MODELS_JOB else generate_truth_json
+        slide, tiles_gen = self.get_scan(module)
+        cols, rows = tiles_gen.level_tiles[module.TARGET_LEVEL]
+        level_width, level_height = tiles_gen.level_dimensions[module.TARGET_LEVEL]
+        return {"level": module.TARGET_LEVEL, "cols": cols, "rows": rows,
+                "tile_size": module.TILE_SIZE, "level_width": level_width,
+                "level_height": level_height, "model": job_type,
+                "models": list(MODEL_REGISTRY) if job_type == MODELS_JOB else [job_type],
+                "scale": QUANT_SCALE, "nodata": NODATA}
+
+    def _store(self, key, output_path):
+        """Kopiuje gotową heatmapę do cache i zwraca ścieżkę wpisu (albo oryginału)."""
+        if key is not None:
+            try:
+                return self.cache.put(key, output_path)
+            except OSError as e:
+                print(f"OSTRZEŻENIE: Nie udało się zapisać heatmapy w cache: {e}")
+        return output_path
+
+    def generate_models(self, progress=None, partial=None) -> dict:
+        """
+        Heatmapy wszystkich modeli z rejestru w jednym przebiegu po skanie.
+        Modele z gotową heatmapą w cache są pomijane. Zwraca {typ: ścieżka}.
+        partial([(col, row, p), ...], typ) - wyniki częściowe z nazwą modelu.
+        """
+        keys = {name: self.cache_key(name) for name in MODEL_REGISTRY}
+        results = {}
+        for name, key in keys.items():
+            cached_path = self.cache.get(key) if key is not None else None
+            if cached_path is not None:
+                print(f"Heatmapa '{name}' wzięta z cache: {cached_path}")
+                results[name] = cached_path
+        missing = [name for name in MODEL_REGISTRY if name not in results]
+        if not missing:
+            return results
+
+        output_paths = inference_engine.run_inference(
+            missing,
+            models={name: self.get_model(name) for name in missing},
+            device=self.device,
+            scan=self.get_scan(inference_engine),
+            polygons=self.get_polygons(inference_engine),
+            progress=progress,
+            partial=(lambda name, tiles: partial(tiles, name)) if partial is not None else None)
+        if output_paths is None:
+            raise RuntimeError(f"Generowanie heatmap {', '.join(missing)} nie powiodło się (szczegóły w logach).")
+
+        for name in missing:
+            results[name] = self._store(keys[name], output_paths[name])
+        return results
+
+    def generate_adaptive(self, heatmap_type: str, time_budget: float) -> str:
+        """
+        Heatmapa modelu w limicie czasu (adaptive_inference.py) - liczona od razu, poza
+        kolejką zadań, żeby odpowiedź zmieściła się w limicie. Czas wczytania modelu
+        (przy zimnym starcie) jest odliczany od limitu. Zwraca ścieżkę pliku.
+        """
+        start = time.perf_counter()
+        model = self.get_model(heatmap_type)
+        remaining = max(time_budget - (time.perf_counter() - start), 1e-3)
+        output_path = adaptive_inference.run_adaptive(heatmap_type, remaining, model=model,
+                                                      device=self.device,
+                                                      scan=self.get_scan(inference_engine),
+                                                      polygons=self.get_polygons(inference_engine))
+        if output_path is None:
+            raise RuntimeError(f"Generowanie heatmapy adaptacyjnej '{heatmap_type}' nie powiodło się.")
+        return output_path
+
+    def generate(self, job_type: str, progress=None, partial=None):
+        """
+        Wykonuje zadanie danego typu (JobManager). MODELS_JOB zwraca {typ: ścieżka}
+        heatmap wszystkich modeli, 'truth' - ścieżkę pliku (względem katalogu WebApp).
+        progress(done, total) - opcjonalny callback postępu w kafelkach.
+        partial([(col, row, p), ...], typ) - opcjonalny callback wyników częściowych (modele).
+        Gotowa heatmapa z tymi samymi wejściami jest brana z cache.
+        """
+        if job_type == MODELS_JOB:
+            return self.generate_models(progress, partial)
+        if job_type != 'truth':
+            raise ValueError(f"Nieznany typ heatmapy: {job_type}")
+
+        key = self.cache_key(job_type)
+        cached_path = self.cache.get(key) if key is not None else None
+        if cached_path is not None:
+            print(f"Heatmapa '{job_type}' wzięta z cache: {cached_path}")
+            return cached_path
+
+        module = generate_truth_json
+        output_path = module.generate_truth_map(scan=self.get_scan(module),
+                                                polygons=self.get_polygons(module))
+        if progress is not None:
+            progress(1, 1)
+        if output_path is None:
+            raise RuntimeError(f"Generowanie heatmapy '{job_type}' nie powiodło się (szczegóły w logach).")
+        return self._store(key, output_path)
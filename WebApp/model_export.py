@@ -0,0 +1,257 @@
+import inspect
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+try:
+    import onnxruntime
+except ImportError:           # ONNX Runtime jest opcjonalny - bez niego zostaje TorchScript/eager
+    onnxruntime = None
+
+# ====================================================================
+#  ZAMROŻONE GRAFY MODELI (TorchScript / ONNX Runtime)
+# ====================================================================
+#
+#  Skrypty inferencji budują model torchvision w trybie eager i wczytują
+#  state_dict z .pth przy każdym starcie. Tutaj eksportujemy wytrenowany model
+#  raz do zamrożonego grafu i zapisujemy go obok wag:
+#    - "torchscript": torch.jit.trace + torch.jit.freeze (wagi jako stałe,
+#      BatchNorm wtopiony w konwolucje, Dropout usunięty) -> <wagi>.torchscript.pt
+#    - "onnx": ten sam graf w ONNX uruchamiany przez onnxruntime na CPU
+#      (wymaga pakietów onnx + onnxruntime) -> <wagi>.onnx
+#  Plik jest eksportowany ponownie, gdy jest starszy niż wagi. Backend wybiera
+#  pole backend modelu w rejestrze; domyślny "eager" = dotychczasowy model
+#  torchvision, zamrożony graf jest opcją włączaną per model (backend="torchscript").
+#  "int8" = model skwantyzowany przez model_quantize.py (<wagi>.int8.pt, tylko
+#  CPU) - nie jest eksportowany automatycznie, bo wymaga kalibracji i oceny.
+#  Grad-CAM (generate_xai.py) potrzebuje autograd, więc zostaje w trybie eager.
+#  Modele (architektura, wagi, backend) opisuje rejestr w inference_engine.py.
+#
+#  Użycie: python model_export.py [resnet|mobilenet|all] [liczba_kafelków]
+#  eksportuje oba grafy i porównuje P(tumor) z modelem eager na kafelkach skanu.
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8")
+BACKEND_EXT = {
+    "torchscript": ".torchscript.pt",
+    "onnx": ".onnx",
+    "int8": ".int8.pt",
+}
+
+# Silnik operacji skwantyzowanych: x86 (fbgemm/oneDNN) albo qnnpack na ARM
+QUANT_ENGINE = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+ONNX_OPSET = 17
+# Eksporter TorchScript (dynamo=False): od torch 2.9 domyślny jest eksporter dynamo,
+# a wersje sprzed torch 2.5 nie znają argumentu dynamo i używają TorchScript same
+ONNX_EXPORT_KWARGS = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+# Test zgodności: maks. różnica P(tumor) względem eager i liczba kafelków referencyjnych
+PARITY_TOLERANCE = 1e-3
+PARITY_TILES = 128
+PARITY_BATCH_SIZE = 32
+
+
+def exported_path(model_path, backend):
+    """Plik zamrożonego grafu obok wag .pth (Resnet_weights/x.pth -> Resnet_weights/x.torchscript.pt)."""
+    return os.path.splitext(model_path)[0] + BACKEND_EXT[backend]
+
+
+def _is_fresh(path, model_path):
+    return os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(model_path)
+
+
+def _example_input(input_size, batch_size=1):
+    return torch.zeros(batch_size, 3, input_size, input_size)
+
+
+def _save_replace(path, save):
+    """
+    save(tmp_path), potem atomowe os.replace na path. Plik tymczasowy jest unikalny
+    (mkstemp), więc równoległe eksporty (procesy, wątki serwera) nie piszą do jednego pliku.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def export_torchscript(eager_model, path, input_size):
+    """Trace + freeze modelu eager (na CPU) i zapis grafu do path."""
+    model = eager_model.to("cpu").eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, _example_input(input_size))
+    frozen = torch.jit.freeze(traced)
+    return _save_replace(path, lambda tmp_path: torch.jit.save(frozen, tmp_path))
+
+
+def export_onnx(eager_model, path, input_size):
+    """Eksport modelu eager do ONNX z dynamicznym rozmiarem paczki."""
+    model = eager_model.to("cpu").eval()
+    return _save_replace(path, lambda tmp_path: torch.onnx.export(
+        model, (_example_input(input_size, 2),), tmp_path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=ONNX_OPSET, **ONNX_EXPORT_KWARGS))
+
+
+EXPORTERS = {
+    "torchscript": export_torchscript,
+    "onnx": export_onnx,
+}
+
+
+class OnnxModel:
+    """
+    Sesja onnxruntime z interfejsem modelu torch: model(batch) -> logity (tensor),
+    więc predict_batch() w skryptach działa bez zmian.
+    """
+
+    def __init__(self, path, num_threads=None):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def ensure_exported(build_eager, model_path, backend, input_size):
+    """Ścieżka zamrożonego grafu; eksportuje go, gdy go nie ma albo jest starszy niż wagi."""
+    path = exported_path(model_path, backend)
+    if not _is_fresh(path, model_path):
+        print(f"Eksport modelu do {backend}: {path}")
+        EXPORTERS[backend](build_eager(model_path, torch.device("cpu")), path, input_size)
+    return path
+
+
+def load_backend_model(build_eager, model_path, device, backend, input_size):
+    """
+    Model gotowy do predykcji w wybranym backendzie. build_eager(model_path, device)
+    to ModelSpec.load_eager z rejestru - używany dla "eager" oraz do (ponownego) eksportu,
+    gdy zamrożonego grafu nie ma albo jest starszy niż wagi.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Nieznany backend modelu: {backend} (dostępne: {', '.join(BACKENDS)})")
+    if backend == "eager":
+        return build_eager(model_path, device)
+    if backend == "onnx" and onnxruntime is None:
+        raise ImportError("Backend 'onnx' wymaga pakietu onnxruntime (pip install onnx onnxruntime).")
+
+    if backend == "int8":
+        return load_int8_model(model_path, device)
+
+    path = ensure_exported(build_eager, model_path, backend, input_size)
+    if backend == "onnx":
+        if device.type != "cpu":
+            print("OSTRZEŻENIE: Backend 'onnx' działa tylko na CPU.")
+        model = OnnxModel(path)
+    else:
+        model = torch.jit.load(path, map_location=device)
+        if device.type == "cpu":
+            # Fuzje pod CPU (np. conv + ReLU); na GPU graf zostaje jak po freeze
+            model = torch.jit.optimize_for_inference(model)
+    print(f"Wczytano model ({backend}) z: {path}")
+    return model
+
+
+def load_int8_model(model_path, device):
+    """Model INT8 opublikowany przez model_quantize.py (musi być nowszy niż wagi)."""
+    if device.type != "cpu":
+        raise ValueError("Backend 'int8' działa tylko na CPU (ustaw urządzenie cpu).")
+    path = exported_path(model_path, "int8")
+    if not _is_fresh(path, model_path):
+        raise FileNotFoundError(f"Brak aktualnego modelu INT8: {path}. Uruchom: python model_quantize.py")
+    torch.backends.quantized.engine = QUANT_ENGINE
+    model = torch.jit.load(path, map_location="cpu")
+    print(f"Wczytano model (int8) z: {path}")
+    return model
+
+
+# ====================================================================
+#  TEST ZGODNOŚCI Z MODELEM EAGER
+# ====================================================================
+
+def _predict_all(model, tensors, batch_size):
+    """P(tumor) dla wszystkich kafelków oraz średni czas jednej paczki."""
+    probs, seconds = [], []
+    with torch.no_grad():
+        for i in range(0, len(tensors), batch_size):
+            batch = torch.stack(tensors[i:i + batch_size])
+            start = time.perf_counter()
+            outputs = model(batch)
+            seconds.append(time.perf_counter() - start)
+            probs.append(F.softmax(outputs, dim=1)[:, 1].numpy())
+    # Pierwsza paczka zawiera rozgrzewkę (profilowanie grafu), więc liczymy ją osobno
+    steady = seconds[1:] or seconds
+    return np.concatenate(probs), seconds[0], float(np.mean(steady))
+
+
+def parity_check(model_type="resnet", n_tiles=PARITY_TILES, batch_size=PARITY_BATCH_SIZE,
+                 tolerance=PARITY_TOLERANCE):
+    """
+    Eksportuje model do każdego dostępnego backendu i porównuje P(tumor) z modelem
+    eager na kafelkach referencyjnych. Zwraca True, gdy wszystkie mieszczą się w tolerancji.
+    """
+    import inference_engine as engine   # Tutaj, bo silnik sam importuje ten moduł
+    spec = engine.MODEL_REGISTRY[model_type]
+    device = torch.device("cpu")
+    tensors = engine.reference_tiles(spec, n_tiles)
+    if not tensors:
+        print("BŁĄD: Brak kafelków tkanki do porównania.")
+        return False
+    print(f"\n{model_type}: {len(tensors)} kafelków referencyjnych, paczka {batch_size}")
+
+    # INT8 ma własną ocenę z progami (model_quantize.py) - tu tylko grafy float
+    backends = [b for b in BACKENDS if b != "int8" and (b != "onnx" or onnxruntime is not None)]
+    if "onnx" not in backends:
+        print("OSTRZEŻENIE: Brak onnxruntime - pomijam backend 'onnx'.")
+
+    # Eksport przed pomiarem - czas startu to samo wczytanie gotowego grafu
+    for backend in backends[1:]:
+        ensure_exported(spec.load_eager, spec.weights, backend, spec.input_size)
+
+    results = {}
+    for backend in backends:
+        start = time.perf_counter()
+        model = load_backend_model(spec.load_eager, spec.weights, device, backend, spec.input_size)
+        load_seconds = time.perf_counter() - start
+        probs, first_batch, per_batch = _predict_all(model, tensors, batch_size)
+        results[backend] = (probs, load_seconds, first_batch, per_batch)
+
+    reference = results["eager"][0]
+    all_ok = True
+    print(f"{'backend':<14}{'start [s]':>10}{'1. paczka [ms]':>16}{'paczka [ms]':>13}{'maks. różnica':>15}{'zgodność':>10}")
+    for backend, (probs, load_seconds, first_batch, per_batch) in results.items():
+        max_diff = float(np.max(np.abs(probs - reference)))
+        agreement = float(np.mean((probs > 0.5) == (reference > 0.5)))
+        ok = max_diff <= tolerance
+        all_ok &= ok
+        print(f"{backend:<14}{load_seconds:>10.2f}{first_batch * 1000:>16.1f}{per_batch * 1000:>13.1f}"
+              f"{max_diff:>15.2e}{agreement:>9.1%}{'' if ok else '  <- POZA TOLERANCJĄ'}")
+    return all_ok
+
+
+if __name__ == "__main__":
+    which = sys.argv[1] if len(sys.argv) > 1 else "all"
+    n_tiles = int(sys.argv[2]) if len(sys.argv) > 2 else PARITY_TILES
+    import inference_engine as engine
+    model_types = list(engine.MODEL_REGISTRY) if which == "all" else [which]
+    ok = all([parity_check(model_type, n_tiles) for model_type in model_types])
+    print("\nZgodność z modelem eager: OK" if ok else "\nBŁĄD: Zamrożony graf różni się od modelu eager.")
+    sys.exit(0 if ok else 1)
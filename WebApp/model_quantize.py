@@ -0,0 +1,215 @@
+import json
+import os
+import random
+import sys
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+import inference_engine as engine
+from model_export import exported_path, _save_replace, QUANT_ENGINE
+from tile_transform import to_model_inputs
+
+# Shardy kafelków z WSI_Pipeline.ipynb (tile_shards.py w katalogu głównym repozytorium)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tile_shards import TileShardReader, find_scan_dirs
+
+# ====================================================================
+#  KWANTYZACJA INT8 (statyczna, po treningu) Z KONTROLĄ ZGODNOŚCI
+# ====================================================================
+#
+#  Dla węzłów tylko z CPU: model float (eager) jest kwantyzowany w trybie FX
+#  (prepare_fx -> kalibracja -> convert_fx), a potem zamrażany jak TorchScript
+#  i zapisywany obok wag jako <wagi>.int8.pt (backend "int8" w skryptach).
+#
+#  Kalibracja: próbka kafelków z ekstrakcji WSI_Pipeline.ipynb (już znormalizowanych
+#  Macenko) - shardy <katalog>/<skan>/tiles_*.u8 + tiles_index.npy (tile_shards.py,
+#  przez to_model_inputs jak w inferencji skanu) albo starsze PNG
+#  <katalog>/<skan>/{healthy,tumor}/*.png (transformacja modelu z rejestru). Rozłączna próbka
+#  z tego samego katalogu oraz kafelki ROI skanu służą do oceny: dryf P(tumor)
+#  względem modelu float i zgodność decyzji heatmapy (P > 0.5).
+#  Model, który nie spełnia progów MIN_AGREEMENT / MAX_MEAN_DRIFT, NIE jest
+#  publikowany - raport (<wagi>.int8.json) jest zapisywany zawsze.
+#
+#  Użycie: python model_quantize.py [resnet|mobilenet|all] [katalog_kafelków]
+
+CALIBRATION_DIR = "calibration_tiles"
+CALIBRATION_TILES = 256        # Kafelki do kalibracji obserwatorów
+EVALUATION_TILES = 256         # Osobne kafelki z katalogu do oceny dryfu
+SCAN_EVALUATION_TILES = 512    # Kafelki ROI skanu skryptu (zgodność heatmapy)
+CALIBRATION_BATCH_SIZE = 32
+CALIBRATION_SEED = 0
+
+# Progi publikacji: zgodność decyzji guz/zdrowe i średni dryf P(tumor)
+MIN_AGREEMENT = 0.99
+MAX_MEAN_DRIFT = 0.02
+
+TILE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def list_tiles(tiles_dir):
+    """Wszystkie kafelki z katalogu ekstrakcji (rekurencyjnie, posortowane)."""
+    paths = []
+    for root, _, files in os.walk(tiles_dir):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(TILE_EXTENSIONS))
+    return sorted(paths)
+
+
+def load_shard_tensors(spec, reader, indices):
+    """Kafelki z shardów (prawdziwy rozmiar z indeksu) -> tensory jak w inferencji skanu (to_model_inputs)."""
+    indices = np.asarray(indices, dtype=np.int64)
+    tiles = reader.get_batch(indices)
+    sizes = np.stack([reader.index["height"][indices], reader.index["width"][indices]], axis=1)
+    tensors = [None] * len(indices)
+    # to_model_inputs wymaga stosu jednego rozmiaru - kafelki brzegowe grupami
+    for height, width in np.unique(sizes, axis=0):
+        group = np.nonzero((sizes[:, 0] == height) & (sizes[:, 1] == width))[0]
+        for j, tensor in zip(group, to_model_inputs(tiles[group, :height, :width], spec.input_size)):
+            tensors[j] = tensor
+    return tensors
+
+
+def tile_source(tiles_dir):
+    """
+    (kafelki, loader(spec, kafelki) -> tensory) dla katalogu ekstrakcji:
+    numery kafelków z shardów, gdy katalog je ma, inaczej ścieżki PNG.
+    """
+    if find_scan_dirs(tiles_dir):
+        reader = TileShardReader(tiles_dir)
+        return list(range(len(reader))), lambda spec, indices: load_shard_tensors(spec, reader, indices)
+    return list_tiles(tiles_dir), load_tensors
+
+
+def split_tiles(paths, n_calibration, n_evaluation, seed=CALIBRATION_SEED):
+    """Losowe, rozłączne próbki: (kalibracja, ocena)."""
+    paths = list(paths)
+    random.Random(seed).shuffle(paths)
+    return paths[:n_calibration], paths[n_calibration:n_calibration + n_evaluation]
+
+
+def load_tensors(spec, paths):
+    """Kafelki po normalizacji z notebooka -> tensory jak w inferencji (transformacja modelu)."""
+    tensors = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                tensors.append(spec.transform(img.convert("RGB")))
+        except Exception as e:
+            print(f"OSTRZEŻENIE: Pomijam kafelek {path}: {e}")
+    return tensors
+
+
+def _batches(tensors, batch_size=CALIBRATION_BATCH_SIZE):
+    for i in range(0, len(tensors), batch_size):
+        yield torch.stack(tensors[i:i + batch_size])
+
+
+def tumor_probs(model, tensors):
+    with torch.no_grad():
+        return np.concatenate([F.softmax(model(batch), dim=1)[:, 1].numpy() for batch in _batches(tensors)])
+
+
+def quantize_model(float_model, calibration_tensors, input_size):
+    """Statyczna kwantyzacja FX: obserwatory + kalibracja + konwersja, potem trace + freeze."""
+    torch.backends.quantized.engine = QUANT_ENGINE
+    example = (torch.zeros(1, 3, input_size, input_size),)
+    prepared = prepare_fx(float_model.eval(), get_default_qconfig_mapping(QUANT_ENGINE), example)
+    with torch.no_grad():
+        for batch in _batches(calibration_tensors):
+            prepared(batch)
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(quantized, example))
+
+
+def drift_report(float_probs, int8_probs):
+    """Dryf P(tumor) na kafelek i zgodność decyzji heatmapy (P > 0.5)."""
+    drift = np.abs(int8_probs - float_probs)
+    return {
+        "tiles": int(len(drift)),
+        "mean_drift": float(drift.mean()),
+        "p99_drift": float(np.percentile(drift, 99)),
+        "max_drift": float(drift.max()),
+        "agreement": float(np.mean((int8_probs > 0.5) == (float_probs > 0.5))),
+    }
+
+
+def quantize(model_type="resnet", tiles_dir=CALIBRATION_DIR, min_agreement=MIN_AGREEMENT,
+             max_mean_drift=MAX_MEAN_DRIFT):
+    """
+    Kwantyzuje model z rejestru, ocenia go i publikuje <wagi>.int8.pt tylko wtedy,
+    gdy mieści się w progach. Zwraca ścieżkę opublikowanego modelu albo None.
+    """
+    spec = engine.MODEL_REGISTRY[model_type]
+    output_path = exported_path(spec.weights, "int8")
+    report_path = os.path.splitext(output_path)[0] + ".json"
+
+    tiles, load = tile_source(tiles_dir)
+    calibration_tiles, evaluation_tiles = split_tiles(tiles, CALIBRATION_TILES, EVALUATION_TILES)
+    if not calibration_tiles:
+        print(f"BŁĄD: Brak kafelków do kalibracji w: {tiles_dir}")
+        return None
+    calibration = load(spec, calibration_tiles)
+    print(f"\n{model_type}: kalibracja na {len(calibration)} kafelkach z {tiles_dir}")
+
+    float_model = spec.load_eager(spec.weights, torch.device("cpu"))
+    int8_model = quantize_model(float_model, calibration, spec.input_size)
+
+    # --- Ocena względem modelu float ---
+    evaluation_sets = {}
+    if evaluation_tiles:
+        evaluation_sets["tiles"] = load(spec, evaluation_tiles)
+    try:
+        evaluation_sets["scan"] = engine.reference_tiles(spec, SCAN_EVALUATION_TILES)
+    except Exception as e:
+        print(f"OSTRZEŻENIE: Brak kafelków skanu do oceny heatmapy: {e}")
+
+    report = {"model": model_type, "weights": spec.weights, "engine": QUANT_ENGINE,
+              "calibration_tiles": len(calibration), "min_agreement": min_agreement,
+              "max_mean_drift": max_mean_drift, "evaluation": {}}
+    passed, evaluated = True, 0
+    for name, tensors in evaluation_sets.items():
+        if not tensors:
+            continue
+        stats = drift_report(tumor_probs(float_model, tensors), tumor_probs(int8_model, tensors))
+        stats["passed"] = stats["agreement"] >= min_agreement and stats["mean_drift"] <= max_mean_drift
+        passed &= stats["passed"]
+        evaluated += 1
+        report["evaluation"][name] = stats
+        print(f"  {name:<6} {stats['tiles']:>5} kafelków | dryf: średni {stats['mean_drift']:.4f}, "
+              f"p99 {stats['p99_drift']:.4f}, maks. {stats['max_drift']:.4f} | "
+              f"zgodność {stats['agreement']:.2%} {'OK' if stats['passed'] else '<- PONIŻEJ PROGU'}")
+    # Bez żadnego ocenionego zbioru nie ma dowodu zgodności - nie publikujemy
+    if not evaluated:
+        print("BŁĄD: Brak kafelków do oceny modelu INT8 (ani z katalogu, ani ze skanu).")
+        passed = False
+    report["evaluated_sets"] = evaluated
+    report["published"] = passed
+
+    # --- Publikacja tylko po przejściu progów ---
+    if passed:
+        _save_replace(output_path, lambda tmp_path: torch.jit.save(int8_model, tmp_path))
+        print(f"Opublikowano model INT8: {output_path}")
+    else:
+        print(f"BŁĄD: Model INT8 nie spełnia progów (zgodność >= {min_agreement:.2%}, "
+              f"średni dryf <= {max_mean_drift}). Nie publikuję.")
+        # Poprzednio opublikowany model nie przeszedł oceny z bieżącymi wagami i progami -
+        # usuwamy go, żeby backend "int8" nie wczytał modelu bez potwierdzonej zgodności
+        if os.path.exists(output_path):
+            os.remove(output_path)
+            print(f"Usunięto poprzedni model INT8: {output_path}")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Raport kwantyzacji: {report_path}")
+    return output_path if passed else None
+
+
+if __name__ == "__main__":
+    which = sys.argv[1] if len(sys.argv) > 1 else "all"
+    tiles_dir = sys.argv[2] if len(sys.argv) > 2 else CALIBRATION_DIR
+    model_types = list(engine.MODEL_REGISTRY) if which == "all" else [which]
+    results = [quantize(model_type, tiles_dir) for model_type in model_types]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,61 @@
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+# ====================================================================
+#  WSPÓLNY INDEKS REGIONÓW (ROI) DLA SIATKI KAFELKÓW
+# ====================================================================
+#
+#  Zamiast budować Point dla każdego kafelka i sprawdzać .within() dla
+#  każdego poligonu (O(kafelki x poligony) w Pythonie), budujemy raz
+#  STRtree nad poligonami z parse_xml_annotations i odpytujemy go jednym
+#  wektorowym wywołaniem dla środków wszystkich kafelków siatki.
+#  Wymaga shapely >= 2.0.
+
+
+def tile_center_grid(tiles_gen, level: int, tile_size: int):
+    """
+    Współrzędne (poziom 0) środków kafelków siatki na danym poziomie.
+    Zwraca (xs, ys): xs ma długość cols, ys długość rows.
+
+    Tak jak dotychczas: lewy górny róg z get_tile_coordinates + tile_size // 2.
+    Przy overlap=0 współrzędna x zależy tylko od kolumny, a y tylko od wiersza,
+    więc wystarczy cols + rows wywołań zamiast cols * rows.
+    """
+    cols, rows = tiles_gen.level_tiles[level]
+    xs = np.array([tiles_gen.get_tile_coordinates(level, (col, 0))[0][0] for col in range(cols)],
+                  dtype=np.float64)
+    ys = np.array([tiles_gen.get_tile_coordinates(level, (0, row))[0][1] for row in range(rows)],
+                  dtype=np.float64)
+    return xs + (tile_size // 2), ys + (tile_size // 2)
+
+
+class RoiIndex:
+    """Indeks przestrzenny poligonów z adnotacji Sedeen."""
+
+    def __init__(self, polygons: list):
+        self.polygons = list(polygons)
+        self.tree = STRtree(self.polygons)
+
+    def lookup_grid(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """
+        Dla każdego punktu siatki (ys x xs) zwraca indeks PIERWSZEGO poligonu
+        (w kolejności z listy), który go zawiera, albo -1 poza regionami.
+        Wynik ma kształt (rows, cols) - tak jak pętla 'for polygon ...: break'.
+        """
+        n_polygons = len(self.polygons)
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        points = shapely.points(grid_x.ravel(), grid_y.ravel())
+
+        result = np.full(points.shape[0], n_polygons, dtype=np.int64)
+        if n_polygons > 0:
+            point_idx, polygon_idx = self.tree.query(points, predicate="within")
+            np.minimum.at(result, point_idx, polygon_idx)
+        result[result == n_polygons] = -1
+        return result.reshape(len(ys), len(xs))
+
+    def roi_coords(self, tiles_gen, level: int, tile_size: int) -> list:
+        """Lista (col, row) kafelków, których środek leży w którymś z poligonów (kolejność wierszami)."""
+        xs, ys = tile_center_grid(tiles_gen, level, tile_size)
+        rows_idx, cols_idx = np.nonzero(self.lookup_grid(xs, ys) >= 0)
+        return list(zip(cols_idx.tolist(), rows_idx.tolist()))
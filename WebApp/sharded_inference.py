@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import inference_engine as engine
+from heatmap_format import new_heatmap_grid, save_heatmap, load_heatmap
+from slide_stain import get_slide_stain_params
+from tile_pipeline import NUM_READER_THREADS
+from model_export import EXPORTERS, ensure_exported
+
+# ====================================================================
+#  INFERENCJA WIELOPROCESOWA (SHARDY PO WIERSZACH SIATKI)
+# ====================================================================
+#
+#  Jeden proces run_inference() ma jeden uchwyt OpenSlide i jedną pulę wątków
+#  torcha, więc na wielordzeniowej maszynie część rdzeni stoi. Tutaj siatkę
+#  dzielimy na N pasów wierszy z (mniej więcej) równą liczbą kafelków-kandydatów
+#  i każdy pas liczy osobny proces z własnym skanem i kopią modelu. Liczbę
+#  wątków torcha i czytelników na proces dzielimy między procesy, żeby się
+#  nie zagłuszały. Każdy proces liczy wszystkie wybrane modele na swoim pasie
+#  (jeden odczyt kafelka na wszystkie modele, jak w inference_engine.py).
+#  Na końcu częściowe heatmapy (.hmap) każdego modelu są łączone w jedną.
+#
+#  Użycie: python sharded_inference.py [resnet|mobilenet|all] [liczba_procesów]
+
+NUM_SHARDS = os.cpu_count() or 1
+
+
+def module_config(module) -> dict:
+    """Stałe konfiguracyjne modułu (WIELKIE_LITERY, proste typy) - przekazywane do procesów."""
+    return {name: value for name, value in vars(module).items()
+            if name.isupper() and isinstance(value, (bool, int, float, str))}
+
+
+def split_rows(row_counts: np.ndarray, num_shards: int) -> list:
+    """Pasy wierszy [start, stop) z mniej więcej równą liczbą kandydatów w każdym."""
+    total = int(row_counts.sum())
+    cumulative = np.cumsum(row_counts)
+    bounds = [0]
+    for i in range(1, num_shards):
+        bounds.append(int(np.searchsorted(cumulative, total * i / num_shards, side="left")) + 1)
+    bounds.append(len(row_counts))
+    bounds = sorted(set(min(b, len(row_counts)) for b in bounds))
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def _run_shard(config, registry, model_names, row_range, torch_threads, reader_threads, norm_mode,
+               batch_size, shard_paths):
+    """Proces-shard: konfiguracja i rejestr z procesu głównego, inferencja dla pasa wierszy."""
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    for name, value in config.items():
+        setattr(engine, name, value)
+    engine.MODEL_REGISTRY.update(registry)
+
+    start = time.time()
+    results = engine.run_inference(model_names, batch_size=batch_size, num_workers=reader_threads,
+                                   norm_mode=norm_mode, output_paths=shard_paths, checkpoint=False,
+                                   row_range=row_range)
+    return results, time.time() - start
+
+
+def run_sharded(model_names=None, num_shards=NUM_SHARDS, norm_mode=None, batch_size=None,
+                output_paths=None):
+    """
+    Heatmapy wybranych modeli (domyślnie wszystkich) liczone przez num_shards procesów.
+    Zwraca {nazwa: ścieżka połączonej heatmapy} lub None (jak engine.run_inference).
+    """
+    model_names = list(model_names or engine.MODEL_REGISTRY)
+    specs = [engine.MODEL_REGISTRY[name] for name in model_names]
+    norm_mode = norm_mode or engine.NORM_MODE
+    batch_size = batch_size or engine.BATCH_SIZE
+    output_paths = {spec.name: spec.output_path for spec in specs} | (output_paths or {})
+    level, tile_size = engine.TARGET_LEVEL, engine.TILE_SIZE
+
+    # --- Siatka kandydatów (jak w run_inference) - do podziału na równe pasy ---
+    try:
+        slide, tiles_gen = engine.open_scan(engine.PATH_TO_SCAN)
+    except Exception as e:
+        print(f"BŁĄD: Nie udało się otworzyć pliku SVS. Błąd: {e}")
+        return None
+    polygons = engine.parse_xml_annotations(engine.PATH_TO_XML)
+    if not polygons:
+        print("BŁĄD: Nie znaleziono żadnych poligonów w XML. Przerywam.")
+        return None
+
+    cols, rows = tiles_gen.level_tiles[level]
+    _, candidate_coords = engine.candidate_tiles(slide, tiles_gen, polygons)
+    row_counts = np.bincount([row for _, row in candidate_coords], minlength=rows)
+
+    # Macierz barwników liczymy raz tutaj - procesy wczytają ją z pliku obok skanu
+    if norm_mode == "slide":
+        get_slide_stain_params(engine.PATH_TO_SCAN, tiles_gen, level, tile_size,
+                               candidate_coords, engine.has_tissue)
+
+    # Zamrożone grafy eksportujemy raz tutaj - procesy tylko je wczytają (bez N równoległych eksportów)
+    for spec in specs:
+        if spec.backend in EXPORTERS:
+            try:
+                ensure_exported(spec.load_eager, spec.weights, spec.backend, spec.input_size)
+            except Exception as e:
+                print(f"BŁĄD: Eksport modelu {spec.label} do {spec.backend} nie powiódł się. Błąd: {e}")
+                return None
+
+    bands = split_rows(row_counts, max(1, num_shards))
+    cpu_count = os.cpu_count() or 1
+    torch_threads = max(1, cpu_count // len(bands))
+    reader_threads = max(1, min(NUM_READER_THREADS, cpu_count // len(bands)))
+    print(f"Shardy: {len(bands)} procesów x ({torch_threads} wątków torch, {reader_threads} czytelników), "
+          f"{len(candidate_coords)} kandydatów.")
+    for start, stop in bands:
+        print(f"  wiersze {start}-{stop - 1}: {int(row_counts[start:stop].sum())} kandydatów")
+
+    # --- Procesy (spawn: bezpieczne z torch/OpenSlide, niezależne od platformy) ---
+    shard_dir = tempfile.mkdtemp(prefix="heatmap_shards_")
+    config = module_config(engine)
+    registry = {spec.name: spec for spec in specs}
+    start_time = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=len(bands),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_run_shard, config, registry, model_names, band, torch_threads, reader_threads,
+                                   norm_mode, batch_size,
+                                   {name: os.path.join(shard_dir, f"shard_{i}_{name}.hmap") for name in model_names})
+                       for i, band in enumerate(bands)]
+            shard_results = [future.result() for future in futures]
+
+        # --- Łączenie częściowych heatmap każdego modelu (pasy się nie nakładają) ---
+        heatmap_grids = {name: new_heatmap_grid(cols, rows) for name in model_names}
+        for i, (shard_paths, shard_seconds) in enumerate(shard_results):
+            if shard_paths is None:
+                print(f"BŁĄD: Shard {i} nie zwrócił heatmap. Przerywam.")
+                return None
+            # Kafelki ocenione przez którykolwiek model pasa (nie tylko ostatni z pętli)
+            shard_tiles = np.zeros((rows, cols), dtype=bool)
+            for name, shard_path in shard_paths.items():
+                _, shard_grid = load_heatmap(shard_path)
+                analysed = ~np.isnan(shard_grid)
+                heatmap_grids[name][analysed] = shard_grid[analysed]
+                shard_tiles |= analysed
+            print(f"  shard {i}: {int(shard_tiles.sum())} kafelków w {shard_seconds:.1f} s")
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    total_seconds = time.time() - start_time
+    print(f"\nAnaliza wieloprocesowa zakończona w {total_seconds:.2f} sekund "
+          f"({len(candidate_coords) / total_seconds:.1f} kandydatów/s).")
+
+    for spec in specs:
+        output_path = output_paths[spec.name]
+        try:
+            save_heatmap(output_path, heatmap_grids[spec.name], level, tile_size,
+                         tiles_gen.level_dimensions[level], model=spec.name)
+            print(f"Pomyślnie zapisano heatmapę {spec.label} w: {output_path}")
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się zapisać pliku heatmapy. Błąd: {e}")
+            return None
+    return output_paths
+
+
+if __name__ == "__main__":
+    which = sys.argv[1] if len(sys.argv) > 1 else "all"
+    num_shards = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_SHARDS
+    run_sharded(None if which == "all" else [which], num_shards)
@@ -1,4 +1,4 @@
-// static/js/scan.js (Wersja 8.0 - Dynamiczne Generowanie)
+// static/js/scan.js (Wersja 12.0 - Heatmapy obu modeli z jednego zadania)
 
 document.addEventListener('DOMContentLoaded', (event) => {
     
@@ -8,9 +8,20 @@ document.addEventListener('DOMContentLoaded', (event) => {
     const BATCH_SIZE = 500;
     const MIN_CONFIDENCE_THRESHOLD = 0.1; 
     const MAX_OPACITY = 0.5; 
+    const JOB_POLL_INTERVAL_MS = 1000; // Co ile pytamy serwer o postęp zadania
+    // 'canvas' = cała siatka w jednym <canvas> (1 piksel = 1 kafelek) skalowanym przez OSD,
+    // 'dzi'    = piramida kafelków PNG z serwera jako druga warstwa OSD,
+    // 'dom'    = stary sposób (jeden <div> na kafelek, wolny przy dużych siatkach)
+    const HEATMAP_RENDERER = 'canvas';
 
     let viewer;
     let currentOverlays = []; 
+    let heatmapLayer = null;          // Warstwa DZI aktualnie pokazanej heatmapy
+    let heatmapCanvas = null;         // Canvas z siatką (renderer 'canvas')
+    const heatmapImages = {};         // Gotowe ImageData dla każdego typu - przełączanie bez przeliczania
+    let partialRedrawPending = false;
+    let activeHeatmapType = 'none';
+    let heatmapOpacity = MAX_OPACITY;
     const tooltipEl = document.getElementById('heatmap-tooltip');
     const loadingSpinner = document.getElementById('loading-spinner');
     const viewerElement = document.getElementById('openseadragon-viewer');
@@ -43,6 +54,10 @@ document.addEventListener('DOMContentLoaded', (event) => {
         
         // Stwórz kontener na radio buttony (ale na razie go nie dodawaj)
         createOsdControls();
+
+        // Tooltip dla warstwy DZI: pozycja myszy -> (col, row) w siatce heatmapy
+        viewerElement.addEventListener('mousemove', handleHeatmapHover);
+        viewerElement.addEventListener('mouseleave', () => { tooltipEl.style.display = 'none'; });
     }
 
     // --- 3. LOGIKA GENEROWANIA (AJAX/API) ---
@@ -67,8 +82,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
         if (type === 'model-mobilenet') apiType = 'mobilenet';
 
         try {
-            // Wyślij żądanie POST do serwera Flask
-            const response = await fetch('/api/generate_heatmap', {
+            // Zleć zadanie - serwer od razu zwraca jego id, inferencja idzie w tle
+            const response = await fetch('/api/heatmap_jobs', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ type: apiType })
@@ -79,24 +94,159 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 throw new Error(error.message || `Błąd serwera: ${response.status}`);
             }
 
-            const result = await response.json();
+            // Wyniki częściowe przez SSE (rysowane na bieżąco), bez SSE - samo odpytywanie
+            const job = await response.json();
+            const result = (job.status !== 'done' && window.EventSource)
+                ? await streamJob(job, type, apiType)
+                : await waitForJob(job);
             console.log("Serwer odpowiedział:", result.message);
 
-            // Teraz, gdy mamy ścieżkę do pliku, wczytaj go
-            const dataResponse = await fetch(result.json_path);
-            loadedHeatmaps[type] = await dataResponse.json();
+            // Zadanie modeli liczy heatmapy wszystkich modeli naraz ("heatmaps": {typ: adresy})
+            const heatmaps = result.heatmaps || { [apiType]: result };
+            await loadHeatmapFile(type, heatmaps[apiType]);
 
             // Dodaj nowy przycisk radio i narysuj heatmapę
             addRadioButtonToControls(type);
             drawHeatmap(type);
 
+            // Pozostałe modele z tego samego zadania - wczytaj w tle, bez przełączania widoku
+            for (const [otherApiType, urls] of Object.entries(heatmaps)) {
+                const otherType = `model-${otherApiType}`;
+                if (otherApiType === apiType || !(otherType in loadedHeatmaps) || loadedHeatmaps[otherType]) continue;
+                loadHeatmapFile(otherType, urls)
+                    .then(() => addRadioButtonToControls(otherType, false))
+                    .catch(error => console.error(`Nie udało się wczytać heatmapy ${otherType}:`, error));
+            }
+
         } catch (error) {
+            if (loadedHeatmaps[type] && loadedHeatmaps[type].partial) {
+                loadedHeatmaps[type] = null;
+                delete heatmapImages[type];
+                if (activeHeatmapType === type) drawHeatmap('none');
+            }
             console.error("Błąd podczas generowania:", error);
             alert(`Wystąpił błąd: ${error.message}`);
         } finally {
             // Ukryj spinner
             loadingSpinner.style.display = 'none';
+            loadingSpinner.textContent = 'Generating...';
+        }
+    }
+
+    // Pobiera i parsuje gotowy plik .hmap (zastępuje ewentualne wyniki częściowe)
+    async function loadHeatmapFile(type, urls) {
+        const dataResponse = await fetch(urls.heatmap_path);
+        if (!dataResponse.ok) {
+            throw new Error(`Nie udało się pobrać heatmapy: ${dataResponse.status}`);
         }
+        loadedHeatmaps[type] = parseHeatmap(await dataResponse.arrayBuffer());
+        loadedHeatmaps[type].dziPath = urls.dzi_path;
+        delete heatmapImages[type];
+    }
+
+    // Plik .hmap: "HMAP" | uint32 LE długość nagłówka | nagłówek JSON | rows*cols bajtów
+    // (0..254 = prawdopodobieństwo * scale, nodata = kafelek nieanalizowany)
+    function parseHeatmap(buffer) {
+        const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+        if (magic !== 'HMAP') {
+            throw new Error('Nieprawidłowy plik heatmapy');
+        }
+        const headerLength = new DataView(buffer).getUint32(4, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+        const values = new Uint8Array(buffer, 8 + headerLength, header.rows * header.cols);
+        return { header, values };
+    }
+
+    // Strumień SSE zadania: siatka wypełniana paczkami wyników w trakcie inferencji.
+    // Zadanie modeli wysyła paczki wszystkich modeli - rysujemy tylko te z "model" === apiType.
+    // Zwraca stan zakończonego zadania (jak waitForJob).
+    function streamJob(job, type, apiType) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/api/heatmap_jobs/${job.job_id}/stream`);
+            let partial = null;
+            showJobProgress(job);
+
+            source.addEventListener('header', (e) => {
+                const header = JSON.parse(e.data);
+                // Częściowe wyniki rysujemy tylko dla modeli i tylko na canvasie
+                if (!type.startsWith('model-') || HEATMAP_RENDERER !== 'canvas') return;
+                const values = new Uint8Array(header.rows * header.cols).fill(header.nodata);
+                partial = { header, values, partial: true };
+                loadedHeatmaps[type] = partial;
+                addRadioButtonToControls(type);
+                drawHeatmap(type);
+            });
+
+            source.addEventListener('tiles', (e) => {
+                const update = JSON.parse(e.data);
+                showJobProgress(update);
+                if (!partial || (update.model && update.model !== apiType)) return;
+                for (const [col, row, value] of update.tiles) {
+                    partial.values[row * partial.header.cols + col] = value;
+                }
+                schedulePartialRedraw(type);
+            });
+
+            source.addEventListener('progress', (e) => showJobProgress(JSON.parse(e.data)));
+
+            source.addEventListener('done', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+
+            source.addEventListener('error', (e) => {
+                source.close();
+                if (e.data) {
+                    // Zdarzenie 'error' wysłane przez serwer (zadanie się nie powiodło)
+                    reject(new Error(JSON.parse(e.data).error || 'Generowanie nie powiodło się'));
+                } else {
+                    // Zerwane połączenie - dokończ zwykłym odpytywaniem
+                    waitForJob(job).then(resolve, reject);
+                }
+            });
+        });
+    }
+
+    // Przerysowanie częściowej heatmapy najwyżej raz na klatkę
+    function schedulePartialRedraw(type) {
+        if (partialRedrawPending) return;
+        partialRedrawPending = true;
+        requestAnimationFrame(() => {
+            partialRedrawPending = false;
+            delete heatmapImages[type];
+            if (activeHeatmapType === type) drawHeatmap(type);
+        });
+    }
+
+    // Odpytuje serwer o stan zadania, aż się skończy; po drodze pokazuje postęp
+    async function waitForJob(job) {
+        while (job.status === 'queued' || job.status === 'running') {
+            showJobProgress(job);
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+
+            const response = await fetch(`/api/heatmap_jobs/${job.job_id}`);
+            if (!response.ok) {
+                const error = await response.json();
+                throw new Error(error.message || `Błąd serwera: ${response.status}`);
+            }
+            job = await response.json();
+        }
+        if (job.status !== 'done') {
+            throw new Error(job.error || 'Generowanie nie powiodło się');
+        }
+        return job;
+    }
+
+    function showJobProgress(job) {
+        let text = job.status === 'queued' ? 'Waiting in queue...' : 'Generating...';
+        if (job.total > 0) {
+            const percent = Math.floor(100 * job.done / job.total);
+            text += ` ${job.done}/${job.total} (${percent}%)`;
+        }
+        if (job.eta_seconds !== null) {
+            text += ` ETA ${Math.ceil(job.eta_seconds)} s`;
+        }
+        loadingSpinner.textContent = text;
     }
 
     // --- 4. DYNAMICZNE TWORZENIE KONTROLEK OSD ---
@@ -107,10 +257,34 @@ document.addEventListener('DOMContentLoaded', (event) => {
         controlsContainer.className = "heatmap-controls-overlay";
         // Domyślnie dodajemy "Ukryj"
         controlsContainer.appendChild(createRadioButton("radio-none-overlay", "none", "Hide", false));
+        controlsContainer.appendChild(createOpacitySlider());
+    }
+
+    // Suwak przezroczystości warstwy heatmapy
+    function createOpacitySlider() {
+        const sliderLabel = document.createElement("label");
+        sliderLabel.className = "heatmap-opacity";
+        const slider = document.createElement("input");
+        slider.type = "range";
+        slider.min = "0";
+        slider.max = "1";
+        slider.step = "0.05";
+        slider.value = String(heatmapOpacity);
+
+        slider.addEventListener('input', () => {
+            heatmapOpacity = parseFloat(slider.value);
+            if (heatmapLayer) heatmapLayer.setOpacity(heatmapOpacity);
+            if (heatmapCanvas) heatmapCanvas.style.opacity = String(heatmapOpacity);
+        });
+
+        sliderLabel.appendChild(document.createTextNode("Opacity"));
+        sliderLabel.appendChild(slider);
+        return sliderLabel;
     }
     
     // Dodaje NOWY przycisk do kontenera
-    function addRadioButtonToControls(type) {
+    // select = false: tylko dodaj przycisk (np. heatmapa wczytana w tle), nie zaznaczaj
+    function addRadioButtonToControls(type, select = true) {
         let label = "";
         if (type === 'model-resnet') label = "Prediction (ResNet)";
         if (type === 'truth') label = "Real adnotations";
@@ -120,17 +294,17 @@ document.addEventListener('DOMContentLoaded', (event) => {
         
         // Nie dodawaj, jeśli już istnieje
         if (document.getElementById(radioId)) {
-            document.getElementById(radioId).checked = true; // Po prostu zaznacz
+            if (select) document.getElementById(radioId).checked = true; // Po prostu zaznacz
             return;
         }
 
-        const newRadio = createRadioButton(radioId, type, label, true);
+        const newRadio = createRadioButton(radioId, type, label, select);
         
         // Dodaj na początek listy (przed "Ukryj")
         controlsContainer.prepend(newRadio);
         
         // Jeśli to pierwszy przycisk, dodaj cały kontener do OSD
-        if (controlsContainer.childElementCount === 2) { // (bo "Ukryj" już tam jest)
+        if (controlsContainer.querySelectorAll('input[type="radio"]').length === 2) { // (bo "Ukryj" już tam jest)
              viewer.addControl(controlsContainer, {
                 anchor: OpenSeadragon.ControlAnchor.NONE
              });
@@ -155,8 +329,185 @@ document.addEventListener('DOMContentLoaded', (event) => {
     }
 
 
-    // --- 5. FUNKCJA DO RYSOWANIA (taka jak w Wersji 6.0) ---
+    // --- 5. FUNKCJE DO RYSOWANIA ---
+
+    // Tekst tooltipa dla kafelka o danym prawdopodobieństwie (null = nic nie pokazujemy)
+    function tooltipTextFor(dataType, probability) {
+        const className = probability > 0.5 ? 'Tumor' : 'Healthy';
+        const confidence = Math.abs(probability - 0.5) * 2;
+        if (!dataType.startsWith('model-')) {
+            return `Actual: ${className}`;
+        }
+        if (confidence < MIN_CONFIDENCE_THRESHOLD) return null;
+        return `Predcition: ${className}<br>Confidence: ${(confidence * 100).toFixed(1)}%`;
+    }
+
+    // Tooltip przy kursorze, przycięty do granic viewer-a
+    function showTooltip(e, text) {
+        tooltipEl.innerHTML = text;
+        tooltipEl.style.display = 'block';
+
+        const rect = viewerElement.getBoundingClientRect();
+        const tooltipWidth  = tooltipEl.offsetWidth;
+        const tooltipHeight = tooltipEl.offsetHeight;
+
+        // Pozycje RELATYWNIE do kontenera viewer-a
+        let x = e.clientX - rect.left + 15;
+        let y = e.clientY - rect.top  + 15;
+
+        // Clamp w poziomie (żeby nie wychodził poza viewer)
+        if (x + tooltipWidth > rect.width - 10) {
+            x = rect.width - tooltipWidth - 10;
+        }
+        if (x < 10) x = 10;
+
+        // Clamp w pionie
+        if (y + tooltipHeight > rect.height - 10) {
+            y = rect.height - tooltipHeight - 10;
+        }
+        if (y < 10) y = 10;
+
+        tooltipEl.style.left = x + "px";
+        tooltipEl.style.top  = y + "px";
+    }
+
+    // Kafelek siatki heatmapy pod kursorem: {col, row, probability} albo null
+    function heatmapCellAt(e, data) {
+        const scan = viewer.world.getItemAt(0);
+        if (!scan) return null;
+        const rect = viewerElement.getBoundingClientRect();
+        const point = new OpenSeadragon.Point(e.clientX - rect.left, e.clientY - rect.top);
+        const imagePoint = scan.viewerElementToImageCoordinates(point);
+
+        // Piksele pełnej rozdzielczości -> piksele poziomu, na którym liczono siatkę
+        const { header, values } = data;
+        const scale = header.level_width / scan.source.dimensions.x;
+        const col = Math.floor(imagePoint.x * scale / header.tile_size);
+        const row = Math.floor(imagePoint.y * scale / header.tile_size);
+        if (col < 0 || row < 0 || col >= header.cols || row >= header.rows) return null;
+
+        const value = values[row * header.cols + col];
+        if (value === header.nodata) return null;
+        return { col, row, probability: value / header.scale };
+    }
+
+    function handleHeatmapHover(e) {
+        if (HEATMAP_RENDERER === 'dom' || activeHeatmapType === 'none') return;
+        const data = loadedHeatmaps[activeHeatmapType];
+        const cell = data ? heatmapCellAt(e, data) : null;
+        const text = cell ? tooltipTextFor(activeHeatmapType, cell.probability) : null;
+        if (text) {
+            showTooltip(e, text);
+        } else {
+            tooltipEl.style.display = 'none';
+        }
+    }
+
     function drawHeatmap(dataType) {
+        activeHeatmapType = dataType;
+        if (HEATMAP_RENDERER === 'canvas') {
+            showHeatmapCanvas(dataType);
+        } else if (HEATMAP_RENDERER === 'dzi') {
+            showHeatmapLayer(dataType);
+        } else {
+            drawHeatmapOverlays(dataType);
+        }
+    }
+
+    // Siatka -> ImageData (cols x rows): czerwony = guz, zielony = zdrowe, alfa = pewność
+    function heatmapImageData(dataType) {
+        if (heatmapImages[dataType]) return heatmapImages[dataType];
+
+        const { header, values } = loadedHeatmaps[dataType];
+        const minConfidence = dataType.startsWith('model-') ? MIN_CONFIDENCE_THRESHOLD : 0;
+        const image = new ImageData(header.cols, header.rows);
+        const pixels = image.data;
+        for (let k = 0; k < values.length; k++) {
+            if (values[k] === header.nodata) continue;   // Przezroczysty (alfa = 0)
+            const probability = values[k] / header.scale;
+            const confidence = Math.abs(probability - 0.5) * 2;
+            if (confidence < minConfidence) continue;
+            const tumor = probability > 0.5;
+            pixels[4 * k]     = tumor ? 255 : 0;
+            pixels[4 * k + 1] = tumor ? 0 : 255;
+            pixels[4 * k + 2] = 0;
+            pixels[4 * k + 3] = Math.round(confidence * 255);
+        }
+        heatmapImages[dataType] = image;
+        return image;
+    }
+
+    // Obszar siatki w koordynatach viewport-u (ostatnie kafelki wystają poza skan)
+    function heatmapGridBounds(header) {
+        const scanBounds = viewer.world.getItemAt(0).getBounds();
+        const unitsPerLevelPixel = scanBounds.width / header.level_width;
+        return new OpenSeadragon.Rect(
+            scanBounds.x,
+            scanBounds.y,
+            header.cols * header.tile_size * unitsPerLevelPixel,
+            header.rows * header.tile_size * unitsPerLevelPixel
+        );
+    }
+
+    // Canvas: jeden element-overlay, który OSD tylko przesuwa i skaluje przy pan/zoom.
+    // Przełączenie heatmapy = podmiana pikseli (putImageData), bez dodawania elementów.
+    function showHeatmapCanvas(dataType) {
+        tooltipEl.style.display = 'none';
+        const data = loadedHeatmaps[dataType];
+        if (dataType === 'none' || !data) {
+            if (heatmapCanvas) heatmapCanvas.style.display = 'none';
+            return;
+        }
+
+        const { header } = data;
+        const bounds = heatmapGridBounds(header);
+        if (!heatmapCanvas) {
+            heatmapCanvas = document.createElement('canvas');
+            heatmapCanvas.className = 'heatmap-canvas';
+            viewer.addOverlay({ element: heatmapCanvas, location: bounds });
+        } else {
+            viewer.updateOverlay(heatmapCanvas, bounds);
+        }
+        heatmapCanvas.width = header.cols;
+        heatmapCanvas.height = header.rows;
+        heatmapCanvas.getContext('2d').putImageData(heatmapImageData(dataType), 0, 0);
+        heatmapCanvas.style.opacity = String(heatmapOpacity);
+        heatmapCanvas.style.display = 'block';
+    }
+
+    // Warstwa DZI: podmiana drugiego obrazu w OpenSeadragon (kafelki renderuje serwer)
+    function showHeatmapLayer(dataType) {
+        console.log(`Pokazuję warstwę heatmapy: ${dataType}`);
+        tooltipEl.style.display = 'none';
+        if (heatmapLayer) {
+            viewer.world.removeItem(heatmapLayer);
+            heatmapLayer = null;
+        }
+        const data = loadedHeatmaps[dataType];
+        if (dataType === 'none' || !data) return;
+
+        // Heatmapa pokrywa dokładnie ten sam obszar co skan
+        const scanBounds = viewer.world.getItemAt(0).getBounds();
+        viewer.addTiledImage({
+            tileSource: data.dziPath,
+            x: scanBounds.x,
+            y: scanBounds.y,
+            width: scanBounds.width,
+            opacity: heatmapOpacity,
+            success: (event) => {
+                // Użytkownik mógł w międzyczasie przełączyć warstwę
+                if (activeHeatmapType !== dataType || heatmapLayer) {
+                    viewer.world.removeItem(event.item);
+                    return;
+                }
+                heatmapLayer = event.item;
+            },
+            error: (event) => console.error("Nie udało się wczytać warstwy heatmapy:", event.message)
+        });
+    }
+
+    // Stary renderer: jeden <div> na kafelek (HEATMAP_RENDERER = 'dom')
+    function drawHeatmapOverlays(dataType) {
         console.log(`Rysuję heatmapę dla: ${dataType}`);
         currentOverlays.forEach(overlayElement => viewer.removeOverlay(overlayElement));
         currentOverlays = [];
@@ -171,20 +522,25 @@ document.addEventListener('DOMContentLoaded', (event) => {
             return;
         }
         
-        // Reszta tej funkcji jest DOKŁADNIE TAKA SAMA jak w Wersji 6.0
-        // (pętla 'processBatch', logika tooltipa, itd.)
-        // ... (skopiuj tutaj resztę funkcji drawHeatmap z Wersji 6.0) ...
-        // ...
-        const entries = Object.entries(data);
+        const { header, values } = data;
+        if (header.level !== TARGET_LEVEL) {
+            console.warn(`Heatmapa jest na poziomie ${header.level}, oczekiwano ${TARGET_LEVEL}.`);
+            return;
+        }
+        const level = header.level;
+
+        // Indeksy analizowanych kafelków w siatce (wiersz po wierszu)
+        const indices = [];
+        for (let k = 0; k < values.length; k++) {
+            if (values[k] !== header.nodata) indices.push(k);
+        }
         let i = 0;
         function processBatch() {
-             for (let j = 0; j < BATCH_SIZE && i < entries.length; j++, i++) {
-                const [tileKey, probability] = entries[i];
-                const parts = tileKey.split('_');
-                const level = parseInt(parts[0]);
-                const col = parseInt(parts[1]);
-                const row = parseInt(parts[2]);
-                if (level !== TARGET_LEVEL) continue;
+             for (let j = 0; j < BATCH_SIZE && i < indices.length; j++, i++) {
+                const index = indices[i];
+                const col = index % header.cols;
+                const row = Math.floor(index / header.cols);
+                const probability = values[index] / header.scale;
                 let r, g, b, opacity, confidence, className;
                 if (probability > 0.5) { // TUMOR
                     r = 255; g = 0; b = 0;
@@ -203,44 +559,9 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 const rect = viewer.source.getTileBounds(level, col, row);
                 const overlayEl = document.createElement("div");
                 overlayEl.style.backgroundColor = `rgba(${r}, ${g}, ${b}, ${opacity})`;
-                let tooltipText = "";
-                if (dataType.startsWith('model-')) {
-                    const confidencePercent = (confidence * 100).toFixed(1);
-                    tooltipText = `Predcition: ${className}<br>Confidence: ${confidencePercent}%`;
-                } else {
-                    tooltipText = `Actual: ${className}`;
-                }
-                overlayEl.addEventListener('mouseover', (e) => {
-                    tooltipEl.innerHTML = tooltipText; 
-                    tooltipEl.style.display = 'block';
-                });
-                overlayEl.addEventListener('mousemove', (e) => {
-                    tooltipEl.innerHTML = tooltipText;
-                    tooltipEl.style.display = 'block';
-                
-                    const rect = viewerElement.getBoundingClientRect();
-                    const tooltipWidth  = tooltipEl.offsetWidth;
-                    const tooltipHeight = tooltipEl.offsetHeight;
-                
-                    // Pozycje RELATYWNIE do kontenera viewer-a
-                    let x = e.clientX - rect.left + 15;
-                    let y = e.clientY - rect.top  + 15;
-                
-                    // Clamp w poziomie (żeby nie wychodził poza viewer)
-                    if (x + tooltipWidth > rect.width - 10) {
-                        x = rect.width - tooltipWidth - 10;
-                    }
-                    if (x < 10) x = 10;
-                
-                    // Clamp w pionie
-                    if (y + tooltipHeight > rect.height - 10) {
-                        y = rect.height - tooltipHeight - 10;
-                    }
-                    if (y < 10) y = 10;
-                
-                    tooltipEl.style.left = x + "px";
-                    tooltipEl.style.top  = y + "px";
-                });
+                const tooltipText = tooltipTextFor(dataType, probability);
+                overlayEl.addEventListener('mouseover', (e) => showTooltip(e, tooltipText));
+                overlayEl.addEventListener('mousemove', (e) => showTooltip(e, tooltipText));
                 
                 
 
@@ -253,7 +574,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
                 });
                 currentOverlays.push(overlayEl); 
             }
-            if (i < entries.length) {
+            if (i < indices.length) {
                 setTimeout(processBatch, 0); 
             } else {
                 console.log(`Rysowanie zakończone. Narysowano ${currentOverlays.length} kafelków.`);
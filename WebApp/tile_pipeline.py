@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+
+# ====================================================================
+#  POTOK PRODUCENT/KONSUMENT DLA KAFELKÓW
+# ====================================================================
+#
+#  Wątki-czytelnicy pobierają kafelki z DeepZoomGenerator (dekodowanie
+#  OpenSlide), filtrują tkankę, normalizują Macenko i wrzucają gotowe
+#  tensory do ograniczonej kolejki. Wątek główny (model) tylko ją opróżnia.
+#  OpenSlide, dekodowanie JPEG i numpy zwalniają GIL, więc wątki wystarczą.
+#  Ograniczona kolejka = backpressure: czytelnicy czekają, gdy model nie
+#  nadąża, więc pamięć nie rośnie nawet na gigapikselowych skanach.
+#  Z deadline (time.perf_counter()) czytelnicy nie zaczynają nowych kafelków po
+#  jego upływie, a generator kończy się bez czekania na nich (limit czasu).
+
+NUM_READER_THREADS = 4
+PREFETCH_CHUNKS = 8     # Maks. liczba gotowych paczek czekających w kolejce
+CHUNK_SIZE = 32         # Ile współrzędnych bierze czytelnik za jednym razem
+
+_DONE = object()
+
+
+class _WorkerError:
+    """Opakowanie wyjątku z wątku-czytelnika, rzucanego ponownie w konsumencie."""
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(q, item, stop_event):
+    """put() z timeoutem, żeby wątek nie zawisł, gdy konsument się zatrzymał."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _prepare_chunk(prepare_tiles, tiles):
+    """
+    prepare_tiles na całej paczce; po błędzie ponawia kafelek po kafelku i pomija
+    tylko te, które zawodzą - reszta paczki nie przepada.
+    """
+    try:
+        return prepare_tiles(tiles)
+    except Exception as e:
+        print(f"OSTRZEŻENIE: Błąd paczki {len(tiles)} kafelków ({e}) - ponawiam kafelek po kafelku.")
+    ready = []
+    for col, row, tile in tiles:
+        try:
+            ready.extend(prepare_tiles([(col, row, tile)]))
+        except Exception as e:
+            print(f"OSTRZEŻENIE: Pomijam kafelek ({col}, {row}). Błąd: {e}")
+    return ready
+
+
+def _expired(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def _reader(tiles_gen, level, chunks, out_q, prepare_tiles, stop_event, deadline=None):
+    try:
+        while not stop_event.is_set():
+            try:
+                chunk = chunks.get_nowait()
+            except queue.Empty:
+                break
+
+            tiles = []
+            for col, row in chunk:
+                if _expired(deadline):
+                    return   # Niepełnej paczki nie oddajemy - jej kafelki zostają nieocenione
+                try:
+                    tiles.append((col, row, tiles_gen.get_tile(level, (col, row))))
+                except Exception:
+                    continue  # Jak wcześniej: błędny kafelek po prostu pomijamy
+
+            # Cała paczka naraz (np. wsadowa normalizacja Macenko)
+            ready = _prepare_chunk(prepare_tiles, tiles) if tiles else []
+
+            if not _put(out_q, (chunk, ready), stop_event):
+                return
+    except Exception as e:
+        _put(out_q, _WorkerError(e), stop_event)
+    finally:
+        _put(out_q, _DONE, stop_event)
+
+
+def iter_prepared_tiles(tiles_gen, level, coords, prepare_tiles,
+                        num_workers=NUM_READER_THREADS,
+                        prefetch_chunks=PREFETCH_CHUNKS,
+                        chunk_size=CHUNK_SIZE,
+                        deadline=None):
+    """
+    Generator gotowych kafelków z puli wątków-czytelników.
+
+    coords        - lista (col, row) do wczytania (już po filtrze ROI)
+    prepare_tiles - funkcja [(col, row, PIL), ...] -> [(col, row, tensor), ...],
+                    pomija kafelki odrzucone (np. brak tkanki, błąd normalizacji)
+    deadline      - opcjonalny koniec limitu czasu (time.perf_counter()): po nim
+                    czytelnicy przestają czytać, a generator kończy się od razu
+
+    Zwraca kolejne paczki (wczytane_współrzędne, [(col, row, tensor), ...]).
+    Kolejność paczek nie jest zachowana - wynik identyfikują (col, row).
+    """
+    chunks = queue.Queue()
+    for i in range(0, len(coords), chunk_size):
+        chunks.put(coords[i:i + chunk_size])
+
+    out_q = queue.Queue(maxsize=prefetch_chunks)
+    stop_event = threading.Event()
+    num_workers = max(1, min(num_workers, chunks.qsize()))
+
+    workers = [
+        threading.Thread(target=_reader,
+                         args=(tiles_gen, level, chunks, out_q, prepare_tiles, stop_event, deadline),
+                         daemon=True)
+        for _ in range(num_workers)
+    ]
+    for w in workers:
+        w.start()
+
+    finished = 0
+    try:
+        while finished < num_workers:
+            try:
+                item = out_q.get(timeout=None if deadline is None else max(deadline - time.perf_counter(), 0.0))
+            except queue.Empty:
+                break   # Limit czasu minął - nie czekamy na czytelników
+            if item is _DONE:
+                finished += 1
+            elif isinstance(item, _WorkerError):
+                raise item.exc
+            else:
+                yield item
+    finally:
+        # Konsument skończył (lub przerwał) - zatrzymaj czytelników
+        # (po limicie czasu nie czekamy: wątki są daemon i kończą po bieżącym kafelku)
+        stop_event.set()
+        for w in workers:
+            w.join(timeout=0.0 if _expired(deadline) else 1.0)
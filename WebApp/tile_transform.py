@@ -0,0 +1,110 @@
+import sys
+import time
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+from torchvision import transforms
+
+# ====================================================================
+#  PRZYGOTOWANIE WEJŚĆ MODELI NA TENSORACH (BEZ PIL)
+# ====================================================================
+#
+#  Transformacja walidacyjna z treningu (Resize(S + 32) -> CenterCrop(S) ->
+#  ToTensor -> Normalize) na PIL robi po normalizacji Macenko kilka kopii
+#  kafelka: Image.fromarray, przeskalowany obraz, tensor float, tensor po
+#  Normalize. Tutaj cały stos kafelków uint8 (N, H, W, 3) jednego rozmiaru:
+#    - torch.from_numpy + permute: widok bez kopii (N, 3, H, W),
+#    - Resize tylko gdy krótszy bok != S + 32 (pełne kafelki 256 px go nie
+#      potrzebują - PIL też zwraca je bez zmian), na uint8 z antyaliasingiem,
+#    - CenterCrop: widok,
+#    - jedna konwersja do float32 z wtopionym ToTensor + Normalize
+#      (x * 1/(255 * std) - mean/std).
+#  Pełne kafelki dają dokładnie ten sam tensor co val_transform; kafelki
+#  brzegowe (skalowane) różnią się o najwyżej 1 poziom uint8 (inne zaokrąglenie
+#  interpolacji w PIL i torch).
+#
+#  Użycie: python tile_transform.py - test zgodności z val_transform.
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+RESIZE_MARGIN = 32   # Resize(S + 32) przed CenterCrop(S), jak w treningu
+
+_SCALE = (1.0 / (255.0 * torch.tensor(IMAGENET_STD))).view(1, 3, 1, 1)
+_SHIFT = (torch.tensor(IMAGENET_MEAN) / torch.tensor(IMAGENET_STD)).view(1, 3, 1, 1)
+
+# Test zgodności: pełne kafelki - identyczne, skalowane - maks. 1 poziom uint8 (z zapasem)
+PARITY_EXACT_TOLERANCE = 1e-5
+PARITY_RESIZED_TOLERANCE = 1.5 / 255 / min(IMAGENET_STD)
+PARITY_SHAPES = [(256, 256), (256, 97), (131, 256), (300, 400)]   # (H, W): pełny, brzegowe, większy
+
+
+def val_transform(input_size):
+    """Transformacja walidacyjna z treningu (PIL) - wzorzec dla to_model_inputs."""
+    return transforms.Compose([
+        transforms.Resize(input_size + RESIZE_MARGIN),
+        transforms.CenterCrop(input_size),
+        transforms.ToTensor(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    ])
+
+
+def to_model_inputs(images, input_size):
+    """
+    Stos kafelków uint8 (N, H, W, 3) jednego rozmiaru -> wejścia modelu (N, 3, S, S) float32,
+    tak jak val_transform(S) dla każdego kafelka osobno.
+    """
+    batch = torch.from_numpy(np.ascontiguousarray(images, dtype=np.uint8)).permute(0, 3, 1, 2)
+    if min(batch.shape[-2:]) != input_size + RESIZE_MARGIN:
+        # Kafelki brzegowe: ciągły układ NCHW przyspiesza interpolację
+        batch = TF.resize(batch.contiguous(), input_size + RESIZE_MARGIN, antialias=True)
+    batch = TF.center_crop(batch, input_size)
+    return batch.float().mul_(_SCALE).sub_(_SHIFT)
+
+
+# ====================================================================
+#  TEST ZGODNOŚCI Z val_transform
+# ====================================================================
+
+def parity_images(shapes=PARITY_SHAPES, per_shape=8, seed=0):
+    """Gładkie obrazy testowe z szumem (jak tkanka, nie czysty szum) dla każdego rozmiaru."""
+    rng = np.random.default_rng(seed)
+    images = {}
+    for height, width in shapes:
+        stack = []
+        for _ in range(per_shape):
+            coarse = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+            img = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR), dtype=np.int16)
+            stack.append(np.clip(img + rng.integers(-16, 17, img.shape), 0, 255).astype(np.uint8))
+        images[(height, width)] = np.stack(stack)
+    return images
+
+
+def parity_check(input_size=224, images=None):
+    """Porównuje to_model_inputs z val_transform; zwraca True, gdy mieści się w tolerancji."""
+    images = images or parity_images()
+    reference_transform = val_transform(input_size)
+    all_ok = True
+    print(f"{'rozmiar':<12}{'kafelki':>8}{'PIL [ms]':>10}{'tensor [ms]':>13}{'maks. różnica':>15}{'tolerancja':>12}")
+    for (height, width), stack in images.items():
+        start = time.perf_counter()
+        reference = torch.stack([reference_transform(Image.fromarray(img)) for img in stack])
+        pil_ms = (time.perf_counter() - start) * 1000 / len(stack)
+        start = time.perf_counter()
+        inputs = to_model_inputs(stack, input_size)
+        tensor_ms = (time.perf_counter() - start) * 1000 / len(stack)
+
+        resized = min(height, width) != input_size + RESIZE_MARGIN
+        tolerance = PARITY_RESIZED_TOLERANCE if resized else PARITY_EXACT_TOLERANCE
+        max_diff = float((inputs - reference).abs().max()) if inputs.shape == reference.shape else float("inf")
+        ok = max_diff <= tolerance
+        all_ok &= ok
+        print(f"{f'{height}x{width}':<12}{len(stack):>8}{pil_ms:>10.2f}{tensor_ms:>13.2f}{max_diff:>15.2e}"
+              f"{tolerance:>12.2e}{'' if ok else '  <- POZA TOLERANCJĄ'}")
+    return all_ok
+
+
+if __name__ == "__main__":
+    ok = parity_check()
+    print("\nZgodność z val_transform: OK" if ok else "\nBŁĄD: Wejścia modelu różnią się od val_transform.")
+    sys.exit(0 if ok else 1)
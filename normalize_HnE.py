@@ -37,6 +37,9 @@ Output: Optimal Stain Vectors
 
 """
 
+import json
+import os
+import threading
 import numpy as np
 import cv2
 from matplotlib import pyplot as plt
@@ -56,8 +59,15 @@ from matplotlib import pyplot as plt
 # beta = 0.15 #As recommended in the paper. OD threshold for transparent pixels (default: 0.15)
 
 
-def norm_HnE(img, Io=240, alpha=1, beta=0.15):
+def norm_HnE(img, Io=240, alpha=1, beta=0.15, return_HE=True):
 
+    # Fast path: only the normalized image is needed (H and E are skipped).
+    # Uses the batched float32 version below on a batch of one tile.
+    if not return_HE:
+        Inorm, ok = norm_HnE_batch(img[np.newaxis], Io=Io, alpha=alpha, beta=beta)
+        if not ok[0]:
+            raise ValueError("Too few tissue pixels to estimate the stain vectors")
+        return Inorm[0]
 
     ######## Step 1: Convert RGB to OD ###################
     ## reference H&E OD matrix.
@@ -154,6 +164,200 @@ def norm_HnE(img, Io=240, alpha=1, beta=0.15):
     
     return (Inorm, H, E)
 
+
+############### BATCHED VERSION #######################
+# Same Macenko steps as norm_HnE, but for a stack of tiles (N, H, W, 3) at once:
+# - only the normalized image is computed (no H and E images),
+# - per-pixel work in float32, RGB -> OD through a 256-entry lookup table,
+# - covariance, eigh, percentiles and least squares vectorized across the batch,
+# - tiles with too few tissue pixels are returned unchanged with ok=False
+#   instead of raising.
+
+# reference H&E OD matrix and maximum stain concentrations (same as in norm_HnE)
+HE_REF = np.array([[0.5626, 0.2159],
+                   [0.7201, 0.8012],
+                   [0.4062, 0.5581]], dtype=np.float32)
+MAX_C_REF = np.array([1.9705, 1.0308], dtype=np.float32)
+
+# minimum number of pixels above beta needed to estimate the stain vectors
+MIN_TISSUE_PIXELS = 10
+
+
+def _od_lut(Io):
+    # OD for every possible uint8 value: -log10((I+1)/Io)
+    return -np.log10((np.arange(256, dtype=np.float32) + 1) / np.float32(Io))
+
+
+def _masked_percentile(values, mask, counts, q):
+    # np.percentile (linear interpolation) of each row, using only the masked values
+    v = np.where(mask, values, np.inf)
+    v.sort(axis=1)
+    pos = (counts - 1) * (q / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, counts - 1)
+    frac = (pos - lo).astype(values.dtype)
+    v_lo = np.take_along_axis(v, lo[:, np.newaxis], axis=1)[:, 0]
+    v_hi = np.take_along_axis(v, hi[:, np.newaxis], axis=1)[:, 0]
+    return v_lo + (v_hi - v_lo) * frac
+
+
+def norm_HnE_batch(imgs, Io=240, alpha=1, beta=0.15, min_tissue_pixels=MIN_TISSUE_PIXELS):
+    """
+    imgs: (N, H, W, 3) uint8 stack of RGB tiles of the same size.
+    Returns (Inorm, ok): Inorm is (N, H, W, 3) uint8, ok is (N,) bool.
+    Tiles with ok=False could not be normalized and are returned unchanged.
+    """
+    imgs = np.asarray(imgs, dtype=np.uint8)
+    n, h, w, c = imgs.shape
+    out = imgs.copy()
+
+    ######## Step 1: Convert RGB to OD (lookup table) ########
+    OD = _od_lut(Io)[imgs.reshape(n, -1, 3)]                   # (N, P, 3)
+
+    ######## Step 2: Remove data with OD intensity less than beta ########
+    tissue = ~np.any(OD < beta, axis=2)                         # (N, P)
+    counts = tissue.sum(axis=1)
+    ok = counts >= max(min_tissue_pixels, 2)
+    if not ok.any():
+        return out, ok
+
+    idx = np.nonzero(ok)[0]
+    OD, tissue, counts = OD[idx], tissue[idx], counts[idx]
+
+    ######## Step 3: Covariance of the tissue pixels and eigenvectors ########
+    weights = tissue.astype(np.float32)[:, :, np.newaxis]
+    mean = (OD * weights).sum(axis=1) / counts[:, np.newaxis]
+    centered = (OD - mean[:, np.newaxis, :]) * weights
+    cov = np.matmul(centered.transpose(0, 2, 1), centered).astype(np.float64)
+    cov /= (counts - 1)[:, np.newaxis, np.newaxis]
+    # the 3x3 eigen problem stays in float64 so eigenvector signs match norm_HnE
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    V = eigvecs[:, :, 1:3].astype(np.float32)                  # (N, 3, 2)
+
+    ######## Steps 4-6: Project on the plane and compute angles ########
+    That = np.matmul(OD, V)                                    # (N, P, 2)
+    phi = np.arctan2(That[:, :, 1], That[:, :, 0])
+
+    minPhi = _masked_percentile(phi, tissue, counts, alpha)
+    maxPhi = _masked_percentile(phi, tissue, counts, 100 - alpha)
+
+    vMin = np.matmul(V, np.stack((np.cos(minPhi), np.sin(minPhi)), axis=1)[:, :, np.newaxis])[:, :, 0]
+    vMax = np.matmul(V, np.stack((np.cos(maxPhi), np.sin(maxPhi)), axis=1)[:, :, np.newaxis])[:, :, 0]
+
+    # hematoxylin first, eosin second
+    h_first = (vMin[:, 0] > vMax[:, 0])[:, np.newaxis]
+    HE = np.stack((np.where(h_first, vMin, vMax), np.where(h_first, vMax, vMin)), axis=2)   # (N, 3, 2)
+
+    ######## Step 7: Concentrations (least squares via pseudo-inverse) ########
+    C = np.matmul(np.linalg.pinv(HE), OD.transpose(0, 2, 1))   # (N, 2, P)
+
+    maxC = np.percentile(C, 99, axis=2)                          # (N, 2)
+    valid = np.all(maxC > 0, axis=1) & np.all(np.isfinite(C), axis=(1, 2))
+    tmp = np.where(valid[:, np.newaxis], maxC / MAX_C_REF, 1.0).astype(np.float32)
+    C2 = C / tmp[:, :, np.newaxis]
+
+    ######## Step 8: Recreate the normalized image ########
+    Inorm = np.float32(Io) * np.exp(-np.matmul(HE_REF, C2))    # (N, 3, P)
+    Inorm[Inorm > 255] = 254
+    Inorm = Inorm.transpose(0, 2, 1).reshape(-1, h, w, 3).astype(np.uint8)
+
+    out[idx[valid]] = Inorm[valid]
+    ok[idx[~valid]] = False
+    return out, ok
+
+
+############### SLIDE-LEVEL VERSION #######################
+# Stain vectors estimated ONCE per slide from a sample of tissue tiles, then
+# applied to every tile as a fixed linear transform in OD space:
+#   OD_norm = HERef * diag(maxCRef / maxC) * pinv(HE) * OD
+# No per-tile covariance/eigh/percentile/lstsq, and no tile-to-tile jitter.
+
+# maximum number of tissue pixels used for the slide-level estimate
+MAX_ESTIMATE_PIXELS = 500000
+
+
+def estimate_stain_params(imgs, Io=240, alpha=1, beta=0.15, max_pixels=MAX_ESTIMATE_PIXELS, seed=0):
+    """
+    imgs: list of RGB uint8 tissue tiles sampled from one slide (sizes may differ).
+    Returns a dict with the slide stain matrix 'HE' (3x2) and 'maxC' (2,).
+    """
+    lut = _od_lut(Io).astype(np.float64)
+    OD = np.concatenate([lut[np.asarray(img, dtype=np.uint8).reshape(-1, 3)] for img in imgs])
+    ODhat = OD[~np.any(OD < beta, axis=1)]
+    if ODhat.shape[0] < MIN_TISSUE_PIXELS:
+        raise ValueError("Too few tissue pixels in the sampled tiles")
+
+    rng = np.random.default_rng(seed)
+    if ODhat.shape[0] > max_pixels:
+        ODhat = ODhat[rng.choice(ODhat.shape[0], max_pixels, replace=False)]
+    if OD.shape[0] > max_pixels:
+        OD = OD[rng.choice(OD.shape[0], max_pixels, replace=False)]
+
+    # same steps as norm_HnE, on the pooled pixels of all tiles
+    eigvals, eigvecs = np.linalg.eigh(np.cov(ODhat.T))
+    That = ODhat.dot(eigvecs[:, 1:3])
+    phi = np.arctan2(That[:, 1], That[:, 0])
+    minPhi = np.percentile(phi, alpha)
+    maxPhi = np.percentile(phi, 100 - alpha)
+    vMin = eigvecs[:, 1:3].dot(np.array([(np.cos(minPhi), np.sin(minPhi))]).T)
+    vMax = eigvecs[:, 1:3].dot(np.array([(np.cos(maxPhi), np.sin(maxPhi))]).T)
+    if vMin[0] > vMax[0]:
+        HE = np.array((vMin[:, 0], vMax[:, 0])).T
+    else:
+        HE = np.array((vMax[:, 0], vMin[:, 0])).T
+
+    C = np.linalg.lstsq(HE, OD.T, rcond=None)[0]
+    maxC = np.array([np.percentile(C[0, :], 99), np.percentile(C[1, :], 99)])
+    if np.any(maxC <= 0):
+        raise ValueError("Degenerate stain concentrations in the sampled tiles")
+
+    return {"HE": HE, "maxC": maxC, "Io": Io, "alpha": alpha, "beta": beta}
+
+
+def stain_transform(params):
+    """3x3 matrix M for row-vector pixels: OD_norm = OD @ M (float32)."""
+    M = HE_REF.astype(np.float64).dot(np.diag(MAX_C_REF / np.asarray(params["maxC"]))).dot(
+        np.linalg.pinv(np.asarray(params["HE"])))
+    return M.T.astype(np.float32)
+
+
+def norm_HnE_fixed(img, params, transform=None):
+    """
+    Normalize one RGB uint8 image (or an (N, H, W, 3) stack) with slide-level
+    stain params. 'transform' can be a precomputed stain_transform(params).
+    """
+    if transform is None:
+        transform = stain_transform(params)
+    img = np.asarray(img, dtype=np.uint8)
+    OD = _od_lut(params["Io"])[img]                          # 256-entry LUT for the log step
+    Inorm = np.float32(params["Io"]) * np.exp(-OD.dot(transform))
+    Inorm[Inorm > 255] = 254
+    return Inorm.astype(np.uint8)
+
+
+def save_stain_params(path, params, **extra):
+    """Save stain params (plus any extra metadata) as JSON, e.g. next to the slide."""
+    data = {key: (value.tolist() if isinstance(value, np.ndarray) else value) for key, value in params.items()}
+    data.update(extra)
+    # Temp file per process and thread: concurrent writers of the same slide never share it
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_stain_params(path):
+    """Load stain params saved with save_stain_params (None if the file is missing or broken)."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        data["HE"] = np.array(data["HE"], dtype=np.float64)
+        data["maxC"] = np.array(data["maxC"], dtype=np.float64)
+        return data
+    except (OSError, ValueError, KeyError):
+        return None
+
+
 # img=cv2.imread('images/HnE_Image.jpg', 1)
 # img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+
+from normalize_HnE import estimate_stain_params, save_stain_params, load_stain_params
+
+# ====================================================================
+#  NORMALIZACJA NA POZIOMIE SKANU (jedna macierz barwników na skan)
+# ====================================================================
+#
+#  Macierz H&E i maksymalne stężenia liczymy raz na skan z próbki kafelków
+#  z tkanką i zapisujemy obok skanu ("<skan>.stain.json"). Kolejne uruchomienia
+#  tylko wczytują plik, dopóki skan (rozmiar, data modyfikacji) się nie zmieni.
+
+STAIN_SAMPLE_TILES = 64   # Ile kafelków z tkanką bierzemy do estymacji
+STAIN_SAMPLE_SEED = 0
+
+
+def stain_cache_path(slide_path: str) -> str:
+    return slide_path + ".stain.json"
+
+
+def _slide_signature(slide_path: str, level: int, tile_size: int) -> dict:
+    stat = os.stat(slide_path)
+    return {"slide_size": stat.st_size, "slide_mtime": int(stat.st_mtime),
+            "level": level, "tile_size": tile_size}
+
+
+def get_slide_stain_params(slide_path, tiles_gen, level, tile_size, coords, tissue_fn,
+                           n_samples=STAIN_SAMPLE_TILES, seed=STAIN_SAMPLE_SEED):
+    """
+    Zwraca parametry barwników dla skanu (z pliku obok skanu albo świeżo wyliczone).
+
+    coords    - kandydaci (col, row), z których losujemy próbkę (np. po filtrze ROI)
+    tissue_fn - filtr tkanki PIL -> bool (np. has_tissue)
+    """
+    cache_path = stain_cache_path(slide_path)
+    signature = _slide_signature(slide_path, level, tile_size)
+
+    params = load_stain_params(cache_path)
+    if params is not None and all(params.get(key) == value for key, value in signature.items()):
+        print(f"Wczytano macierz barwników skanu z: {cache_path}")
+        return params
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(coords))
+    sample = []
+    for i in order:
+        col, row = coords[i]
+        try:
+            tile_pil = tiles_gen.get_tile(level, (col, row))
+        except Exception:
+            continue
+        if tissue_fn(tile_pil):
+            sample.append(np.array(tile_pil.convert('RGB')))
+        if len(sample) >= n_samples:
+            break
+
+    if not sample:
+        raise ValueError("Brak kafelków z tkanką do estymacji macierzy barwników.")
+
+    params = estimate_stain_params(sample)
+    try:
+        save_stain_params(cache_path, params, n_tiles=len(sample), **signature)
+        print(f"Zapisano macierz barwników skanu ({len(sample)} kafelków) w: {cache_path}")
+    except OSError as e:
+        print(f"OSTRZEŻENIE: Nie udało się zapisać {cache_path}: {e}")
+    return params
@@ -0,0 +1,511 @@
+import math
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision import models, transforms
+
+from tile_shards import TileShardReader
+from tile_dataset import TileDataset
+
+# ====================================================================
+#  AUGMENTACJA CAŁYCH PACZEK NA TENSORACH (zamiast PIL per kafelek)
+# ====================================================================
+#
+#  Transformacja treningowa z notebooków (RandomResizedCrop -> flipy ->
+#  RandomRotation(90) -> ColorJitter -> ToTensor -> Normalize) liczona jest na
+#  PIL osobno dla każdego kafelka w workerach DataLoadera. BatchAugment robi to
+#  samo na całej paczce uint8 (N, H, W, 3) z shardów (tile_shards.py):
+#    - RandomResizedCrop: parametry losowane jak w torchvision (10 prób, potem
+#      środek), wycinek + skalowanie całej paczki jednym F.grid_sample
+#      (bilinearnie; pełny kafelek w skali 1:1 daje dokładnie te same piksele),
+#    - flipy i obroty o 90°: dokładne permutacje pikseli (8 symetrii kwadratu,
+#      wtopione w siatkę grid_sample - patrz crop_resize) zamiast
+#      RandomRotation(90) o dowolny kąt, które interpoluje i wstawia czarne rogi,
+#    - ColorJitter: jasność, kontrast, nasycenie i odcień z losowym czynnikiem
+#      na kafelek, wektorowo i w miejscu (wzory z torchvision, odcień bez
+#      konwersji HSV tam i z powrotem; kolejność stała: b, c, s, h),
+#    - Normalize (ImageNet).
+#  Kafelki brzegowe są w shardach dopełnione do pełnego rozmiaru - sizes (N, 2)
+#  podaje ich prawdziwe (H, W) i wycinki są losowane tylko z tego obszaru.
+#  train=False: Resize(S + 32) -> CenterCrop(S) jak transformacja walidacyjna.
+#  Losowość z własnego torch.Generator (seed) - powtarzalne paczki.
+#
+#  TileBatchLoader podaje paczki z TileDataset (tile_dataset.py) od razu jako
+#  (wejścia modelu na urządzeniu, etykiety), więc pętla treningowa notebooków
+#  i tile_train.py się nie zmienia. Odczyt i augmentacja kolejnych paczek idą
+#  w wątkach w tle (jak workery DataLoadera), równolegle z krokiem modelu.
+#
+#  Użycie: python tile_augment.py [katalog_shardów] - test zgodności z
+#  transformacjami PIL i czas paczki; z katalogiem także czas kroków treningu
+#  (odczyt + augmentacja + forward/backward) względem DataLoadera z workerami.
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+INPUT_SIZE = 224
+RESIZE_MARGIN = 32            # Resize(S + 32) przed CenterCrop(S) w trybie walidacji
+
+CROP_SCALE = (0.08, 1.0)      # Jak domyślne RandomResizedCrop
+CROP_RATIO = (3 / 4, 4 / 3)
+CROP_ATTEMPTS = 10
+BRIGHTNESS = 0.2              # ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.05)
+CONTRAST = 0.2
+SATURATION = 0.2
+HUE = 0.05
+
+AUGMENT_SEED = 42
+AUGMENT_WORKERS = 2           # Wątki odczytu + augmentacji (notebooki miały 2 workery DataLoadera na CPU)
+
+# Test zgodności (po Normalize): walidacja na pełnych kafelkach i operacje koloru jak torchvision
+PARITY_TOLERANCE = 1e-4
+PARITY_RESIZED_TOLERANCE = 1.5 / 255 / min(IMAGENET_STD)   # Skalowane kafelki brzegowe: maks. 1 poziom uint8
+PARITY_TILES = 64
+PARITY_BATCH_SIZE = 64
+
+# Czas kroków treningu (odczyt + augmentacja + forward/backward ResNet18) na shardach
+TRAIN_BENCH_STEPS = 8
+TRAIN_BENCH_BATCH_SIZE = 32
+
+
+# ====================================================================
+#  OPERACJE NA PACZKACH
+# ====================================================================
+
+def to_float_batch(images, device=None):
+    """Paczka uint8 (N, H, W, 3) (numpy / tensor) -> float32 (N, 3, H, W) w [0, 1] na device."""
+    batch = torch.as_tensor(np.asarray(images) if not torch.is_tensor(images) else images)
+    batch = batch.to(device, non_blocking=True).permute(0, 3, 1, 2)
+    return batch.float().div_(255.0)
+
+
+def sample_crop_boxes(sizes, scale=CROP_SCALE, ratio=CROP_RATIO, generator=None):
+    """
+    Wycinki RandomResizedCrop dla każdego kafelka: (N, 4) [top, left, height, width]
+    w granicach sizes (N, 2) = (H, W). Jak get_params z torchvision: pierwsza
+    poprawna z CROP_ATTEMPTS prób, w razie braku - największy środek o proporcji z ratio.
+    """
+    sizes = torch.as_tensor(sizes, dtype=torch.float64)
+    height, width = sizes[:, :1], sizes[:, 1:]
+    n = len(sizes)
+    area = height * width
+    target_area = area * torch.empty(n, CROP_ATTEMPTS, dtype=torch.float64).uniform_(*scale, generator=generator)
+    log_ratio = torch.empty(n, CROP_ATTEMPTS, dtype=torch.float64).uniform_(
+        math.log(ratio[0]), math.log(ratio[1]), generator=generator)
+    aspect = torch.exp(log_ratio)
+    crop_w = torch.round(torch.sqrt(target_area * aspect))
+    crop_h = torch.round(torch.sqrt(target_area / aspect))
+    valid = (crop_w > 0) & (crop_w <= width) & (crop_h > 0) & (crop_h <= height)
+    attempt = valid.to(torch.uint8).argmax(dim=1, keepdim=True)
+    found = valid.any(dim=1)
+    crop_h = crop_h.gather(1, attempt)[:, 0]
+    crop_w = crop_w.gather(1, attempt)[:, 0]
+
+    # Brak poprawnej próby: środek kafelka z proporcją przyciętą do ratio
+    height, width = height[:, 0], width[:, 0]
+    in_ratio = width / height
+    fallback_w = torch.where(in_ratio > ratio[1], torch.round(height * ratio[1]), width)
+    fallback_h = torch.where(in_ratio < ratio[0], torch.round(width / ratio[0]), height)
+    crop_h = torch.where(found, crop_h, fallback_h)
+    crop_w = torch.where(found, crop_w, fallback_w)
+
+    u = torch.rand(n, 2, dtype=torch.float64, generator=generator)
+    top = torch.where(found, torch.floor(u[:, 0] * (height - crop_h + 1)), torch.round((height - crop_h) / 2))
+    left = torch.where(found, torch.floor(u[:, 1] * (width - crop_w + 1)), torch.round((width - crop_w) / 2))
+    return torch.stack([top, left, crop_h, crop_w], dim=1)
+
+
+def center_crop_boxes(sizes, input_size=INPUT_SIZE, margin=RESIZE_MARGIN):
+    """Resize(S + margin) -> CenterCrop(S) wyrażone jako wycinek w pikselach kafelka: (N, 4)."""
+    sizes = torch.as_tensor(sizes, dtype=torch.float64)
+    height, width = sizes[:, 0], sizes[:, 1]
+    short = torch.minimum(height, width)
+    target = input_size + margin
+    # Rozmiary po Resize jak w torchvision: krótszy bok = target, dłuższy int(target * dłuższy / krótszy)
+    new_h = torch.where(height <= width, torch.full_like(height, target), torch.floor(target * height / short))
+    new_w = torch.where(width <= height, torch.full_like(width, target), torch.floor(target * width / short))
+    top = torch.round((new_h - input_size) / 2)
+    left = torch.round((new_w - input_size) / 2)
+    scale_y, scale_x = height / new_h, width / new_w
+    return torch.stack([top * scale_y, left * scale_x, input_size * scale_y, input_size * scale_x], dim=1)
+
+
+def crop_resize(batch, boxes, input_size=INPUT_SIZE, transpose=None, flip_h=None, flip_v=None, sizes=None):
+    """
+    Wycinki boxes (N, 4) [top, left, h, w] z paczki (N, 3, H, W) przeskalowane do (S, S)
+    jednym grid_sample (bilinearnie, środki pikseli jak w resize bez antyaliasingu).
+    sizes (N, 2) - prawdziwe (H, W) kafelków: próbkowanie nie sięga do dopełnienia.
+    transpose / flip_h / flip_v (maski bool N) dają to samo co dihedral() na wyniku:
+    siatka próbkowania affine_grid jest symetryczna (linspace liczony od obu końców),
+    więc zmiana znaku / zamiana kolumn theta permutuje punkty próbkowania bit w bit.
+    """
+    n, _, height, width = batch.shape
+    boxes = boxes.to(batch.device, torch.float32)
+    top, left, crop_h, crop_w = boxes.unbind(1)
+    scale_x, scale_y = crop_w / width, crop_h / height
+    no = torch.zeros(n, dtype=torch.bool, device=batch.device)
+    transpose, flip_h, flip_v = (no if m is None else m.to(batch.device) for m in (transpose, flip_h, flip_v))
+    sign_u = 1 - 2 * flip_h.float()
+    sign_v = 1 - 2 * flip_v.float()
+    theta = torch.zeros(n, 2, 3, device=batch.device)
+    # Punkt wyjścia (u, v) -> (u', v') = (±u, ±v), po transpozycji (±v, ±u) -> x = sx * u' + ox, y = sy * v' + oy
+    theta[:, 0, 0] = torch.where(transpose, 0.0, scale_x * sign_u)
+    theta[:, 0, 1] = torch.where(transpose, scale_x * sign_v, 0.0)
+    theta[:, 0, 2] = (2 * left + crop_w) / width - 1
+    theta[:, 1, 0] = torch.where(transpose, scale_y * sign_u, 0.0)
+    theta[:, 1, 1] = torch.where(transpose, 0.0, scale_y * sign_v)
+    theta[:, 1, 2] = (2 * top + crop_h) / height - 1
+    grid = F.affine_grid(theta, (n, 3, input_size, input_size), align_corners=False)
+    if sizes is not None:
+        sizes = torch.as_tensor(sizes, device=batch.device)
+        if bool((sizes[:, 0] < height).any() or (sizes[:, 1] < width).any()):
+            # Środek ostatniego prawdziwego piksela jako granica (jak padding_mode="border")
+            limits = (2 * sizes.flip(1).float() - 1) / torch.tensor([width, height], device=batch.device) - 1
+            grid = torch.minimum(grid, limits.view(n, 1, 1, 2))
+    return F.grid_sample(batch, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+
+def dihedral(batch, transpose, flip_h, flip_v):
+    """
+    Transpozycja, potem flipy (maski bool N) - 8 symetrii kwadratu (obrót o 90° =
+    transpozycja + flip) jako permutacja pikseli gotowej paczki (N, 3, S, S).
+    """
+    codes = transpose.long() + 2 * flip_h.long() + 4 * flip_v.long()
+    out = torch.empty_like(batch)
+    for code in torch.unique(codes).tolist():
+        selected = torch.nonzero(codes == code)[:, 0].to(batch.device)
+        group = batch[selected]
+        if code & 1:
+            group = group.transpose(-2, -1)
+        if code & 2:
+            group = group.flip(-1)
+        if code & 4:
+            group = group.flip(-2)
+        out[selected] = group
+    return out
+
+
+def _grayscale(batch):
+    r, g, b = batch.unbind(1)
+    return torch.mul(r, 0.2989).add_(g, alpha=0.587).add_(b, alpha=0.114).unsqueeze(1)
+
+
+def _shift_hue(batch, shift):
+    """
+    adjust_hue z torchvision (RGB -> HSV, h + shift, HSV -> RGB) bez pełnej konwersji:
+    przesunięcie odcienia zachowuje V = max i chromę C = max - min, więc kanał
+    n (R = 5, G = 3, B = 1) to V - C * clamp(2 - |k - 2|, 0, 1), k = (n + 6h) mod 6.
+    """
+    r, g, b = batch.unbind(1)
+    value = batch.amax(dim=1)
+    chroma = value - batch.amin(dim=1)
+    is_r = value == r
+    is_g = (value == g).logical_and_(~is_r)
+    is_b = (~is_r).logical_and_(~is_g)
+    # 6h z przesunięciem, w [-1.3, 5.3] - sektor koła barw wg kanału z maksimum
+    h6 = torch.sub(g, b).mul_(is_r)
+    h6.add_(torch.sub(b, r).add_(chroma, alpha=2).mul_(is_g))
+    h6.add_(torch.sub(r, g).add_(chroma, alpha=4).mul_(is_b))
+    h6.div_((chroma == 0).float().add_(chroma))
+    h6.add_((shift.to(batch.device) * 6).view(-1, 1, 1))
+    out = torch.empty_like(batch)
+    for channel, n in enumerate((5, 3, 1)):
+        k = h6.add(n)
+        k.sub_((k >= 6).float(), alpha=6)   # k < 0 daje 0 tak samo jak k + 6
+        k.sub_(2).abs_().neg_().add_(2).clamp_(0, 1)
+        torch.sub(value, k.mul_(chroma), out=out[:, channel])
+    return out
+
+
+def color_jitter(batch, brightness, contrast, saturation, hue):
+    """
+    Czynniki (N,) na kafelek: adjust_brightness -> contrast -> saturation -> hue
+    z torchvision, na całej paczce (jasność, kontrast i nasycenie w miejscu).
+    """
+    def per_tile(factors):
+        return factors.to(batch.device).view(-1, 1, 1, 1)
+
+    batch.mul_(per_tile(brightness)).clamp_(0, 1)
+    contrast = per_tile(contrast)
+    mean = _grayscale(batch).mean(dim=(1, 2, 3), keepdim=True)
+    batch.mul_(contrast).add_(mean.mul_(1 - contrast)).clamp_(0, 1)
+    saturation = per_tile(saturation)
+    gray = _grayscale(batch).mul_(1 - saturation)
+    batch.mul_(saturation).add_(gray).clamp_(0, 1)
+    return _shift_hue(batch, hue)
+
+
+def normalize(batch):
+    mean = torch.tensor(IMAGENET_MEAN, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=batch.device).view(1, 3, 1, 1)
+    return batch.sub_(mean).div_(std)
+
+
+# ====================================================================
+#  AUGMENTACJA I PACZKI DLA PĘTLI TRENINGOWEJ
+# ====================================================================
+
+class BatchAugment:
+    """
+    augment(images, sizes=None) -> wejścia modelu (N, 3, S, S) float32 na device.
+    images: uint8 (N, H, W, 3); sizes: prawdziwe (H, W) kafelków (domyślnie cały obraz).
+    train=False - deterministyczne Resize(S + 32) + CenterCrop(S) (walidacja / test).
+    """
+
+    def __init__(self, input_size=INPUT_SIZE, train=True, seed=AUGMENT_SEED, device=None,
+                 brightness=BRIGHTNESS, contrast=CONTRAST, saturation=SATURATION, hue=HUE):
+        self.input_size = input_size
+        self.train = train
+        self.device = device
+        self.jitter = (brightness, contrast, saturation, hue)
+        self.generator = torch.Generator().manual_seed(seed)
+
+    @staticmethod
+    def _factors(n, amount, generator):
+        return torch.empty(n).uniform_(max(0.0, 1 - amount), 1 + amount, generator=generator)
+
+    def __call__(self, images, sizes=None, generator=None):
+        """generator - losowość tej paczki (domyślnie generator augmentacji; TileBatchLoader podaje własny)."""
+        generator = generator or self.generator
+        batch = to_float_batch(images, self.device)
+        n = len(batch)
+        if sizes is None:
+            sizes = torch.tensor(batch.shape[-2:]).expand(n, 2)
+        if not self.train:
+            boxes = center_crop_boxes(sizes, self.input_size)
+            return normalize(crop_resize(batch, boxes, self.input_size, sizes=sizes))
+
+        # Wycinek, skalowanie i losowa z 8 symetrii kwadratu w jednym grid_sample
+        boxes = sample_crop_boxes(sizes, generator=generator)
+        transpose, flip_h, flip_v = (torch.rand(n, 3, generator=generator) < 0.5).unbind(1)
+        batch = crop_resize(batch, boxes, self.input_size, transpose, flip_h, flip_v, sizes)
+        brightness, contrast, saturation, hue = self.jitter
+        batch = color_jitter(batch, self._factors(n, brightness, generator), self._factors(n, contrast, generator),
+                             self._factors(n, saturation, generator),
+                             torch.empty(n).uniform_(-hue, hue, generator=generator))
+        return normalize(batch)
+
+
+class TileBatchLoader:
+    """
+    Paczki z TileDataset (tile_dataset.py) bez procesów DataLoadera: odczyt paczki
+    uint8 z shardów (reader.get_batch, kolejność zapisu) + augment na jego urządzeniu.
+    Iteracja daje (wejścia, etykiety) jak DataLoader. sampler (np. balanced_sampler)
+    albo shuffle (seed) wyznacza kolejność kafelków w epoce. num_workers wątków
+    czyta i augmentuje kolejne paczki w tle, gdy pętla liczy model (memmap i operacje
+    torcha zwalniają GIL); num_workers=0 - wszystko w wątku pętli. Każda paczka ma
+    własny generator z ziarnem losowanym po kolei, więc wynik nie zależy od wątków.
+    """
+
+    def __init__(self, dataset, batch_size, augment, shuffle=False, sampler=None, seed=AUGMENT_SEED,
+                 num_workers=AUGMENT_WORKERS):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.augment = augment
+        self.shuffle = shuffle
+        self.sampler = sampler
+        self.num_workers = num_workers
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def _order(self):
+        if self.sampler is not None:
+            return np.fromiter(iter(self.sampler), dtype=np.int64)
+        if self.shuffle:
+            return torch.randperm(len(self.dataset), generator=self.generator).numpy()
+        return np.arange(len(self.dataset))
+
+    def _load(self, indices, seed):
+        """Odczyt paczki z shardów + augmentacja (w wątku w tle)."""
+        reader = self.dataset.reader
+        sizes = np.stack([reader.index["height"][indices], reader.index["width"][indices]], axis=1)
+        images = torch.from_numpy(reader.get_batch(indices))
+        inputs = self.augment(images, sizes.astype(np.int64), torch.Generator().manual_seed(seed))
+        return inputs, torch.from_numpy(reader.labels[indices]).to(inputs.device)
+
+    def __iter__(self):
+        order = self._order()
+        batches = [self.dataset.indices[order[start:start + self.batch_size]]
+                   for start in range(0, len(order), self.batch_size)]
+        seeds = torch.randint(2 ** 62, (len(batches),), generator=self.generator).tolist()
+        if self.num_workers <= 0:
+            for indices, seed in zip(batches, seeds):
+                yield self._load(indices, seed)
+            return
+        # Do num_workers paczek w przygotowaniu naraz; oddawane w kolejności epoki
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = deque(pool.submit(self._load, indices, seed)
+                            for indices, seed in zip(batches[:self.num_workers], seeds))
+            for k in range(self.num_workers, len(batches) + self.num_workers):
+                batch = pending.popleft().result()
+                if k < len(batches):
+                    pending.append(pool.submit(self._load, batches[k], seeds[k]))
+                yield batch
+
+
+# ====================================================================
+#  TEST ZGODNOŚCI Z TRANSFORMACJAMI PIL
+# ====================================================================
+
+def parity_tiles(n_tiles=PARITY_TILES, size=256, seed=0):
+    """Gładkie kafelki testowe z szumem (jak tkanka) - uint8 (N, size, size, 3)."""
+    rng = np.random.default_rng(seed)
+    tiles = []
+    for _ in range(n_tiles):
+        coarse = rng.integers(0, 256, (size // 8, size // 8, 3), dtype=np.uint8)
+        img = np.asarray(Image.fromarray(coarse).resize((size, size), Image.BILINEAR), dtype=np.int16)
+        tiles.append(np.clip(img + rng.integers(-16, 17, img.shape), 0, 255).astype(np.uint8))
+    return np.stack(tiles)
+
+
+def pil_train_transform(input_size=INPUT_SIZE):
+    """Transformacja treningowa z notebooków (wzorzec czasu)."""
+    return transforms.Compose([
+        transforms.RandomResizedCrop(input_size),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomVerticalFlip(),
+        transforms.RandomRotation(90),
+        transforms.ColorJitter(brightness=BRIGHTNESS, contrast=CONTRAST, saturation=SATURATION, hue=HUE),
+        transforms.ToTensor(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    ])
+
+
+def parity_check(tiles=None, input_size=INPUT_SIZE, tolerance=PARITY_TOLERANCE):
+    """Porównuje operacje paczkowe z odpowiednikami torchvision; zwraca True, gdy zgodne."""
+    tiles = parity_tiles() if tiles is None else tiles
+    generator = torch.Generator().manual_seed(0)
+    checks = []
+
+    # 1. Walidacja na pełnych kafelkach: to samo co Resize + CenterCrop + ToTensor + Normalize (PIL)
+    val = transforms.Compose([transforms.Resize(input_size + RESIZE_MARGIN), transforms.CenterCrop(input_size),
+                              transforms.ToTensor(), transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)])
+    reference = torch.stack([val(Image.fromarray(tile)) for tile in tiles])
+    checks.append(("walidacja (Resize + CenterCrop)", reference, BatchAugment(input_size, train=False)(tiles),
+                   tolerance))
+
+    # 1b. Kafelek brzegowy dopełniony do pełnego rozmiaru - dopełnienie nie może przeciekać
+    edge_width = 97
+    padded = np.full_like(tiles, 255)
+    padded[:, :, :edge_width] = tiles[:, :, :edge_width]
+    reference = torch.stack([val(Image.fromarray(np.ascontiguousarray(tile[:, :edge_width]))) for tile in tiles])
+    sizes = np.tile([tiles.shape[1], edge_width], (len(tiles), 1))
+    checks.append(("walidacja (kafelek brzegowy)", reference, BatchAugment(input_size, train=False)(padded, sizes),
+                   PARITY_RESIZED_TOLERANCE))
+
+    # 2. Wycinek + skalowanie 1:1 (bez interpolacji) = zwykłe cięcie tablicy
+    batch = to_float_batch(tiles)
+    boxes = torch.tensor([[10.0, 20.0, input_size, input_size]]).expand(len(tiles), 4)
+    checks.append(("wycinek 1:1", batch[:, :, 10:10 + input_size, 20:20 + input_size],
+                   crop_resize(batch, boxes, input_size), tolerance))
+
+    # 3. Flipy i obroty o 90° wtopione w grid_sample = te same piksele co TF.hflip / vflip / transpozycja
+    transpose, flip_h, flip_v = (torch.rand(len(tiles), 3, generator=generator) < 0.5).unbind(1)
+    boxes = sample_crop_boxes(torch.tensor([[256, 256]]).expand(len(tiles), 2), generator=generator)
+    cropped = crop_resize(batch, boxes, input_size)
+    expected = []
+    for tile, tr, fh, fv in zip(cropped, transpose, flip_h, flip_v):
+        tile = tile.transpose(-2, -1) if tr else tile
+        tile = TF.hflip(tile) if fh else tile
+        expected.append(TF.vflip(tile) if fv else tile)
+    checks.append(("flipy + obroty o 90°", torch.stack(expected),
+                   crop_resize(batch, boxes, input_size, transpose, flip_h, flip_v), 0.0))
+    checks.append(("dihedral (permutacja pikseli)", torch.stack(expected),
+                   dihedral(cropped, transpose, flip_h, flip_v), 0.0))
+
+    # 4. ColorJitter z ustalonymi czynnikami: te same wzory co TF.adjust_* na tensorach
+    factors = [torch.empty(len(tiles)).uniform_(0.8, 1.2, generator=generator) for _ in range(3)]
+    hue = torch.empty(len(tiles)).uniform_(-HUE, HUE, generator=generator)
+    expected = []
+    for tile, b, c, s, h in zip(batch, *factors, hue):
+        tile = TF.adjust_brightness(tile, float(b))
+        tile = TF.adjust_contrast(tile, float(c))
+        tile = TF.adjust_saturation(tile, float(s))
+        expected.append(TF.adjust_hue(tile, float(h)))
+    checks.append(("ColorJitter", torch.stack(expected), color_jitter(batch.clone(), *factors, hue), tolerance))
+
+    all_ok = True
+    print(f"{'operacja':<34}{'maks. różnica':>15}{'tolerancja':>12}")
+    for name, expected, actual, limit in checks:
+        max_diff = float((expected - actual).abs().max())
+        ok = max_diff <= limit
+        all_ok &= ok
+        print(f"{name:<34}{max_diff:>15.2e}{limit:>12.2e}{'' if ok else '  <- POZA TOLERANCJĄ'}")
+    return all_ok
+
+
+def benchmark(tiles=None, batch_size=PARITY_BATCH_SIZE, input_size=INPUT_SIZE):
+    """Czas jednej paczki: transformacja PIL per kafelek vs BatchAugment (CPU)."""
+    tiles = parity_tiles(batch_size) if tiles is None else tiles[:batch_size]
+    pil_transform = pil_train_transform(input_size)
+    augment = BatchAugment(input_size)
+    augment(tiles)   # Rozgrzewka
+    start = time.perf_counter()
+    torch.stack([pil_transform(Image.fromarray(tile)) for tile in tiles])
+    pil_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    augment(tiles)
+    batch_seconds = time.perf_counter() - start
+    print(f"\nPaczka {len(tiles)} kafelków: PIL {pil_seconds * 1000:.0f} ms, "
+          f"tensory {batch_seconds * 1000:.0f} ms ({pil_seconds / batch_seconds:.1f}x)")
+
+
+def training_benchmark(reader, steps=TRAIN_BENCH_STEPS, batch_size=TRAIN_BENCH_BATCH_SIZE, input_size=INPUT_SIZE,
+                       workers=AUGMENT_WORKERS):
+    """
+    Czas kroków treningu ResNet18 (CPU) end-to-end: DataLoader z transformacją PIL
+    i workers procesami (jak dotąd w notebookach) vs TileBatchLoader bez wątków
+    i z workers wątkami. Pierwszy krok każdego wariantu (rozgrzewka) nie jest liczony.
+    """
+    indices = np.arange(min(len(reader), (steps + 1) * batch_size))
+    dataset = TileDataset(reader, indices)
+    variants = [
+        (f"DataLoader + PIL ({workers} workery)",
+         lambda: DataLoader(TileDataset(reader, indices, pil_train_transform(input_size)), batch_size=batch_size,
+                            shuffle=True, num_workers=workers)),
+        ("TileBatchLoader (bez wątków)",
+         lambda: TileBatchLoader(dataset, batch_size, BatchAugment(input_size), shuffle=True, num_workers=0)),
+        (f"TileBatchLoader ({workers} wątki)",
+         lambda: TileBatchLoader(dataset, batch_size, BatchAugment(input_size), shuffle=True, num_workers=workers)),
+    ]
+    print(f"\nKroki treningu ResNet18 na CPU ({torch.get_num_threads()} wątków torch), paczka {batch_size}:")
+    results = []
+    for name, make_loader in variants:
+        torch.manual_seed(0)
+        model = models.resnet18(num_classes=2)
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+        criterion = torch.nn.CrossEntropyLoss()
+        model.train()
+        n_steps, start = 0, None
+        for inputs, labels in make_loader():
+            optimizer.zero_grad()
+            criterion(model(inputs), labels).backward()
+            optimizer.step()
+            if start is None:
+                start = time.perf_counter()   # Po rozgrzewce (start workerów, pierwsza paczka)
+            else:
+                n_steps += 1
+        seconds = (time.perf_counter() - start) / max(n_steps, 1)
+        results.append(seconds)
+        print(f"  {name:<32}{seconds * 1000:>8.0f} ms/krok ({results[0] / seconds:.2f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    ok = parity_check()
+    benchmark()
+    if len(sys.argv) > 1:
+        shard_reader = TileShardReader(sys.argv[1])
+        if len(shard_reader):
+            training_benchmark(shard_reader)
+        else:
+            print(f"BŁĄD: Brak shardów kafelków w: {sys.argv[1]}")
+    print("\nZgodność z transformacjami torchvision: OK" if ok else "\nBŁĄD: Augmentacja różni się od torchvision.")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,192 @@
+import os
+import shutil
+import sys
+import time
+import zlib
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, WeightedRandomSampler
+
+from tile_shards import TileShardReader, LABELS, INDEX_FILE, find_scan_dirs, _save_atomic
+
+# ====================================================================
+#  DATASET TRENINGOWY NA SHARDACH KAFELKÓW (memmap, bez kopiowania PNG)
+# ====================================================================
+#
+#  Notebooki treningowe kopiowały każdy PNG do /content/final_dataset
+#  (random.sample + copy_files), a ImageFolder dekodował PNG w każdej epoce.
+#  Tutaj kafelki zostają w shardach z ekstrakcji (tile_shards.py):
+#    - TileDataset = TileShardReader (np.memmap) + tablica numerów kafelków;
+#      __getitem__ to wycinek shardu, bez dekodowania,
+#    - balansowanie to tablica numerów (undersample) albo sampler z wagami
+#      klas (balanced_sampler) - nic nie jest kopiowane,
+#    - podział train/val/test po skanach (split_by_scan) - kafelki jednego
+#      skanu nigdy nie trafiają do dwóch zbiorów,
+#    - stage_shards kopiuje shardy (kilka dużych plików na skan) z Dysku Google
+#      na lokalny dysk Colab, skąd memmap czyta szybko.
+#
+#  Użycie: python tile_dataset.py <katalog> - liczności klas, podział po skanach
+#  i czas jednej epoki odczytu (bez modelu).
+
+SPLIT_FRACTIONS = (0.7, 0.15, 0.15)   # train / val / test (udział skanów)
+SPLIT_SEED = 42
+BALANCE_SEED = 42
+
+
+class TileDataset(Dataset):
+    """
+    Kafelki o numerach indices z TileShardReader jako (obraz, etykieta) - jak ImageFolder
+    (classes, targets), ale bez plików PNG. transform dostaje PIL.Image (np. transforms
+    z notebooka); transform=None zwraca tablicę uint8 (H, W, 3).
+    """
+
+    def __init__(self, reader, indices=None, transform=None):
+        self.reader = reader
+        self.indices = np.arange(len(reader)) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.transform = transform
+        self.classes = list(LABELS)
+        self.targets = reader.labels[self.indices]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, j):
+        i = int(self.indices[j])
+        tile = np.ascontiguousarray(self.reader[i])
+        if self.transform is not None:
+            tile = self.transform(Image.fromarray(tile))
+        return tile, int(self.reader.labels[i])
+
+    def class_counts(self):
+        counts = np.bincount(self.targets, minlength=len(LABELS))
+        return {label: int(counts[k]) for k, label in enumerate(LABELS)}
+
+
+# ====================================================================
+#  BALANSOWANIE I PODZIAŁ (TABLICE NUMERÓW KAFELKÓW)
+# ====================================================================
+
+def undersample(labels, indices=None, seed=BALANCE_SEED):
+    """Losowo tyle samo kafelków z każdej klasy (liczność najmniejszej klasy); zwraca posortowane numery."""
+    indices = np.arange(len(labels)) if indices is None else np.asarray(indices, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    per_class = [indices[labels[indices] == k] for k in range(len(LABELS))]
+    n_to_sample = min(len(members) for members in per_class)
+    return np.sort(np.concatenate([rng.choice(members, n_to_sample, replace=False) for members in per_class]))
+
+
+def balanced_sampler(targets, seed=BALANCE_SEED):
+    """
+    Sampler z wagą 1 / liczność klasy: każda epoka losuje (ze zwracaniem) len(targets)
+    kafelków, w oczekiwaniu po równo z każdej klasy - wykorzystuje wszystkie kafelki.
+    """
+    counts = np.bincount(targets, minlength=len(LABELS)).astype(np.float64)
+    weights = 1.0 / np.maximum(counts, 1)
+    generator = torch.Generator().manual_seed(seed)
+    return WeightedRandomSampler(torch.as_tensor(weights[targets]), num_samples=len(targets),
+                                 replacement=True, generator=generator)
+
+
+def scan_counts(n_scans, fractions=SPLIT_FRACTIONS):
+    """
+    Liczby skanów w zbiorach: fractions * n_scans zaokrąglone do całych skanów, ale
+    co najmniej jeden skan na zbiór (np. 4 skany -> 2/1/1, a nie 3/0/1).
+    """
+    if n_scans < len(fractions):
+        raise ValueError(f"Podział na {len(fractions)} zbiory wymaga co najmniej {len(fractions)} skanów "
+                         f"(jest {n_scans}).")
+    ideal = np.asarray(fractions, dtype=np.float64) / np.sum(fractions) * n_scans
+    counts = np.maximum(np.round(ideal).astype(int), 1)
+    while counts.sum() > n_scans:   # Nadmiar zabieramy zbiorowi najbardziej ponad udział (zostaje >= 1)
+        excess = np.where(counts > 1, counts - ideal, -np.inf)
+        counts[np.argmax(excess)] -= 1
+    while counts.sum() < n_scans:
+        counts[np.argmax(ideal - counts)] += 1
+    return counts
+
+
+def split_by_scan(reader, fractions=SPLIT_FRACTIONS, seed=SPLIT_SEED):
+    """
+    Podział kafelków na zbiory według skanów: {"train": numery, "val": ..., "test": ...}.
+    Skany są tasowane i dzielone w proporcjach fractions (scan_counts - każdy zbiór
+    dostaje co najmniej jeden skan; ValueError, gdy skanów jest mniej niż zbiorów).
+    """
+    names = ("train", "val", "test")[:len(fractions)]
+    order = np.random.default_rng(seed).permutation(len(reader.scans))
+    bounds = np.cumsum(scan_counts(len(order), fractions))
+    splits, start = {}, 0
+    for name, end in zip(names, bounds):
+        splits[name] = np.nonzero(np.isin(reader.scan_ids, order[start:end]))[0]
+        start = end
+    return splits
+
+
+def scans_of(reader, indices):
+    """Nazwy skanów, z których pochodzą kafelki indices."""
+    return [reader.scans[k] for k in np.unique(reader.scan_ids[indices])]
+
+
+# ====================================================================
+#  KOPIA SHARDÓW NA LOKALNY DYSK
+# ====================================================================
+
+def _read_index_bytes(scan_dir):
+    path = os.path.join(scan_dir, INDEX_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def stage_shards(root, local_root):
+    """
+    Kopiuje foldery skanów z shardami z root do local_root (pomija skany, których
+    indeks się nie zmienił - rozmiar i CRC tiles_index.npy) i zwraca local_root
+    - do użycia w TileShardReader. Działa też w trakcie ekstrakcji: indeks jest
+    zapamiętywany PRZED kopiowaniem shardów (shardy tylko rosną, więc kopia pokrywa
+    wszystkie jego kafelki) i zapisywany na końcu.
+    """
+    os.makedirs(local_root, exist_ok=True)
+    for scan_dir in find_scan_dirs(root):
+        target = os.path.join(local_root, os.path.basename(os.path.normpath(scan_dir)))
+        index_bytes = _read_index_bytes(scan_dir)
+        staged = _read_index_bytes(target)
+        if (index_bytes is not None and staged is not None and len(staged) == len(index_bytes)
+                and zlib.crc32(staged) == zlib.crc32(index_bytes)):
+            continue
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.makedirs(target)
+        for name in sorted(os.listdir(scan_dir)):
+            if not name.endswith(".tmp") and name != INDEX_FILE:
+                shutil.copyfile(os.path.join(scan_dir, name), os.path.join(target, name))
+        # Indeks na końcu - przerwana kopia nie ma indeksu i przy następnym wywołaniu jest powtarzana
+        if index_bytes is not None:
+            _save_atomic(os.path.join(target, INDEX_FILE), lambda f: f.write(index_bytes))
+    return local_root
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Użycie: python tile_dataset.py <katalog>")
+        sys.exit(1)
+    reader = TileShardReader(sys.argv[1])
+    if not len(reader):
+        print(f"BŁĄD: Brak kafelków w: {sys.argv[1]}")
+        sys.exit(1)
+    dataset = TileDataset(reader)
+    print(f"{len(dataset)} kafelków z {len(reader.scans)} skanów: {dataset.class_counts()}")
+    if len(reader.scans) >= len(SPLIT_FRACTIONS):
+        for name, indices in split_by_scan(reader).items():
+            print(f"  {name:<6} {len(indices):>7} kafelków, skany: {', '.join(scans_of(reader, indices))}")
+    else:
+        print(f"OSTRZEŻENIE: Mniej niż {len(SPLIT_FRACTIONS)} skany - pomijam podział po skanach.")
+    balanced = undersample(reader.labels)
+    print(f"Undersampling: {TileDataset(reader, balanced).class_counts()}")
+
+    start = time.perf_counter()
+    for j in np.random.default_rng(0).permutation(len(dataset)):
+        dataset[j]
+    seconds = time.perf_counter() - start
+    print(f"Epoka odczytu (losowa kolejność): {seconds:.2f} s ({len(dataset) / max(seconds, 1e-9):.0f} kafelków/s)")
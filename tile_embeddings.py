@@ -0,0 +1,461 @@
+import copy
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import models
+
+from tile_shards import TileShardReader, LABELS, INDEX_FILE, _save_atomic
+from tile_dataset import TileDataset, split_by_scan, SPLIT_FRACTIONS
+from tile_augment import BatchAugment, TileBatchLoader, INPUT_SIZE
+
+# ====================================================================
+#  EMBEDDINGI KAFELKÓW (float16) I SZYBKIE GŁOWY / KALIBRACJA
+# ====================================================================
+#
+#  Głowa modeli to Dropout(0.5) + Linear(num_ftrs, 2) na wyjściu ostatniej
+#  warstwy sieci (ResNet18: 512 cech po avgpool, MobileNetV2: 1280). Nowa
+#  głowa, temperatura albo próg decyzji wymagały dotąd pełnego forwardu sieci
+#  na każdym kafelku. Tutaj forward jest robiony RAZ:
+#    - extract_embeddings zapisuje cechy przed głową (float16) dla każdego
+#      skanu: embeddings_<nazwa>.npy (N, D) - wiersz k = wiersz k tiles_index.npy,
+#      obok embeddings_<nazwa>.json (model, wagi, rozmiar wejścia, liczba
+#      kafelków, suma kontrolna indeksu). Zmiana wag lub dopisane kafelki
+#      = embeddingi skanu liczone od nowa, aktualne skany są pomijane,
+#    - load_embeddings składa je w tablicę zgodną z numerami kafelków
+#      TileShardReader (te same split_indices co w notebookach),
+#    - na cechach w pamięci: trening głowy (train_head), logity istniejącej
+#      głowy (head_logits), temperatura (fit_temperature, wtapiana w Linear -
+#      fold_temperature, więc .pth dla WebApp się nie zmienia), próg decyzji
+#      globalny i per skan (best_threshold, slide_thresholds).
+#  Cechy są liczone transformacją walidacyjną (Resize + CenterCrop), jak w ewaluacji.
+#
+#  Użycie: python tile_embeddings.py <katalog> <resnet|mobilenet> <wagi.pth> [katalog_embeddingów]
+#  - ekstrakcja, test zgodności z pełnym modelem, kalibracja i nowa głowa
+#  na podziale po skanach.
+
+EMBED_PREFIX = "embeddings"
+EMBED_DTYPE = np.float16
+EXTRACT_BATCH = 128
+
+# Architektury z notebooków: konstruktor torchvision + nazwa atrybutu głowy
+ARCHITECTURES = {
+    "resnet": (models.resnet18, "fc"),
+    "mobilenet": (models.mobilenet_v2, "classifier"),
+}
+
+HEAD_DROPOUT = 0.5
+HEAD_EPOCHS = 30
+HEAD_BATCH_SIZE = 1024
+HEAD_LR = 1e-3
+HEAD_WEIGHT_DECAY = 1e-4
+HEAD_SEED = 42
+
+TEMPERATURE_ITERS = 100
+ECE_BINS = 15
+THRESHOLDS = np.linspace(0.0, 1.0, 101)   # Siatka progów P(tumor)
+
+# Test zgodności: logity głowy na embeddingach float16 vs pełny forward
+PARITY_TILES = 64
+PARITY_TOLERANCE = 5e-2
+
+
+# ====================================================================
+#  MODEL I CECHY PRZED GŁOWĄ
+# ====================================================================
+
+def head_name(model):
+    """Atrybut z głową modelu: 'fc' (ResNet) albo 'classifier' (MobileNet)."""
+    return "fc" if isinstance(getattr(model, "fc", None), nn.Module) else "classifier"
+
+
+def new_head(in_features, dropout=HEAD_DROPOUT):
+    """Głowa jak w notebookach: Dropout + Linear(in_features, 2)."""
+    return nn.Sequential(nn.Dropout(p=dropout), nn.Linear(in_features, len(LABELS)))
+
+
+def build_model(arch, weights=None, device="cpu"):
+    """Architektura z notebooka (arch: 'resnet' / 'mobilenet') z naszą głową i wagami .pth."""
+    constructor, head = ARCHITECTURES[arch]
+    model = constructor(weights=None)
+    in_features = [m for m in getattr(model, head).modules() if isinstance(m, nn.Linear)][-1].in_features
+    setattr(model, head, new_head(in_features))
+    if weights is not None:
+        model.load_state_dict(torch.load(weights, map_location=device))
+    return model.to(device).eval()
+
+
+def weights_key(path):
+    """Krótki skrót pliku wag - embeddingi są ważne tylko dla tych samych wag."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def state_key(model):
+    """Skrót wag modelu w pamięci (np. bez pliku .pth) - jak weights_key, unikalny dla wag."""
+    h = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        h.update(name.encode())
+        h.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+@contextmanager
+def headless(model, head=None):
+    """Na czas bloku głowa = nn.Identity, więc model(inputs) zwraca cechy przed głową."""
+    head = head or head_name(model)
+    saved = getattr(model, head)
+    setattr(model, head, nn.Identity())
+    try:
+        yield model
+    finally:
+        setattr(model, head, saved)
+
+
+def head_of(model):
+    """Kopia głowy modelu (do logitów na embeddingach)."""
+    return copy.deepcopy(getattr(model, head_name(model))).cpu().eval()
+
+
+def apply_head(model, head):
+    """Wstawia wagi głowy (np. po train_head / fold_temperature) do modelu - gotowego do zapisu .pth."""
+    getattr(model, head_name(model)).load_state_dict(head.state_dict())
+    return model
+
+
+# ====================================================================
+#  ZAPIS I ODCZYT EMBEDDINGÓW
+# ====================================================================
+
+def embedding_paths(scan_dir, name, store_root=None):
+    """(plik .npy, plik .json) embeddingów skanu - w folderze skanu albo w store_root/<folder skanu>."""
+    folder = scan_dir if store_root is None else os.path.join(store_root, os.path.basename(os.path.normpath(scan_dir)))
+    base = os.path.join(folder, f"{EMBED_PREFIX}_{name}")
+    return base + ".npy", base + ".json"
+
+
+def _scan_rows(reader, scan_id):
+    return np.nonzero(reader.scan_ids == scan_id)[0]
+
+
+def _embedding_meta(index, name, weights_id, input_size):
+    # Z indeksu skanu w reader (nie z pliku na dysku) - shardy mogą rosnąć w trakcie ekstrakcji
+    return {"model": name, "weights": weights_id, "input_size": input_size,
+            "tiles": len(index), "index_crc32": zlib.crc32(index.tobytes())}
+
+
+def _is_current(scan_dir, name, meta, store_root):
+    npy_path, json_path = embedding_paths(scan_dir, name, store_root)
+    if not (os.path.isfile(npy_path) and os.path.isfile(json_path)):
+        return False
+    with open(json_path) as f:
+        saved = json.load(f)
+    return all(saved.get(key) == value for key, value in meta.items())
+
+
+@torch.no_grad()
+def extract_embeddings(model, reader, name, weights_id, store_root=None, input_size=INPUT_SIZE,
+                       batch_size=EXTRACT_BATCH, device=None):
+    """
+    Cechy przed głową dla wszystkich kafelków reader (skan po skanie, aktualne pomija)
+    i zwraca load_embeddings(reader, name, store_root). Model jest przełączany w eval().
+    weights_id odróżnia wagi (weights_key(plik .pth) albo state_key(model)).
+    """
+    device = device or next(model.parameters()).device
+    dim = [m for m in getattr(model, head_name(model)).modules() if isinstance(m, nn.Linear)][-1].in_features
+    augment = BatchAugment(input_size, train=False, device=device)
+    model.eval()
+    with headless(model):
+        for scan_id, scan_dir in enumerate(reader.scan_dirs):
+            rows = _scan_rows(reader, scan_id)
+            meta = _embedding_meta(reader.index[rows], name, weights_id, input_size)
+            if _is_current(scan_dir, name, meta, store_root):
+                continue
+            start, filled = time.perf_counter(), 0
+            features = np.empty((len(rows), dim), dtype=EMBED_DTYPE)
+            for inputs, _ in TileBatchLoader(TileDataset(reader, rows), batch_size, augment):
+                features[filled:filled + len(inputs)] = model(inputs).to("cpu", torch.float16).numpy()
+                filled += len(inputs)
+
+            npy_path, json_path = embedding_paths(scan_dir, name, store_root)
+            os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+            _save_atomic(npy_path, lambda f: np.save(f, features))
+            meta["dim"] = dim
+            _save_atomic(json_path, lambda f: f.write(json.dumps(meta, indent=2).encode()))
+            print(f"Embeddingi {name} skanu {reader.scans[scan_id]}: {features.shape[0]} x {features.shape[1]} "
+                  f"({time.perf_counter() - start:.1f} s)")
+    return load_embeddings(reader, name, store_root)
+
+
+def load_embeddings(reader, name, store_root=None):
+    """
+    Embeddingi float16 (len(reader), D) w numeracji kafelków reader - embeddings[split_indices[x]].
+    None, gdy któregoś skanu brakuje albo nie pasuje do indeksu skanu w reader
+    (liczba kafelków, suma kontrolna, liczba wierszy .npy).
+    """
+    parts = []
+    for scan_id, scan_dir in enumerate(reader.scan_dirs):
+        npy_path, json_path = embedding_paths(scan_dir, name, store_root)
+        index = reader.index[_scan_rows(reader, scan_id)]
+        if not (os.path.isfile(json_path) and os.path.isfile(npy_path)):
+            print(f"BŁĄD: Brak embeddingów {name} skanu {reader.scans[scan_id]} - uruchom extract_embeddings.")
+            return None
+        with open(json_path) as f:
+            meta = json.load(f)
+        features = np.load(npy_path, mmap_mode="r")
+        if (meta["tiles"] != len(index) or meta["index_crc32"] != zlib.crc32(index.tobytes())
+                or len(features) != meta["tiles"]):
+            print(f"BŁĄD: Embeddingi {name} skanu {reader.scans[scan_id]} nie pasują do {INDEX_FILE} - "
+                  f"uruchom extract_embeddings ponownie.")
+            return None
+        parts.append(features)
+    if not parts:
+        return np.zeros((0, 0), dtype=EMBED_DTYPE)
+    return np.concatenate(parts)
+
+
+# ====================================================================
+#  GŁOWY NA EMBEDDINGACH
+# ====================================================================
+
+@torch.no_grad()
+def head_logits(head, features, device="cpu", batch_size=HEAD_BATCH_SIZE * 16):
+    """Logity głowy (N, 2) float32 na CPU dla embeddingów (N, D)."""
+    head = head.to(device).eval()
+    out = [head(torch.from_numpy(np.asarray(features[start:start + batch_size])).to(device).float()).cpu()
+           for start in range(0, len(features), batch_size)]
+    return torch.cat(out) if out else torch.zeros(0, len(LABELS))
+
+
+def train_head(features, labels, val=None, epochs=HEAD_EPOCHS, lr=HEAD_LR, weight_decay=HEAD_WEIGHT_DECAY,
+               dropout=HEAD_DROPOUT, balance=True, batch_size=HEAD_BATCH_SIZE, seed=HEAD_SEED, device="cpu"):
+    """
+    Nowa głowa Dropout + Linear wytrenowana na embeddingach (N, D) z etykietami labels.
+    balance - strata z wagami 1 / liczność klasy (jak balanced_sampler, bez losowania).
+    val=(cechy, etykiety) - zwracana jest głowa z najlepszą celnością walidacyjną.
+    Zwraca (głowa na CPU, historia {'train_loss', 'val_acc'}).
+    """
+    torch.manual_seed(seed)
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.from_numpy(np.asarray(features)).to(device).float()
+    y = torch.as_tensor(labels, dtype=torch.int64).to(device)
+    counts = torch.bincount(y, minlength=len(LABELS)).float()
+    weight = (counts.sum() / counts.clamp(min=1) / len(LABELS)) if balance else None
+
+    head = new_head(x.shape[1], dropout).to(device)
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=weight_decay)
+    history = {"train_loss": [], "val_acc": []}
+    best_acc, best_state = -1.0, None
+    for epoch in range(epochs):
+        head.train()
+        running_loss = 0.0
+        for batch in torch.randperm(len(x), generator=generator).split(batch_size):
+            batch = batch.to(device)
+            optimizer.zero_grad()
+            loss = F.cross_entropy(head(x[batch]), y[batch], weight=weight)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * len(batch)
+        history["train_loss"].append(running_loss / max(len(x), 1))
+        if val is not None:
+            acc = float((head_logits(head, val[0], device).argmax(1).numpy() == np.asarray(val[1])).mean())
+            history["val_acc"].append(acc)
+            if acc > best_acc:
+                best_acc, best_state = acc, copy.deepcopy(head.state_dict())
+    if best_state is not None:
+        head.load_state_dict(best_state)
+    return head.cpu().eval(), history
+
+
+# ====================================================================
+#  KALIBRACJA: TEMPERATURA I PROGI
+# ====================================================================
+
+def fit_temperature(logits, labels, max_iter=TEMPERATURE_ITERS):
+    """Temperatura T minimalizująca NLL softmax(logits / T) (skalowanie temperaturą, LBFGS na log T)."""
+    labels = torch.as_tensor(labels, dtype=torch.int64)
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_t.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return float(log_t.detach().exp())
+
+
+def fold_temperature(head, temperature):
+    """Kopia głowy z Linear podzielonym przez T - logity modelu są już skalibrowane (te same decyzje)."""
+    head = copy.deepcopy(head)
+    linear = [m for m in head.modules() if isinstance(m, nn.Linear)][-1]
+    with torch.no_grad():
+        linear.weight.div_(temperature)
+        linear.bias.div_(temperature)
+    return head
+
+
+def tumor_probs(logits, temperature=1.0):
+    """P(tumor) z logitów (N, 2) jako numpy."""
+    return torch.softmax(logits / temperature, dim=1)[:, LABELS.index("tumor")].numpy()
+
+
+def calibration_error(probs, labels, bins=ECE_BINS):
+    """Expected Calibration Error pewności (max prawdopodobieństwo klasy) w przedziałach równej szerokości."""
+    probs, labels = np.asarray(probs), np.asarray(labels)
+    confidence = np.maximum(probs, 1 - probs)
+    correct = (probs >= 0.5) == (labels == LABELS.index("tumor"))
+    bin_ids = np.minimum(((confidence - 0.5) * 2 * bins).astype(int), bins - 1)
+    error = 0.0
+    for b in range(bins):
+        members = bin_ids == b
+        if members.any():
+            error += members.mean() * abs(correct[members].mean() - confidence[members].mean())
+    return float(error)
+
+
+def balanced_accuracy(probs, labels, thresholds=THRESHOLDS):
+    """Średnia czułości klas dla każdego progu (G,); klasa bez kafelków jest pomijana."""
+    probs, labels = np.asarray(probs), np.asarray(labels)
+    preds = probs[None, :] >= np.asarray(thresholds)[:, None]
+    recalls = [(preds[:, labels == k] == bool(k)).mean(axis=1) for k in range(len(LABELS)) if (labels == k).any()]
+    return np.mean(recalls, axis=0) if recalls else np.full(len(thresholds), np.nan)
+
+
+def best_threshold(probs, labels, thresholds=THRESHOLDS):
+    """
+    (próg P(tumor), zrównoważona celność) - najlepszy próg z siatki.
+    Bez kafelków obu klas próg nie jest wyznaczalny - zwraca (0.5, nan).
+    """
+    if len(np.unique(labels)) < len(LABELS):
+        return 0.5, float("nan")
+    scores = balanced_accuracy(probs, labels, thresholds)
+    # Remisy (np. płaskie P(tumor)) rozstrzyga próg najbliższy 0.5
+    ties = np.flatnonzero(scores >= np.nanmax(scores) - 1e-12)
+    best = int(ties[np.argmin(np.abs(np.asarray(thresholds)[ties] - 0.5))])
+    return float(thresholds[best]), float(scores[best])
+
+
+def slide_thresholds(probs, labels, scan_ids, scans, threshold=0.5, thresholds=THRESHOLDS):
+    """
+    Progi per skan: {skan: {'tiles', 'bacc' (przy wspólnym threshold), 'threshold', 'bacc_own'}}.
+    Własny próg skanu tylko, gdy ma kafelki obu klas (inaczej None).
+    """
+    probs, labels, scan_ids = np.asarray(probs), np.asarray(labels), np.asarray(scan_ids)
+    result = {}
+    for scan_id in np.unique(scan_ids):
+        members = scan_ids == scan_id
+        own_threshold, own_bacc = best_threshold(probs[members], labels[members], thresholds)
+        result[scans[scan_id]] = {
+            "tiles": int(members.sum()),
+            "bacc": float(balanced_accuracy(probs[members], labels[members], [threshold])[0]),
+            "threshold": None if np.isnan(own_bacc) else own_threshold,
+            "bacc_own": None if np.isnan(own_bacc) else own_bacc}
+    return result
+
+
+def head_report(logits, labels, temperature=1.0, threshold=0.5):
+    """Metryki głowy: NLL, ECE, celność i zrównoważona celność przy progu."""
+    labels = np.asarray(labels)
+    probs = tumor_probs(logits, temperature)
+    return {"nll": float(F.cross_entropy(logits / temperature, torch.as_tensor(labels, dtype=torch.int64))),
+            "ece": calibration_error(probs, labels),
+            "acc": float(((probs >= threshold) == (labels == LABELS.index("tumor"))).mean()),
+            "bacc": float(balanced_accuracy(probs, labels, [threshold])[0])}
+
+
+def print_report(name, report):
+    print(f"{name:<34}" + "  ".join(f"{key} {value:.4f}" for key, value in report.items()))
+
+
+def print_slide_thresholds(slides):
+    print(f"{'skan':<20}{'kafelki':>9}{'bacc':>9}{'próg skanu':>12}{'bacc (własny)':>15}")
+    for scan, entry in slides.items():
+        own = "-" if entry["threshold"] is None else f"{entry['threshold']:.2f}"
+        own_bacc = "-" if entry["bacc_own"] is None else f"{entry['bacc_own']:.4f}"
+        print(f"{scan:<20}{entry['tiles']:>9}{entry['bacc']:>9.4f}{own:>12}{own_bacc:>15}")
+
+
+# ====================================================================
+#  TEST ZGODNOŚCI I DEMO NA PODZIALE PO SKANACH
+# ====================================================================
+
+@torch.no_grad()
+def parity_check(model, reader, embeddings, n_tiles=PARITY_TILES, input_size=INPUT_SIZE, tolerance=PARITY_TOLERANCE):
+    """Logity pełnego modelu vs głowa na zapisanych embeddingach (float16) dla pierwszych kafelków."""
+    device = next(model.parameters()).device
+    indices = np.arange(min(n_tiles, len(reader)))
+    inputs, _ = next(iter(TileBatchLoader(TileDataset(reader, indices), len(indices),
+                                          BatchAugment(input_size, train=False, device=device))))
+    expected = model.eval()(inputs).cpu()
+    actual = head_logits(head_of(model), embeddings[indices])
+    max_diff = float((expected - actual).abs().max())
+    ok = max_diff <= tolerance
+    print(f"Zgodność logitów (embeddingi float16 vs pełny model): maks. różnica {max_diff:.2e} "
+          f"(tolerancja {tolerance:.0e}){'' if ok else '  <- POZA TOLERANCJĄ'}")
+    return ok
+
+
+def calibration_demo(model, reader, embeddings):
+    """Podział po skanach: temperatura i próg na val, ocena na test, nowa głowa na train."""
+    splits = split_by_scan(reader)
+    labels = {x: reader.labels[indices] for x, indices in splits.items()}
+    head = head_of(model)
+    logits = {x: head_logits(head, embeddings[indices]) for x, indices in splits.items()}
+
+    start = time.perf_counter()
+    temperature = fit_temperature(logits["val"], labels["val"])
+    threshold, _ = best_threshold(tumor_probs(logits["val"], temperature), labels["val"])
+    print(f"\nTemperatura T = {temperature:.3f}, próg P(tumor) = {threshold:.2f} "
+          f"(val, {time.perf_counter() - start:.2f} s)")
+    print_report("test: głowa modelu", head_report(logits["test"], labels["test"]))
+    print_report("test: + temperatura i próg", head_report(logits["test"], labels["test"], temperature, threshold))
+    print("\nProgi per skan (test, P(tumor) po temperaturze):")
+    print_slide_thresholds(slide_thresholds(tumor_probs(logits["test"], temperature), labels["test"],
+                                            reader.scan_ids[splits["test"]], reader.scans, threshold))
+
+    start = time.perf_counter()
+    new, history = train_head(embeddings[splits["train"]], labels["train"],
+                              val=(embeddings[splits["val"]], labels["val"]))
+    print(f"\nNowa głowa: {len(history['train_loss'])} epok na {len(splits['train'])} kafelkach "
+          f"w {time.perf_counter() - start:.2f} s, najlepsza celność val {max(history['val_acc'], default=0):.4f}")
+    print_report("test: nowa głowa", head_report(head_logits(new, embeddings[splits["test"]]), labels["test"]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[2] not in ARCHITECTURES:
+        print("Użycie: python tile_embeddings.py <katalog> <resnet|mobilenet> <wagi.pth> [katalog_embeddingów]")
+        sys.exit(1)
+    root, arch, weights = sys.argv[1:4]
+    store_root = sys.argv[4] if len(sys.argv) > 4 else None
+    reader = TileShardReader(root)
+    if not len(reader):
+        print(f"BŁĄD: Brak kafelków w: {root}")
+        sys.exit(1)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    model = build_model(arch, weights, device)
+
+    start = time.perf_counter()
+    embeddings = extract_embeddings(model, reader, arch, weights_key(weights), store_root)
+    if embeddings is None:
+        sys.exit(1)
+    print(f"Embeddingi: {embeddings.shape[0]} x {embeddings.shape[1]} {embeddings.dtype} "
+          f"({embeddings.nbytes / 2**20:.1f} MB, {time.perf_counter() - start:.1f} s)")
+    ok = parity_check(model, reader, embeddings)
+    if len(reader.scans) >= len(SPLIT_FRACTIONS):   # split_by_scan: co najmniej jeden skan na zbiór
+        calibration_demo(model, reader, embeddings)
+    else:
+        print(f"OSTRZEŻENIE: Mniej niż {len(SPLIT_FRACTIONS)} skany - pomijam kalibrację na podziale po skanach.")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,301 @@
+import json
+import os
+import sys
+import numpy as np
+
+# ====================================================================
+#  SHARDY KAFELKÓW (surowe uint8, tylko dopisywanie) + INDEKS
+# ====================================================================
+#
+#  Zamiast osobnego PNG dla każdego kafelka (setki tysięcy małych plików na
+#  Dysku Google, potem kopiowanych jeden po drugim) ekstrakcja WSI_Pipeline.ipynb
+#  zapisuje w folderze skanu:
+#    - tiles_00000.u8, tiles_00001.u8, ... - surowe kafelki uint8
+#      (TILE_SIZE, TILE_SIZE, 3) jeden za drugim, SHARD_TILES kafelków na plik;
+#      kafelki brzegowe (mniejsze) są dopełniane białym tłem (PAD_VALUE),
+#    - tiles_index.npy - tablica strukturalna INDEX_DTYPE: współrzędne siatki,
+#      poziom, etykieta (0 = healthy, 1 = tumor - kolejność klas z ImageFolder),
+#      prawdziwy rozmiar kafelka, statystyki tkanki (średnia / odchylenie jasności
+#      przed normalizacją - te same co w has_tissue) oraz shard i pozycja w nim,
+#    - tiles.json - skan, rozmiar kafelka, etykiety, liczba kafelków na shard.
+#  Dopisywanie: kafelki trafiają od razu na koniec bieżącego shardu, a commit()
+#  (po każdym wierszu, przed checkpointem _progress.json) robi fsync i atomowo
+#  podmienia indeks. Wznowienie od wiersza R obcina shardy do kafelków z
+#  wierszy < R, więc nie ma duplikatów ani połówek kafelków.
+#
+#  TileShardReader czyta jeden folder skanu albo folder z folderami skanów:
+#  losowy dostęp przez np.memmap (reader[i]), strumień sekwencyjny w kolejności
+#  zapisu (iter_batches) i wybór kafelków po etykiecie / skanie (select).
+#
+#  Użycie: python tile_shards.py <katalog> - podsumowanie kafelków per skan.
+
+TILE_SIZE = 256
+SHARD_TILES = 1024        # ~200 MB na shard przy kafelkach 256 px
+PAD_VALUE = 255           # Dopełnienie kafelków brzegowych (białe tło)
+STREAM_BATCH = 256        # Kafelki na paczkę w iter_batches
+
+LABELS = ("healthy", "tumor")
+SHARD_PREFIX = "tiles"
+META_FILE = f"{SHARD_PREFIX}.json"
+INDEX_FILE = f"{SHARD_PREFIX}_index.npy"
+
+INDEX_DTYPE = np.dtype([
+    ("col", "<i4"), ("row", "<i4"), ("level", "<i2"), ("label", "u1"),
+    ("height", "<u2"), ("width", "<u2"),
+    ("mean", "<f4"), ("std", "<f4"),
+    ("shard", "<u4"), ("offset", "<u4"),
+])
+
+
+def shard_path(scan_dir, shard):
+    return os.path.join(scan_dir, f"{SHARD_PREFIX}_{shard:05d}.u8")
+
+
+def has_shards(scan_dir):
+    return os.path.isfile(os.path.join(scan_dir, META_FILE))
+
+
+def load_index(scan_dir):
+    """Indeks kafelków skanu (pusty, gdy skan nie ma jeszcze shardów)."""
+    path = os.path.join(scan_dir, INDEX_FILE)
+    if not os.path.isfile(path):
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.load(path)
+
+
+def load_meta(scan_dir):
+    with open(os.path.join(scan_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def _save_atomic(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ====================================================================
+#  ZAPIS
+# ====================================================================
+
+class TileShardWriter:
+    """
+    Dopisuje znormalizowane kafelki skanu do shardów w scan_dir.
+    resume_row=None - zaczyna od zera (usuwa poprzednie shardy i indeks),
+    resume_row=R - zostawia kafelki z wierszy < R (wznowienie z checkpointu).
+    """
+
+    def __init__(self, scan_dir, scan_name, tile_size=TILE_SIZE, shard_tiles=SHARD_TILES, resume_row=None):
+        self.scan_dir = scan_dir
+        self.tile_size = tile_size
+        self.shard_tiles = shard_tiles
+        self.tile_bytes = tile_size * tile_size * 3
+        os.makedirs(scan_dir, exist_ok=True)
+
+        index = load_index(scan_dir) if resume_row is not None else np.zeros(0, dtype=INDEX_DTYPE)
+        if resume_row is not None and has_shards(scan_dir):
+            meta = load_meta(scan_dir)
+            if meta.get("tile_size") != tile_size or meta.get("shard_tiles") != shard_tiles:
+                print("OSTRZEŻENIE: Inny format shardów w folderze skanu - zaczynam od zera.")
+                index = index[:0]
+        self.index = index[index["row"] < resume_row] if resume_row is not None else index
+        self._truncate()
+        self.meta = {"scan": scan_name, "tile_size": tile_size, "shard_tiles": shard_tiles, "labels": list(LABELS)}
+        _save_atomic(os.path.join(scan_dir, META_FILE), lambda f: f.write(json.dumps(self.meta).encode()))
+        self._commit_index()
+
+        self.pending = []
+        self.shard = int(self.index["shard"][-1]) if len(self.index) else 0
+        self.offset = int(self.index["offset"][-1]) + 1 if len(self.index) else 0
+        self.file = None
+        self._buffer = np.full((tile_size, tile_size, 3), PAD_VALUE, dtype=np.uint8)
+
+    def _truncate(self):
+        """Obcina shardy do kafelków z indeksu (usuwa te dopisane po ostatnim commit)."""
+        last_shard = int(self.index["shard"][-1]) if len(self.index) else -1
+        last_size = (int(self.index["offset"][-1]) + 1) * self.tile_bytes if len(self.index) else 0
+        for name in os.listdir(self.scan_dir):
+            if not (name.startswith(SHARD_PREFIX + "_") and name.endswith(".u8")):
+                continue
+            shard = int(name[len(SHARD_PREFIX) + 1:-3])
+            path = os.path.join(self.scan_dir, name)
+            if shard > last_shard:
+                os.remove(path)
+            elif shard == last_shard and os.path.getsize(path) != last_size:
+                os.truncate(path, last_size)
+
+    def _commit_index(self):
+        _save_atomic(os.path.join(self.scan_dir, INDEX_FILE), lambda f: np.save(f, self.index))
+
+    def add(self, tile, col, row, level, label, mean, std):
+        """Dopisuje kafelek uint8 (H, W, 3), H, W <= tile_size; label = 'healthy' / 'tumor'."""
+        height, width = tile.shape[:2]
+        if height != self.tile_size or width != self.tile_size:
+            self._buffer[:] = PAD_VALUE
+            self._buffer[:height, :width] = tile
+            tile = self._buffer
+        if self.offset >= self.shard_tiles:
+            if self.file is not None:
+                # Pełny shard utrwalamy przed zamknięciem - commit() robi fsync tylko bieżącego
+                self._sync()
+                self.file.close()
+                self.file = None
+            self.shard, self.offset = self.shard + 1, 0
+        if self.file is None:
+            self.file = open(shard_path(self.scan_dir, self.shard), "ab")
+        self.file.write(np.ascontiguousarray(tile, dtype=np.uint8).tobytes())
+        self.pending.append((col, row, level, LABELS.index(label), height, width, mean, std, self.shard, self.offset))
+        self.offset += 1
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def commit(self):
+        """Utrwala dopisane kafelki (fsync shardu) i atomowo podmienia indeks."""
+        if self.file is not None:
+            self._sync()
+        if self.pending:
+            self.index = np.concatenate([self.index, np.array(self.pending, dtype=INDEX_DTYPE)])
+            self.pending = []
+            self._commit_index()
+
+    def close(self):
+        self.commit()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def label_counts(self):
+        counts = np.bincount(self.index["label"], minlength=len(LABELS))
+        return {label: int(counts[i]) for i, label in enumerate(LABELS)}
+
+
+# ====================================================================
+#  ODCZYT
+# ====================================================================
+
+def find_scan_dirs(root):
+    """root, jeśli sam jest folderem skanu z shardami, inaczej jego podfoldery z shardami."""
+    if has_shards(root):
+        return [root]
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root)) if has_shards(os.path.join(root, name))]
+
+
+class TileShardReader:
+    """
+    Kafelki z shardów jednego lub wielu skanów jako jedna numerowana kolekcja.
+    index - połączony indeks (INDEX_DTYPE), scan_ids[i] - numer skanu kafelka w scans.
+    Shardy są otwierane leniwie (np.memmap) i nie są przenoszone przy pickle,
+    więc czytnik można przekazać do workerów DataLoadera.
+    """
+
+    def __init__(self, roots, scans=None):
+        roots = [roots] if isinstance(roots, str) else list(roots)
+        self.scan_dirs, self.scans, self.tile_size = [], [], None
+        indexes, scan_ids = [], []
+        for scan_dir in (d for root in roots for d in find_scan_dirs(root)):
+            meta = load_meta(scan_dir)
+            if scans is not None and meta["scan"] not in scans:
+                continue
+            if self.tile_size is None:
+                self.tile_size = meta["tile_size"]
+            elif meta["tile_size"] != self.tile_size:
+                print(f"OSTRZEŻENIE: Pomijam {scan_dir} - inny rozmiar kafelka ({meta['tile_size']}).")
+                continue
+            index = load_index(scan_dir)
+            scan_ids.append(np.full(len(index), len(self.scans), dtype=np.int32))
+            indexes.append(index)
+            self.scan_dirs.append(scan_dir)
+            self.scans.append(meta["scan"])
+        self.tile_size = self.tile_size or TILE_SIZE
+        self.index = np.concatenate(indexes) if indexes else np.zeros(0, dtype=INDEX_DTYPE)
+        self.scan_ids = np.concatenate(scan_ids) if scan_ids else np.zeros(0, dtype=np.int32)
+        self.labels = self.index["label"].astype(np.int64)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _shard(self, scan_id, shard):
+        key = (scan_id, shard)
+        if key not in self._shards:
+            path = shard_path(self.scan_dirs[scan_id], shard)
+            n_tiles = os.path.getsize(path) // (self.tile_size * self.tile_size * 3)
+            self._shards[key] = np.memmap(path, dtype=np.uint8, mode="r",
+                                          shape=(n_tiles, self.tile_size, self.tile_size, 3))
+        return self._shards[key]
+
+    def tile(self, i, padded=False):
+        """Kafelek i jako uint8 (H, W, 3) - widok na shard, bez kopii."""
+        record = self.index[i]
+        tile = self._shard(int(self.scan_ids[i]), int(record["shard"]))[int(record["offset"])]
+        return tile if padded else tile[:record["height"], :record["width"]]
+
+    def __getitem__(self, i):
+        return self.tile(i)
+
+    def get_batch(self, indices):
+        """Kafelki (dopełnione do tile_size) o podanych numerach jako tablica (N, S, S, 3)."""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices), self.tile_size, self.tile_size, 3), dtype=np.uint8)
+        # Kolejność zapisu (skan, shard, pozycja) - odczyt z dysku idzie do przodu
+        order = np.lexsort((self.index["offset"][indices], self.index["shard"][indices], self.scan_ids[indices]))
+        for j in order:
+            out[j] = self.tile(indices[j], padded=True)
+        return out
+
+    def storage_order(self, indices=None):
+        """Numery kafelków posortowane w kolejności zapisu na dysku."""
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        return indices[np.lexsort((self.index["offset"][indices], self.index["shard"][indices],
+                                   self.scan_ids[indices]))]
+
+    def iter_batches(self, indices=None, batch_size=STREAM_BATCH):
+        """Strumień sekwencyjny: (numery, kafelki (N, S, S, 3)) w kolejności zapisu."""
+        ordered = self.storage_order(indices)
+        for start in range(0, len(ordered), batch_size):
+            chunk = ordered[start:start + batch_size]
+            yield chunk, self.get_batch(chunk)
+
+    def select(self, labels=None, scans=None):
+        """Numery kafelków z podanymi etykietami ('healthy' / 'tumor') i / lub ze skanów o podanych nazwach."""
+        keep = np.ones(len(self), dtype=bool)
+        if labels is not None:
+            keep &= np.isin(self.labels, [LABELS.index(label) for label in labels])
+        if scans is not None:
+            keep &= np.isin(self.scan_ids, [i for i, name in enumerate(self.scans) if name in scans])
+        return np.nonzero(keep)[0]
+
+    def summary(self):
+        """{skan: {etykieta: liczba kafelków}}."""
+        counts = np.zeros((len(self.scans), len(LABELS)), dtype=np.int64)
+        np.add.at(counts, (self.scan_ids, self.labels), 1)
+        return {scan: {label: int(counts[i, j]) for j, label in enumerate(LABELS)}
+                for i, scan in enumerate(self.scans)}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Użycie: python tile_shards.py <katalog>")
+        sys.exit(1)
+    reader = TileShardReader(sys.argv[1])
+    if not len(reader.scans):
+        print(f"BŁĄD: Brak shardów kafelków w: {sys.argv[1]}")
+        sys.exit(1)
+    summary = reader.summary()
+    for scan, counts in summary.items():
+        print(f"Skan {scan}: " + " | ".join(f"{counts[label]} {label}" for label in LABELS))
+    totals = {label: sum(counts[label] for counts in summary.values()) for label in LABELS}
+    print(f"Łącznie {len(reader)} kafelków w {len(reader.scans)} skanach: "
+          + " | ".join(f"{totals[label]} {label}" for label in LABELS))
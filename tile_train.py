@@ -0,0 +1,181 @@
+import copy
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import models
+
+from tile_shards import TileShardReader
+from tile_dataset import TileDataset, undersample, balanced_sampler, split_by_scan, scans_of
+from tile_augment import BatchAugment, TileBatchLoader, INPUT_SIZE
+from tile_embeddings import new_head
+
+# ====================================================================
+#  TRENING Z LINII POLECEŃ (BEZ NOTEBOOKA)
+# ====================================================================
+#
+#  Ten sam trening co kroki 4-6 notebooków RESNET / MOBILENET, ale jako skrypt
+#  na shardach kafelków (np. na serwerze z GPU, bez Colab):
+#    - podział po skanach (split_by_scan), balansowanie undersample / weighted,
+#    - TileBatchLoader: odczyt i augmentacja paczek w wątkach w tle (tile_augment.py),
+#    - ResNet18: pełne fine-tuning z trzema LR (głowa / layer3-4 / reszta),
+#      MobileNetV2: zamrożona sieć poza ostatnim blokiem cech i głową,
+#    - Adam + ReduceLROnPlateau(val acc) + early stopping; najlepsze wagi
+#      zapisywane jako final_best_model_epoch_<n>.pth (jak w notebookach).
+#  Na koniec dokładność na zbiorze testowym i czas epok.
+#
+#  Użycie: python tile_train.py <katalog> <resnet|mobilenet> [katalog_wyjściowy] [epoki]
+
+LEARNING_RATE = 1e-4
+BATCH_SIZE = 64
+NUM_EPOCHS = 40
+EARLY_STOPPING_PATIENCE = 7
+BALANCE_MODE = "undersample"   # "undersample" = po równo z klas, "weighted" = wszystkie kafelki + sampler z wagami klas
+RANDOM_SEED = 42
+PRETRAINED = True              # Wagi ImageNet (pobierane przez torchvision przy pierwszym użyciu)
+OUTPUT_DIR = "train_output"
+
+
+def build_training_model(arch, pretrained=PRETRAINED, lr=LEARNING_RATE):
+    """Model i grupy parametrów optymalizatora jak w kroku 5 notebooka arch ('resnet' / 'mobilenet')."""
+    if arch == "resnet":
+        model = models.resnet18(weights=models.ResNet18_Weights.IMAGENET1K_V1 if pretrained else None)
+        model.fc = new_head(model.fc.in_features)
+        low = [model.conv1, model.bn1, model.layer1, model.layer2]
+        groups = [
+            {'params': list(model.fc.parameters()), 'lr': lr},
+            {'params': list(model.layer3.parameters()) + list(model.layer4.parameters()), 'lr': lr / 10},
+            {'params': [p for m in low for p in m.parameters()], 'lr': lr / 100},
+        ]
+    elif arch == "mobilenet":
+        model = models.mobilenet_v2(weights=models.MobileNet_V2_Weights.IMAGENET1K_V1 if pretrained else None)
+        for param in model.parameters():
+            param.requires_grad = False
+        model.classifier = new_head(model.classifier[1].in_features)
+        for param in model.features[-1].parameters():
+            param.requires_grad = True
+        groups = [
+            {'params': list(model.classifier.parameters()), 'lr': lr},
+            {'params': list(model.features[-1].parameters()), 'lr': lr / 10},
+        ]
+    else:
+        raise ValueError(f"Nieznana architektura: {arch} (resnet / mobilenet)")
+    return model, groups
+
+
+def make_loaders(reader, splits, device, batch_size=BATCH_SIZE, balance_mode=BALANCE_MODE, seed=RANDOM_SEED,
+                 input_size=INPUT_SIZE):
+    """TileBatchLoader dla train / val / test (krok 4 notebooków)."""
+    train_indices = splits["train"]
+    if balance_mode == "undersample":
+        train_indices = undersample(reader.labels, train_indices, seed=seed)
+    datasets = {"train": TileDataset(reader, train_indices),
+                "val": TileDataset(reader, splits["val"]),
+                "test": TileDataset(reader, splits["test"])}
+    sampler = balanced_sampler(datasets["train"].targets, seed=seed) if balance_mode == "weighted" else None
+    augment = {"train": BatchAugment(input_size, train=True, seed=seed, device=device),
+               "val": BatchAugment(input_size, train=False, device=device)}
+    return {
+        x: TileBatchLoader(datasets[x], batch_size, augment["train" if x == "train" else "val"],
+                           shuffle=x == "train" and sampler is None,
+                           sampler=sampler if x == "train" else None, seed=seed)
+        for x in datasets
+    }
+
+
+def run_epoch(model, loader, criterion, optimizer=None, device="cpu"):
+    """Jedna epoka (z optimizer - trening, bez - ewaluacja); zwraca (strata, dokładność)."""
+    model.train(optimizer is not None)
+    total_loss, corrects, seen = 0.0, 0, 0
+    with torch.set_grad_enabled(optimizer is not None):
+        for inputs, labels in loader:
+            inputs, labels = inputs.to(device), labels.to(device)
+            outputs = model(inputs)
+            loss = criterion(outputs, labels)
+            if optimizer is not None:
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+            total_loss += loss.item() * inputs.size(0)
+            corrects += int((outputs.argmax(1) == labels).sum())
+            seen += inputs.size(0)
+    return total_loss / max(seen, 1), corrects / max(seen, 1)
+
+
+def train(model, groups, loaders, output_dir, epochs=NUM_EPOCHS, patience=EARLY_STOPPING_PATIENCE, device="cpu"):
+    """
+    Pętla z kroku 6 notebooków: ReduceLROnPlateau na val acc, early stopping po
+    patience epokach bez poprawy. Zwraca (najlepsza epoka, ścieżka wag, historia);
+    model kończy z najlepszymi wagami.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(groups)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=2)
+
+    best_acc, best_epoch, best_path = -1.0, 0, None
+    best_model_wts = copy.deepcopy(model.state_dict())
+    history = {'train_loss': [], 'train_acc': [], 'val_loss': [], 'val_acc': [], 'seconds': []}
+    epochs_no_improve = 0
+    for epoch in range(1, epochs + 1):
+        start = time.perf_counter()
+        train_loss, train_acc = run_epoch(model, loaders["train"], criterion, optimizer, device)
+        val_loss, val_acc = run_epoch(model, loaders["val"], criterion, device=device)
+        seconds = time.perf_counter() - start
+        for key, value in zip(history, (train_loss, train_acc, val_loss, val_acc, seconds)):
+            history[key].append(value)
+        print(f"Epoka {epoch}/{epochs}: train loss {train_loss:.4f} acc {train_acc:.4f} | "
+              f"val loss {val_loss:.4f} acc {val_acc:.4f} | {seconds:.1f} s")
+        scheduler.step(val_acc)
+
+        if val_acc > best_acc:
+            best_acc, best_epoch, epochs_no_improve = val_acc, epoch, 0
+            best_model_wts = copy.deepcopy(model.state_dict())
+            best_path = os.path.join(output_dir, f"final_best_model_epoch_{epoch}.pth")
+            torch.save(best_model_wts, best_path)
+            print(f"====> Nowy najlepszy model zapisany w: {best_path} (Acc: {best_acc:.4f})")
+        else:
+            epochs_no_improve += 1
+            if epochs_no_improve >= patience:
+                print(f"EARLY STOPPING: brak poprawy przez {patience} epok.")
+                break
+
+    model.load_state_dict(best_model_wts)
+    return best_epoch, best_path, history
+
+
+def main(data_dir, arch, output_dir=OUTPUT_DIR, epochs=NUM_EPOCHS):
+    torch.manual_seed(RANDOM_SEED)
+    np.random.seed(RANDOM_SEED)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    reader = TileShardReader(data_dir)
+    if len(reader) == 0:
+        print(f"BŁĄD: Brak shardów kafelków w: {data_dir}")
+        return 1
+
+    splits = split_by_scan(reader)
+    for name, indices in splits.items():
+        print(f"{name}: {len(indices)} kafelków, skany: {', '.join(scans_of(reader, indices))}")
+    loaders = make_loaders(reader, splits, device)
+    model, groups = build_training_model(arch)
+
+    start = time.perf_counter()
+    best_epoch, best_path, history = train(model, groups, loaders, output_dir, epochs=epochs, device=device)
+    _, test_acc = run_epoch(model, loaders["test"], nn.CrossEntropyLoss(), device=device)
+    print(f"\nTrening zakończony w {time.perf_counter() - start:.0f} s "
+          f"(średnio {np.mean(history['seconds']):.1f} s/epokę); najlepsza epoka {best_epoch}: {best_path}")
+    print(f"Dokładność testowa: {test_acc:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Użycie: python tile_train.py <katalog> <resnet|mobilenet> [katalog_wyjściowy] [epoki]")
+        sys.exit(1)
+    sys.exit(main(sys.argv[1], sys.argv[2],
+                  sys.argv[3] if len(sys.argv) > 3 else OUTPUT_DIR,
+                  int(sys.argv[4]) if len(sys.argv) > 4 else NUM_EPOCHS))
@@ -0,0 +1,70 @@
+import math
+import numpy as np
+
+# ====================================================================
+#  MASKA TKANKI Z MINIATURY SKANU (PRE-PASS)
+# ====================================================================
+#
+#  has_tissue() może odrzucić kafelek dopiero po odczytaniu go w pełnej
+#  rozdzielczości, a większość skanu piersi to puste szkło. Tutaj raz
+#  czytamy miniaturę skanu, liczymy średnią jasność w bloku odpowiadającym
+#  każdemu kafelkowi siatki i do czytnika trafiają tylko kandydaci.
+#
+#  Średnia jasność bloku miniatury ~ średnia kafelka w pełnej rozdzielczości,
+#  więc używamy tego samego MAX_MEAN_THRESHOLD (z małym zapasem). Odchylenie
+#  standardowe po zmniejszeniu obrazu jest zaniżone, dlatego MIN_STD_THRESHOLD
+#  sprawdza dalej dokładnie has_tissue() na odczytanym kafelku.
+
+MASK_PX_PER_TILE = 8     # Ile pikseli miniatury przypada na jeden kafelek siatki
+MASK_MEAN_MARGIN = 10    # Zapas dla progu jasności (miniatura uśrednia krawędzie tkanki)
+MASK_DILATION = 1        # O ile kafelków poszerzyć maskę (niedokładne wyrównanie miniatury)
+
+
+def _dilate(mask: np.ndarray, iterations: int) -> np.ndarray:
+    """Dylatacja maski (sąsiedztwo 4-spójne) bez zależności od scipy/cv2."""
+    for _ in range(iterations):
+        grown = mask.copy()
+        grown[1:, :] |= mask[:-1, :]
+        grown[:-1, :] |= mask[1:, :]
+        grown[:, 1:] |= mask[:, :-1]
+        grown[:, :-1] |= mask[:, 1:]
+        mask = grown
+    return mask
+
+
+def compute_tissue_mask(slide, tiles_gen, level: int, tile_size: int, max_mean_threshold: float,
+                        px_per_tile=MASK_PX_PER_TILE, mean_margin=MASK_MEAN_MARGIN,
+                        dilation=MASK_DILATION) -> np.ndarray:
+    """
+    Zwraca maskę bool (rows, cols) siatki 'level': True = kafelek może zawierać tkankę.
+    W razie błędu odczytu miniatury zwraca maskę pełną (nic nie pomijamy).
+    """
+    cols, rows = tiles_gen.level_tiles[level]
+    level_w, level_h = tiles_gen.level_dimensions[level]
+    scale = px_per_tile / tile_size
+    thumb_w = max(1, math.ceil(level_w * scale))
+    thumb_h = max(1, math.ceil(level_h * scale))
+
+    try:
+        thumb = slide.get_thumbnail((thumb_w, thumb_h)).convert('L').resize((thumb_w, thumb_h))
+    except Exception as e:
+        print(f"OSTRZEŻENIE: Nie udało się odczytać miniatury ({e}). Pomijam pre-pass tkanki.")
+        return np.ones((rows, cols), dtype=bool)
+
+    gray = np.asarray(thumb, dtype=np.float64)
+
+    # Dopełnienie do pełnych bloków; piksele spoza skanu nie wchodzą do średniej
+    padded = np.zeros((rows * px_per_tile, cols * px_per_tile), dtype=np.float64)
+    valid = np.zeros_like(padded)
+    h = min(thumb_h, padded.shape[0])
+    w = min(thumb_w, padded.shape[1])
+    padded[:h, :w] = gray[:h, :w]
+    valid[:h, :w] = 1.0
+
+    block_sum = padded.reshape(rows, px_per_tile, cols, px_per_tile).sum(axis=(1, 3))
+    block_count = valid.reshape(rows, px_per_tile, cols, px_per_tile).sum(axis=(1, 3))
+    block_mean = np.divide(block_sum, block_count,
+                           out=np.full_like(block_sum, 255.0), where=block_count > 0)
+
+    mask = block_mean < (max_mean_threshold + mean_margin)
+    return _dilate(mask, dilation)